@@ -0,0 +1,253 @@
+# app/accounting.py
+# 每个请求的 token / 延迟 / 费用记账。
+#
+# - 每次 LLM 调用、embedding 调用都记一笔：prompt/completion tokens、耗时、估算费用
+# - 归属维度：endpoint（/chat、/chat/batch…）、route（qa/leave）、node（generate/extract…）、
+#   requester、user_role、model。endpoint/requester/user_role 由 main.py 在请求入口用
+#   attribution() 设置；route/node 从 langgraph 当前运行的节点信息里自动取
+# - 请求级延迟 / 错误数由 main.py 的 metering 中间件在响应体发完时用 record_request 记
+#   （流式响应要等流结束；状态码 >= 400、或者流中途发了 error 事件（mark_failed）都算错误）
+# - 按天聚合写进 redis hash，一次调用一个 pipeline；/metrics/cost 读出汇总
+#
+# token 数优先用供应商返回的 usage，拿不到再用 tiktoken 估算。
+
+import contextvars
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Iterator
+
+from langchain_core.embeddings import Embeddings
+
+from app.config import settings
+from app.db.redis_session import get_redis
+
+KEY_PREFIX = "acct:"
+KEY_TTL_SECONDS = 90 * 86400
+DIMENSIONS = ["endpoint", "route", "node", "requester", "user_role", "model", "provider"]
+
+# 单价：元 / 千 tokens（输入, 输出）。可用环境变量 LLM_PRICES 覆盖，格式同下（JSON）
+DEFAULT_PRICES: dict[str, list[float]] = {
+    "qwen-max": [0.0024, 0.0096],
+    "deepseek-chat": [0.002, 0.008],
+    "gpt-4o-mini": [0.0011, 0.0044],
+    "text-embedding-v2": [0.0007, 0.0],
+}
+
+_attribution: contextvars.ContextVar[dict] = contextvars.ContextVar("acct_attribution", default={})
+
+
+@lru_cache(maxsize=1)
+def _prices() -> dict[str, list[float]]:
+    prices = dict(DEFAULT_PRICES)
+    if settings.llm_prices:
+        try:
+            prices.update(json.loads(settings.llm_prices))
+        except Exception as e:
+            print(f"[accounting] bad LLM_PRICES: {e}")
+    return prices
+
+
+def cost_of(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    p_in, p_out = _prices().get(model, [0.0, 0.0])
+    return (prompt_tokens * p_in + completion_tokens * p_out) / 1000
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None  # 离线环境拿不到词表，用字符数估算
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _encoding()
+    if enc is not None:
+        return len(enc.encode(text))
+    return len(text)  # 中文大致 1 字 1 token
+
+
+def count_message_tokens(messages: Any) -> int:
+    if isinstance(messages, str):
+        return count_tokens(messages)
+    total = 0
+    for m in messages or []:
+        content = getattr(m, "content", m)
+        total += count_tokens(content if isinstance(content, str) else str(content)) + 4
+    return total
+
+
+# ---------- 归属 ----------
+
+@contextmanager
+def attribution(endpoint: str, **fields: Any) -> Iterator[dict]:
+    """在请求入口包一层：期间所有 LLM / embedding 调用都记到这个 endpoint 名下。
+    请求级延迟不在这里记（流式响应退出这里的时候还没开始发），见 record_request。"""
+    ctx = {"endpoint": endpoint, **{k: v for k, v in fields.items() if v}}
+    token = _attribution.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _attribution.reset(token)
+
+
+def annotate(**fields: Any) -> None:
+    """请求处理中途补充归属信息（例如解析完 body 才知道 requester / user_role）。"""
+    ctx = _attribution.get()
+    if ctx:
+        ctx.update({k: v for k, v in fields.items() if v})
+
+
+def mark_failed() -> None:
+    """响应已经以 200 开始（SSE 流）之后才出错：这个请求照样记成一次错误。"""
+    ctx = _attribution.get()
+    if ctx:
+        ctx["failed"] = True
+
+
+def _current_dims(model: str) -> dict[str, str]:
+    dims = {k: str(v) for k, v in _attribution.get().items() if k in DIMENSIONS}
+    dims["model"] = model
+    try:
+        from langgraph.config import get_config
+
+        meta = get_config().get("metadata") or {}
+        node = meta.get("langgraph_node")
+        ns = meta.get("langgraph_checkpoint_ns") or ""
+        route = ns.split(":", 1)[0] if ns else ""
+        if route and route != node:
+            dims["route"] = route
+            dims["node"] = f"{route}/{node}"
+        elif node:
+            dims["node"] = str(node)
+    except Exception:
+        pass  # 不在 langgraph 节点里（比如 /chat/batch 的批量 embedding）
+    return dims
+
+
+# ---------- 写入 ----------
+
+def _day() -> str:
+    return datetime.now().strftime("%Y%m%d")
+
+
+_write_paused_until = 0.0
+
+
+def _write(dims: dict[str, str], fields: dict[str, int]) -> None:
+    global _write_paused_until
+    if time.monotonic() < _write_paused_until:
+        return
+    try:
+        day = _day()
+        pipe = get_redis().pipeline(transaction=False)
+        for dim, value in dims.items():
+            key = f"{KEY_PREFIX}{day}:{dim}:{value}"
+            for f, v in fields.items():
+                pipe.hincrby(key, f, v)
+            pipe.expire(key, KEY_TTL_SECONDS)
+            pipe.sadd(f"{KEY_PREFIX}{day}:{dim}", value)
+            pipe.expire(f"{KEY_PREFIX}{day}:{dim}", KEY_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        # 记账失败不能影响业务；redis 挂了就暂停 30 秒，别让每次 LLM 调用都等连接超时
+        _write_paused_until = time.monotonic() + 30
+        print(f"[accounting] write failed: {e}")
+
+
+def record_usage(
+    kind: str,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    latency_s: float,
+    provider: str | None = None,
+) -> None:
+    if not settings.accounting_enabled:
+        return
+    dims = _current_dims(model)
+    if provider:
+        dims["provider"] = provider
+    _write(dims, {
+        f"{kind}_calls": 1,
+        "prompt_tokens": int(prompt_tokens),
+        "completion_tokens": int(completion_tokens),
+        "cost_micro": int(round(cost_of(model, prompt_tokens, completion_tokens) * 1e6)),  # 百万分之一元，方便 HINCRBY
+        f"{kind}_latency_ms": int(latency_s * 1000),
+    })
+
+
+def record_llm_response(provider: str, model: str, messages: Any, response: Any, latency_s: float) -> None:
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt = usage.get("input_tokens") or count_message_tokens(messages)
+    completion = usage.get("output_tokens") or count_tokens(str(getattr(response, "content", "") or ""))
+    record_usage("llm", model, prompt, completion, latency_s, provider=provider)
+
+
+def record_request(endpoint: str, latency_s: float, ok: bool) -> None:
+    if not settings.accounting_enabled:
+        return
+    _write({"endpoint": endpoint}, {
+        "requests": 1,
+        "errors": 0 if ok else 1,
+        "request_latency_ms": int(latency_s * 1000),
+    })
+
+
+class MeteredEmbeddings(Embeddings):
+    """包一层 embedding 模型，按输入文本估算 token 并记账。"""
+
+    def __init__(self, inner: Embeddings, model: str):
+        self.inner = inner
+        self.model = model
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        t0 = time.perf_counter()
+        out = self.inner.embed_documents(texts)
+        record_usage("embedding", self.model, sum(count_tokens(t) for t in texts), 0, time.perf_counter() - t0)
+        return out
+
+    def embed_query(self, text: str) -> list[float]:
+        t0 = time.perf_counter()
+        out = self.inner.embed_query(text)
+        record_usage("embedding", self.model, count_tokens(text), 0, time.perf_counter() - t0)
+        return out
+
+
+# ---------- 读取 ----------
+
+def summary(dimension: str = "endpoint", day: str | None = None) -> dict:
+    """某一天按某个维度的汇总：调用数、tokens、费用（元）、平均延迟。"""
+    day = day or _day()
+    r = get_redis()
+    values = sorted(r.smembers(f"{KEY_PREFIX}{day}:{dimension}"))
+    pipe = r.pipeline(transaction=False)
+    for v in values:
+        pipe.hgetall(f"{KEY_PREFIX}{day}:{dimension}:{v}")
+    rows = []
+    for v, raw in zip(values, pipe.execute()):
+        h = {k: int(x) for k, x in raw.items()}
+        row = {
+            dimension: v,
+            "llm_calls": h.get("llm_calls", 0),
+            "embedding_calls": h.get("embedding_calls", 0),
+            "prompt_tokens": h.get("prompt_tokens", 0),
+            "completion_tokens": h.get("completion_tokens", 0),
+            "cost": round(h.get("cost_micro", 0) / 1e6, 6),
+            "avg_llm_latency_ms": round(h.get("llm_latency_ms", 0) / h["llm_calls"], 1) if h.get("llm_calls") else None,
+        }
+        if h.get("requests"):
+            row["requests"] = h["requests"]
+            row["errors"] = h.get("errors", 0)
+            row["avg_request_latency_ms"] = round(h.get("request_latency_ms", 0) / h["requests"], 1)
+            row["cost_per_request"] = round(row["cost"] / h["requests"], 6)
+        rows.append(row)
+    rows.sort(key=lambda x: x["cost"], reverse=True)
+    return {"day": day, "dimension": dimension, "rows": rows}
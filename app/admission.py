@@ -0,0 +1,179 @@
+# app/admission.py
+# 准入控制：每条路由（qa / leave）、每个 LLM 供应商各一个并发池 + 有界等待队列。
+#
+# 以前 router_graph.invoke 来多少跑多少：一波 QA 流量把 LLM 配额打满，上游开始 429，
+# 请假流程也跟着排在后面等，所有请求一起变慢。
+# 现在：
+#   - 池里有空位直接进；没空位进队列等，最多等 admission_wait_s
+#   - 队列也满了（或等超时）立刻失败：AdmissionRejected -> 接口返回 503 + Retry-After，不再堆积
+#   - 路由池把 QA 的在途数量限制住，请假流程有自己的池，不会被 QA 挤掉；
+#     供应商池的并发上限 >= 各路由池之和时，QA 打满也不会占光供应商的并发
+# 池子的实时状态（在途、排队、放行 / 拒绝次数、等待时间分位数）从 /metrics/admission 导出。
+#
+# 池的大小：ADMISSION_POOLS（JSON）按池名覆盖，如 {"route:qa": [10, 20], "llm:deepseek": [4, 8]}，
+# 值是 [并发上限, 队列长度]，并发上限 0 表示不限制；没配的用下面 Settings 里的默认值。
+# 处理请求的都是线程（同步接口跑在线程池里、/chat/batch 用 to_thread），所以用线程锁实现。
+
+from __future__ import annotations
+
+import json
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator
+
+from app.config import settings
+
+
+class AdmissionRejected(RuntimeError):
+    def __init__(self, pool: str, reason: str, retry_after: int):
+        super().__init__(f"{pool}: {reason}")
+        self.pool = pool
+        self.reason = reason  # queue_full / wait_timeout
+        self.retry_after = retry_after
+
+
+class Slot:
+    """拿到的一个并发名额；release() 可以重复调用（流式接口在多个地方兜底释放）。"""
+
+    def __init__(self, pool: "Pool | None"):
+        self._pool = pool
+        self._started = time.monotonic()
+        self._released = pool is None
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._pool._release(time.monotonic() - self._started)
+
+
+class Pool:
+    def __init__(self, name: str, limit: int, queue_max: int, wait_s: float):
+        self.name = name
+        self.limit = limit
+        self.queue_max = queue_max
+        self.wait_s = wait_s
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._cond = threading.Condition()
+        self._waits: deque[float] = deque(maxlen=1000)
+        self._service: deque[float] = deque(maxlen=200)
+
+    def retry_after(self) -> int:
+        """按最近的平均处理时间估算排到的时间（秒，至少 1）。"""
+        svc = sum(self._service) / len(self._service) if self._service else 1.0
+        return max(1, math.ceil(svc * (self.waiting + 1) / max(1, self.limit)))
+
+    def acquire(self) -> Slot:
+        t0 = time.monotonic()
+        with self._cond:
+            if self.active >= self.limit:
+                if self.waiting >= self.queue_max:
+                    self.rejected += 1
+                    raise AdmissionRejected(self.name, "queue_full", self.retry_after())
+                self.waiting += 1
+                try:
+                    deadline = t0 + self.wait_s
+                    while self.active >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.timed_out += 1
+                            raise AdmissionRejected(self.name, "wait_timeout", self.retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+            self._waits.append(time.monotonic() - t0)
+        return Slot(self)
+
+    def _release(self, service_s: float) -> None:
+        with self._cond:
+            self.active -= 1
+            self._service.append(service_s)
+            self._cond.notify()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            active, waiting = self.active, self.waiting
+
+        def _pct(q: float) -> float | None:
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 1) if waits else None
+
+        return {
+            "limit": self.limit,
+            "queue_max": self.queue_max,
+            "active": active,
+            "queued": waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_p50_ms": _pct(0.5),
+            "wait_p95_ms": _pct(0.95),
+            "wait_max_ms": round(waits[-1] * 1000, 1) if waits else None,
+        }
+
+
+@lru_cache(maxsize=1)
+def _overrides() -> dict[str, list[int]]:
+    if not settings.admission_pools:
+        return {}
+    try:
+        return json.loads(settings.admission_pools)
+    except Exception as e:
+        print(f"[admission] bad ADMISSION_POOLS: {e}")
+        return {}
+
+
+def _defaults(name: str) -> tuple[int, int]:
+    if name == "route:qa":
+        return settings.admission_qa_concurrency, settings.admission_qa_queue
+    if name == "route:leave":
+        return settings.admission_leave_concurrency, settings.admission_leave_queue
+    if name.startswith("llm:"):
+        return settings.admission_llm_concurrency, settings.admission_llm_queue
+    return 0, 0
+
+
+_pools: dict[str, Pool | None] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name: str) -> Pool | None:
+    """按名字取池（第一次用到时创建）；关闭准入控制或并发上限为 0 时返回 None。"""
+    if not settings.admission_enabled:
+        return None
+    if name not in _pools:
+        with _pools_lock:
+            if name not in _pools:
+                limit, queue_max = _overrides().get(name) or _defaults(name)
+                _pools[name] = Pool(name, int(limit), int(queue_max), settings.admission_wait_s) if limit > 0 else None
+    return _pools[name]
+
+
+def acquire(name: str) -> Slot:
+    pool = get_pool(name)
+    return pool.acquire() if pool is not None else Slot(None)
+
+
+@contextmanager
+def admit(name: str) -> Iterator[None]:
+    slot = acquire(name)
+    try:
+        yield
+    finally:
+        slot.release()
+
+
+def snapshot() -> dict:
+    return {name: pool.snapshot() for name, pool in sorted(_pools.items()) if pool is not None}
@@ -9,25 +9,151 @@ class Settings(BaseModel):  # BaseModel后续这个类会转换为JSON/字典方
     deepseek_base_url: str = os.getenv("DEEPSEEK_BASE_URL", 'https://api.deepseek.com/v1')
     deepseek_api_key: str = os.getenv("DEEPSEEK_API_KEY", "sk-f359d11bb18e4d00b05b735d394f770e")
     deepseek_embedding_model_name: str = os.getenv("DEEPSEEK_MODEL_NAME", "deepseek_chat")
+    deepseek_chat_model: str = os.getenv("DEEPSEEK_CHAT_MODEL", "deepseek-chat")
 
 
     # qianwen
     qianwen_base_url: str = os.getenv("QIANWEN_BASE_URL", 'https://dashscope.aliyuncs.com/compatible-mode/v1')
     qianwen_api_key: str = os.getenv("QIANWEN_API_KEY", "sk-3eca7ef0c1b14bc19ef14cc1f1a1457b")
     qianwen_embedding_model_name: str = os.getenv("QIANWEN_EMBEDDING_MODEL_NAME", 'text-embedding-v2')
+    qianwen_chat_model: str = os.getenv("QIANWEN_CHAT_MODEL", "qwen-max")
 
 
     # chatgpt
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "sk-f359d11bb18e4d00b05b735d394f770e")
     model_name: str = os.getenv("MODEL_NAME", "gpt-4o-mini")
+    openai_base_url: str = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 
+    # LLM 供应商路由（app/llm_router.py）：按顺序列出启用的供应商
+    llm_providers: str = os.getenv("LLM_PROVIDERS", "qianwen,deepseek")
+    llm_timeout_s: float = float(os.getenv("LLM_TIMEOUT_S", "60"))
+    llm_stats_window: int = int(os.getenv("LLM_STATS_WINDOW", "100"))     # 滚动统计窗口（次）
+    llm_min_samples: int = int(os.getenv("LLM_MIN_SAMPLES", "5"))         # 样本数够了才按延迟排序/对冲
+    llm_hedge_enabled: bool = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in {"1", "true", "yes"}
+    llm_breaker_failures: int = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+    llm_breaker_cooldown_s: float = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30"))
 
+    # 准入控制（app/admission.py）：每条路由 / 每个 LLM 供应商一个并发池 + 有界队列，满了直接 503
+    # 供应商池的并发上限最好 >= 各路由池之和，QA 打满时请假流程仍能拿到供应商并发
+    admission_enabled: bool = os.getenv("ADMISSION_ENABLED", "true").lower() in {"1", "true", "yes"}
+    admission_wait_s: float = float(os.getenv("ADMISSION_WAIT_S", "10"))
+    admission_qa_concurrency: int = int(os.getenv("ADMISSION_QA_CONCURRENCY", "10"))
+    admission_qa_queue: int = int(os.getenv("ADMISSION_QA_QUEUE", "20"))
+    admission_leave_concurrency: int = int(os.getenv("ADMISSION_LEAVE_CONCURRENCY", "6"))
+    admission_leave_queue: int = int(os.getenv("ADMISSION_LEAVE_QUEUE", "12"))
+    admission_llm_concurrency: int = int(os.getenv("ADMISSION_LLM_CONCURRENCY", "16"))
+    admission_llm_queue: int = int(os.getenv("ADMISSION_LLM_QUEUE", "32"))
+    admission_pools: str = os.getenv("ADMISSION_POOLS", "")  # JSON：{"池名": [并发上限, 队列长度]}
 
-    chroma_dir: str = os.getenv("CHROMA_DIR", "./data/chroma")
-    chroma_host: str = os.getenv("CHROMA_HOST", "localhost")
-    chroma_port: int = int(os.getenv("CHROMA_PORT", "8000"))
-    collection_name: str = os.getenv("COLLECTION_NAME", "knowledge_base")
+    # 相同问题的请求合并（app/singleflight.py）：归一化问题 + 可见范围相同的并发 QA 共用一次检索 + 生成；
+    # singleflight_redis 打开时跨 worker 通过 redis 锁 / pub-sub 合并，leader 的结果保留 singleflight_result_ttl_s 秒
+    singleflight_enabled: bool = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() in {"1", "true", "yes"}
+    singleflight_redis: bool = os.getenv("SINGLEFLIGHT_REDIS", "true").lower() in {"1", "true", "yes"}
+    singleflight_wait_s: float = float(os.getenv("SINGLEFLIGHT_WAIT_S", "60"))
+    singleflight_result_ttl_s: float = float(os.getenv("SINGLEFLIGHT_RESULT_TTL_S", "5"))
+
+    # 预生成的 FAQ 答案索引（app/rag/faq.py，python -m app.rag.faq build 离线生成）：
+    # 问题 embedding 余弦相似度 >= faq_min_score 时直接返回预生成的答案
+    faq_enabled: bool = os.getenv("FAQ_ENABLED", "true").lower() in {"1", "true", "yes"}
+    faq_min_score: float = float(os.getenv("FAQ_MIN_SCORE", "0.92"))
+    faq_questions_file: str = os.getenv("FAQ_QUESTIONS_FILE", "data/faq/questions.txt")
+    faq_session_min_count: int = int(os.getenv("FAQ_SESSION_MIN_COUNT", "3"))
+    faq_max_questions: int = int(os.getenv("FAQ_MAX_QUESTIONS", "100"))
+
+    # Chroma 用本地 PersistentClient（app/chroma_db），collection 名由 app/rag/vectorstore.py 管理；
+    # 以前的 CHROMA_DIR / CHROMA_HOST / CHROMA_PORT / COLLECTION_NAME 已不再读取（设了的话第一次连 Chroma 时打一条警告）
+
+    # 蓝绿 collection（app/rag/vectorstore.py）：版本指针本地缓存秒数、旧版本保留多久再删
+    corpus_pointer_ttl_s: float = float(os.getenv("CORPUS_POINTER_TTL_S", "5"))
+    corpus_gc_grace_s: float = float(os.getenv("CORPUS_GC_GRACE_S", "600"))
+    # /reindex 期间 /ingest、PUT/DELETE /docs 直接 409；reindex 开始前最多等多久让正在进行的写入结束；
+    # 两个标记在 redis 里的过期时间只是进程崩溃时的兜底
+    reindex_writer_wait_s: float = float(os.getenv("REINDEX_WRITER_WAIT_S", "60"))
+    reindex_lock_ttl_s: int = int(os.getenv("REINDEX_LOCK_TTL_S", "3600"))
+    corpus_writer_ttl_s: int = int(os.getenv("CORPUS_WRITER_TTL_S", "600"))
+    # /reindex 新建的版本是否按 visibility 分区存放（每个可见性一个 collection）
+    vector_partitioning: bool = os.getenv("VECTOR_PARTITIONING", "true").lower() in {"1", "true", "yes"}
+    # 量化向量索引（app/rag/quantized.py）：none / float16 / int8；
+    # quant_rescore：先取 k*N 个候选再用 float32 原向量重打分，0 表示不重打分
+    vector_quantization: str = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+    quant_rescore: int = int(os.getenv("QUANT_RESCORE", "4"))
+    # 小块检索、大块作答（app/rag/parent_store.py）：命中子 chunk 后换成所在的父段落（docx 小节 / PDF 页）；
+    # parent_max：最多给大模型几个父段落，parent_max_chars：单个父段落最多截取多少字
+    parent_retrieval: bool = os.getenv("PARENT_RETRIEVAL", "true").lower() in {"1", "true", "yes"}
+    parent_store_path: str = os.getenv("PARENT_STORE_PATH", "app/parent_store/parents.sqlite3")
+    parent_max: int = int(os.getenv("PARENT_MAX", "3"))
+    parent_max_chars: int = int(os.getenv("PARENT_MAX_CHARS", "1200"))
+
+    # 文档级摘要索引（app/rag/doc_summary.py）：入库时每个源文件生成一条摘要（llm / extractive）并 embed，
+    # 检索先按摘要挑 doc_summary_top_docs 个文档，再只在它们的 chunk 里找
+    doc_summary_retrieval: bool = os.getenv("DOC_SUMMARY_RETRIEVAL", "true").lower() in {"1", "true", "yes"}
+    doc_summary_mode: str = os.getenv("DOC_SUMMARY_MODE", "llm").lower()
+    doc_summary_top_docs: int = int(os.getenv("DOC_SUMMARY_TOP_DOCS", "5"))
+    doc_summary_chars: int = int(os.getenv("DOC_SUMMARY_CHARS", "200"))
+    doc_summary_input_chars: int = int(os.getenv("DOC_SUMMARY_INPUT_CHARS", "3000"))
+    doc_summary_path: str = os.getenv("DOC_SUMMARY_PATH", "app/doc_summaries/summaries.sqlite3")
+
+    # embedding 后端（app/rag/local_embeddings.py）：dashscope（远程 text-embedding-v2）/ hashing（本地字符 n-gram 哈希 TF-IDF）
+    # / onnx（本地 ONNX 模型目录，含 model.onnx + tokenizer.json）。换后端要 /reindex
+    embedding_backend: str = os.getenv("EMBEDDING_BACKEND", "dashscope").lower()
+    local_embedding_dim: int = int(os.getenv("LOCAL_EMBEDDING_DIM", "1024"))
+    local_embedding_ngrams: str = os.getenv("LOCAL_EMBEDDING_NGRAMS", "1,2,3")
+    local_embedding_idf_path: str = os.getenv("LOCAL_EMBEDDING_IDF_PATH", "app/local_embeddings/idf.npy")
+    local_embedding_batch_size: int = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "64"))
+    local_embedding_threads: int = int(os.getenv("LOCAL_EMBEDDING_THREADS", "4"))
+    onnx_embedding_model: str = os.getenv("ONNX_EMBEDDING_MODEL", "")
+    onnx_embedding_pooling: str = os.getenv("ONNX_EMBEDDING_POOLING", "cls").lower()  # bge 系列用 cls
+    onnx_query_instruction: str = os.getenv("ONNX_QUERY_INSTRUCTION", "")
+
+    # redis
+    redis_host: str = os.getenv("REDIS_HOST", "127.0.0.1")
+    redis_port: int = int(os.getenv("REDIS_PORT", "6379"))
+    redis_db: int = int(os.getenv("REDIS_DB", "0"))
+
+    # 请假流程结构化抽取（SLOT/TIME 提示词）的 LLM 结果缓存
+    llm_cache_enabled: bool = os.getenv("LLM_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+    llm_cache_ttl: int = int(os.getenv("LLM_CACHE_TTL", "86400"))
+
+    # token / 费用记账（app/accounting.py），LLM_PRICES 为 JSON：{"model": [输入价, 输出价]}（元/千 tokens）
+    accounting_enabled: bool = os.getenv("ACCOUNTING_ENABLED", "true").lower() in {"1", "true", "yes"}
+    llm_prices: str = os.getenv("LLM_PRICES", "")
+
+    # 工作日历（app/workflows/leave/calendar.py）：节假日 / 调休表来源 file（CSV）或 mysql（holidays 表）
+    holiday_source: str = os.getenv("HOLIDAY_SOURCE", "file")
+    holiday_file: str = os.getenv("HOLIDAY_FILE", "data/calendar/holidays.csv")
+
+    # 多轮问答的会话记忆（app/rag/memory.py）：原样保留最近 memory_max_turns 轮，更早的折叠进滚动摘要；
+    # 摘要 + 最近几轮合计不超过 memory_token_budget 个 token，单轮回答最多记 memory_answer_chars 个字
+    memory_enabled: bool = os.getenv("MEMORY_ENABLED", "true").lower() in {"1", "true", "yes"}
+    memory_max_turns: int = int(os.getenv("MEMORY_MAX_TURNS", "4"))
+    memory_token_budget: int = int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))
+    memory_summary_tokens: int = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
+    memory_answer_chars: int = int(os.getenv("MEMORY_ANSWER_CHARS", "150"))
+
+    # 单请求剖析（app/profiling.py）：X-Profile 头 / ?profile= 带上 profile_token 触发（没配 token 时不认），
+    # 或按 profile_sample_rate 抽样；profile_mode：cprofile / sample
+    profile_token: str = os.getenv("PROFILE_TOKEN", "")
+    profile_sample_rate: float = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    profile_mode: str = os.getenv("PROFILE_MODE", "cprofile").lower()
+    profile_sample_interval_ms: float = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+    profile_dir: str = os.getenv("PROFILE_DIR", "app/profiles")
+    profile_keep: int = int(os.getenv("PROFILE_KEEP", "200"))
+
+    # 启动时是否预热（预先建好 redis/mysql/chroma 连接和 LLM 客户端）
+    warmup_on_start: bool = os.getenv("WARMUP_ON_START", "false").lower() in {"1", "true", "yes"}
+    # 启动时建 leave_requests 的联合索引（keyset 分页 / 待审批队列 / 冲突检测靠它们，已存在就跳过）
+    mysql_ensure_indexes: bool = os.getenv("MYSQL_ENSURE_INDEXES", "true").lower() in {"1", "true", "yes"}
     chunk_size: int = int(os.getenv("CHUNK_SIZE", "200"))
     chunk_overlap: int = int(os.getenv("CHUNK_OVERLAP", "60"))
 
+    # 入库近似去重（SimHash），汉明距离 <= dedup_max_distance 视为重复
+    dedup_enabled: bool = os.getenv("DEDUP_ENABLED", "true").lower() in {"1", "true", "yes"}
+    dedup_max_distance: int = int(os.getenv("DEDUP_MAX_DISTANCE", "8"))
+    # 被跳过的近似重复 chunk 记下它折叠进了哪篇文档（app/ingestion/dedup.py），原文档被删 / 替换时据此把它们重新入库
+    dedup_refs_path: str = os.getenv("DEDUP_REFS_PATH", "app/dedup/refs.sqlite3")
+
+    # /chat/batch：同时跑多少个问题、一次最多收多少个问题
+    batch_max_concurrency: int = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+    batch_max_items: int = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
 settings = Settings()
@@ -0,0 +1,67 @@
+# app/db/llm_cache.py
+# 结构化抽取类 LLM 调用的 redis 缓存。
+#
+# 请假流程里用户经常把同一句话重发一遍（确认环节改一改又发回来），
+# SLOT_USER / TIME_USER 这类抽取提示词对同样的输入应当给出同样的 JSON，
+# 没必要每次都去调大模型。
+#
+# key = 抽取类型 + 提示词版本 + 归一化后的文本 (+ 额外上下文，比如时间解析用的“今天日期”)
+# 提示词一改，版本号（提示词内容的哈希）就变，旧缓存自然失效。
+
+import hashlib
+import json
+import re
+from typing import Any, Callable, Dict
+
+from app.config import settings
+from app.db.redis_session import get_redis
+
+KEY_PREFIX = "llmcache:"
+
+_WS = re.compile(r"\s+")
+
+
+def prompt_version(*parts: str) -> str:
+    """用提示词内容的哈希做版本号。"""
+    return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()[:8]
+
+
+def normalize_text(text: str) -> str:
+    return _WS.sub(" ", (text or "").strip()).lower()
+
+
+def cache_key(kind: str, version: str, text: str, extra: str = "") -> str:
+    digest = hashlib.sha1(f"{normalize_text(text)}\x00{extra}".encode("utf-8")).hexdigest()
+    return f"{KEY_PREFIX}{kind}:{version}:{digest}"
+
+
+def cached_json(
+    kind: str,
+    version: str,
+    text: str,
+    compute: Callable[[], Dict[str, Any]],
+    extra: str = "",
+) -> Dict[str, Any]:
+    """先查缓存，没命中再调用 compute()（真正的 LLM 调用）并写回。
+
+    - 只缓存非空结果：解析失败的空 dict 下次还会重试
+    - redis 不可用时直接走 LLM，缓存只是加速，不能影响主流程
+    """
+    if not settings.llm_cache_enabled:
+        return compute()
+
+    key = cache_key(kind, version, text, extra)
+    try:
+        hit = get_redis().get(key)
+        if hit:
+            return json.loads(hit)
+    except Exception as e:
+        print(f"[llm_cache] get failed: {e}")
+
+    data = compute()
+    if data:
+        try:
+            get_redis().setex(key, settings.llm_cache_ttl, json.dumps(data, ensure_ascii=False))
+        except Exception as e:
+            print(f"[llm_cache] set failed: {e}")
+    return data
@@ -1,6 +1,9 @@
 import os
+import json
+import base64
 import pymysql
 from contextlib import contextmanager
+from typing import Callable
 
 MYSQL_HOST = os.getenv("MYSQL_HOST", "127.0.0.1")
 MYSQL_PORT = int(os.getenv("MYSQL_PORT", "3306"))
@@ -23,14 +26,92 @@ def get_conn():
         conn.close()
 
 
-def get_leave_balance(requester: str) -> dict | None:
+@contextmanager
+def transaction():
+    """显式事务：with 块正常结束就 COMMIT，抛异常就 ROLLBACK。"""
+    with get_conn() as conn:
+        conn.begin()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+CONFLICT_FIELDS = ("leave_id", "start_time", "end_time", "status")
+BALANCE_FIELDS = ("annual_days", "sick_days", "personal_days")
+
+
+def _conflict_query(
+    requester: str,
+    start_time: str,
+    end_time: str,
+    exclude_leave_id: str | None,
+    limit: int,
+    select: str | None = None,
+) -> tuple[str, list]:
+    """时间冲突查询。select：SELECT 列表，默认就是 CONFLICT_FIELDS（UNION 时由调用方按同一组字段补齐列）。"""
+    sql = (
+        f"SELECT {select or ', '.join(CONFLICT_FIELDS)} FROM leave_requests "
+        "WHERE requester=%s AND start_time < %s AND end_time > %s AND status IN ('PENDING','APPROVED') "
+    )
+    params: list = [requester, end_time, start_time]
+    if exclude_leave_id:
+        sql += "AND leave_id <> %s "
+        params.append(exclude_leave_id)
+    sql += "ORDER BY start_time LIMIT %s"
+    params.append(limit)
+    return sql, params
+
+
+def get_balance_and_conflicts(
+    requester: str,
+    start_time: str | None,
+    end_time: str | None,
+    exclude_leave_id: str | None = None,
+    limit: int = 10,
+) -> tuple[dict | None, list[dict]]:
+    """校验用：一次往返同时拿到余额和时间重叠的 PENDING/APPROVED 请假单。
+
+    两个查询用 UNION ALL 拼成一条 SQL（列对齐，用 kind 区分），两边的列都由 CONFLICT_FIELDS / BALANCE_FIELDS 生成。
+    重叠条件：已有.start_time < 新.end_time AND 已有.end_time > 新.start_time（首尾相接不算冲突）。
+    exclude_leave_id：修改请假时排除自己。
+    """
+    balance_cols = ", ".join([f"NULL AS {f}" for f in CONFLICT_FIELDS] + list(BALANCE_FIELDS))
+    sql = f"(SELECT 'balance' AS kind, {balance_cols} FROM leave_balances WHERE requester=%s)"
+    params: list = [requester]
+    if start_time and end_time:
+        conflict_cols = ", ".join(["'conflict'", *CONFLICT_FIELDS] + ["NULL"] * len(BALANCE_FIELDS))
+        c_sql, c_params = _conflict_query(requester, start_time, end_time, exclude_leave_id, limit, select=conflict_cols)
+        sql += f" UNION ALL ({c_sql})"
+        params += c_params
+
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT annual_days, sick_days, personal_days FROM leave_balances WHERE requester=%s",
-                (requester,)
-            )
-            return cur.fetchone()
+            cur.execute(sql, tuple(params))
+            rows = cur.fetchall()
+
+    balance = None
+    conflicts = []
+    for r in rows:
+        if r["kind"] == "balance":
+            balance = {k: r[k] for k in BALANCE_FIELDS}
+        else:
+            conflicts.append({k: r[k] for k in CONFLICT_FIELDS})
+    return balance, conflicts
+
+
+def get_holiday_overrides() -> dict:
+    """节假日 / 调休表：{date: 是否上班}。
+
+    holidays(day DATE PRIMARY KEY, is_workday TINYINT NOT NULL, name VARCHAR(32))
+    is_workday = 0 放假，1 调休上班。
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT day, is_workday FROM holidays")
+            return {r["day"]: bool(r["is_workday"]) for r in cur.fetchall()}
 
 
 def insert_leave_request(req: dict) -> str:
@@ -71,45 +152,207 @@ def cancel_leave_request(leave_id: str) -> bool:
             return cur.rowcount > 0
 
 
-def get_recent_leave_requests(requester: str, limit: int = 5) -> list[dict]:
-    limit = max(1, min(int(limit), 20))  # 我们查询的时候最多一次查询20条
+# ========= 分页（keyset） =========
+# 不用 OFFSET：OFFSET 越往后越慢（要先扫过前面所有行）。
+# keyset 分页记住上一页最后一行的排序键，下一页从它后面接着取，配合下面的联合索引每页都是 O(page)。
+
+LEAVE_INDEX_DDL = [
+    # 员工历史：WHERE requester=? AND id<? ORDER BY id DESC
+    "CREATE INDEX idx_leave_requester_id ON leave_requests (requester, id)",
+    # HR 待审批队列（按类型筛）：WHERE status='PENDING' AND leave_type=? AND start_time 范围 ORDER BY start_time, id
+    "CREATE INDEX idx_leave_status_type_start ON leave_requests (status, leave_type, start_time, id)",
+    # HR 待审批队列（不筛类型）
+    "CREATE INDEX idx_leave_status_start ON leave_requests (status, start_time, id)",
+    # 时间冲突检测：WHERE requester=? AND start_time < 新结束 AND end_time > 新开始
+    # start_time 走范围扫描，end_time 在索引里直接过滤（ICP），只有真正重叠的行才回表看 status
+    "CREATE INDEX idx_leave_requester_start_end ON leave_requests (requester, start_time, end_time)",
+]
+
+
+def ensure_leave_indexes() -> list[str]:
+    """建索引（已存在就跳过）。MySQL 没有 CREATE INDEX IF NOT EXISTS，只能吃掉 1061 错误。
+
+    服务启动时（lifespan，mysql_ensure_indexes 打开时）调一次；也可以手动跑 python -m app.db.mysql。
+    """
+    created = []
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT leave_id, leave_type, start_time, end_time, duration_days, status, reason, created_at "
-                "FROM leave_requests WHERE requester=%s "
-                "ORDER BY id DESC LIMIT %s",
-                (requester, limit),
-            )
-            return cur.fetchall()
+            for ddl in LEAVE_INDEX_DDL:
+                try:
+                    cur.execute(ddl)
+                    created.append(ddl)
+                except pymysql.err.OperationalError as e:
+                    if e.args and e.args[0] == 1061:  # Duplicate key name
+                        continue
+                    raise
+    return created
 
 
-def update_leave_request(leave_id: str, fields: dict) -> bool:
-    """
-    Only update PENDING requests.
-    fields can include: leave_type, start_time, end_time, duration_days, reason
+def _encode_cursor(values: list) -> str:
+    raw = json.dumps(values, default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor: str | None) -> list | None:
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+def get_leave_history_page(requester: str, cursor: str | None = None, limit: int = 20) -> tuple[list[dict], str | None]:
+    """员工请假历史，新的在前。返回 (本页记录, 下一页 cursor)；没有更多时 cursor 为 None。"""
+    limit = max(1, min(int(limit), 100))
+    after = _decode_cursor(cursor)
+    sql = (
+        "SELECT id, leave_id, leave_type, start_time, end_time, duration_days, status, reason, created_at "
+        "FROM leave_requests WHERE requester=%s "
+    )
+    params: list = [requester]
+    if after:
+        sql += "AND id < %s "
+        params.append(int(after[0]))
+    sql += "ORDER BY id DESC LIMIT %s"
+    params.append(limit + 1)  # 多取一条判断还有没有下一页
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, tuple(params))
+            rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor([rows[-1]["id"]])
+    return rows, next_cursor
+
+
+def get_pending_leave_requests(
+    leave_type: str | None = None,
+    start_from: str | None = None,
+    start_to: str | None = None,
+    cursor: str | None = None,
+    limit: int = 20,
+) -> tuple[list[dict], str | None]:
+    """HR/Admin 待审批队列，按开始时间从早到晚。
+
+    leave_type / start_from / start_to 都可选；start_* 是 'YYYY-MM-DD[ HH:MM]'，左闭右开。
     """
-    allowed = {"leave_type", "start_time", "end_time", "duration_days", "reason"}
-    sets = []  # sets里放的是过滤出来的能改的那些列的名字
-    params = []  # params里放的sets对应的那些列的值
-    for k, v in fields.items():
-        if k in allowed and v is not None:
-            sets.append(f"{k}=%s")  # sets=['leave_type=%s', 'end_time=%s']
-            params.append(v)  # params=['年假', 'xx年月日']
-
-    if not sets:
-        return False
-
-    params.extend([leave_id])
+    limit = max(1, min(int(limit), 100))
+    after = _decode_cursor(cursor)
     sql = (
-        "UPDATE leave_requests SET " + ", ".join(sets) +
-        " WHERE leave_id=%s AND status='PENDING'"
+        "SELECT id, leave_id, requester, leave_type, start_time, end_time, duration_days, reason, created_at "
+        "FROM leave_requests WHERE status='PENDING' "
     )
+    params: list = []
+    if leave_type:
+        sql += "AND leave_type=%s "
+        params.append(leave_type)
+    if start_from:
+        sql += "AND start_time >= %s "
+        params.append(start_from)
+    if start_to:
+        sql += "AND start_time < %s "
+        params.append(start_to)
+    if after:
+        # (start_time, id) > (上一页最后一行)；展开写，MySQL 才能用上索引的范围扫描
+        sql += "AND (start_time > %s OR (start_time = %s AND id > %s)) "
+        params.extend([after[0], after[0], int(after[1])])
+    sql += "ORDER BY start_time ASC, id ASC LIMIT %s"
+    params.append(limit + 1)
 
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, tuple(params))
-            return cur.rowcount > 0
+            rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode_cursor([str(last["start_time"]), last["id"]])
+    return rows, next_cursor
+
+
+MODIFIABLE_FIELDS = ("leave_type", "start_time", "end_time", "duration_days", "reason")
+
+
+def modify_leave_request(
+    leave_id: str,
+    changes: dict,
+    validate: Callable[[dict, dict | None, list[dict]], tuple[list[str], list[str]]],
+) -> dict:
+    """事务内修改请假单：锁行 -> 同事务读余额 -> 校验 -> 更新 -> 提交。
+
+    changes：要改的字段（None 表示不改），LLM 抽取要在调用前做完，别在持锁期间调大模型。
+    validate(new_req, balance, conflicts) -> (missing, violations)，可以往 new_req 里写 duration_days。
+
+    一条连接、三条语句（锁行并带出余额 / 查时间冲突 / UPDATE），锁住之后并发的审批、取消要等本事务结束。
+    返回 {"ok": True, "req": 修改后的单}，或者 {"ok": False, "step": 失败步骤, "message": ...}，
+    step：lock（单不存在）/ status（不是 PENDING）/ validate / update / db
+    只有数据库错误（pymysql.MySQLError）算 db；validate 回调里的异常、代码错误照常抛出，不伪装成数据库故障。
+    """
+    step = "lock"
+    try:
+        with transaction() as conn:
+            with conn.cursor() as cur:
+                # 1) 锁行，顺带把申请人的余额读出来（余额行也一起锁住，防止同时扣减）
+                cur.execute(
+                    "SELECT r.leave_id, r.requester, r.leave_type, r.start_time, r.end_time, r.reason, r.status, "
+                    "b.annual_days, b.sick_days, b.personal_days "
+                    "FROM leave_requests r LEFT JOIN leave_balances b ON b.requester = r.requester "
+                    "WHERE r.leave_id=%s FOR UPDATE",
+                    (leave_id,),
+                )
+                old = cur.fetchone()
+                if not old:
+                    return {"ok": False, "step": step, "message": f"未找到编号为 {leave_id} 的请假申请。"}
+
+                step = "status"
+                if old["status"] != "PENDING":
+                    return {"ok": False, "step": step, "message": f"{leave_id} 不是待审批状态，无法修改（当前：{old['status']}）。"}
+
+                balance = None
+                if old["annual_days"] is not None:
+                    balance = {k: old[k] for k in BALANCE_FIELDS}
+                new_req = {
+                    "leave_type": old["leave_type"],
+                    "start_time": old["start_time"].strftime("%Y-%m-%d %H:%M"),
+                    "end_time": old["end_time"].strftime("%Y-%m-%d %H:%M"),
+                    "reason": old.get("reason"),
+                    "requester": old["requester"],
+                }
+                new_req.update({k: v for k, v in changes.items() if v is not None})
+
+                # 2) 时间冲突（排除自己）+ 规则校验
+                step = "validate"
+                c_sql, c_params = _conflict_query(
+                    old["requester"], new_req["start_time"], new_req["end_time"], leave_id, 10
+                )
+                cur.execute(c_sql, tuple(c_params))
+                missing, violations = validate(new_req, balance, cur.fetchall())
+                if missing or violations:
+                    tips = []
+                    if missing:
+                        tips.append("缺少信息：" + "、".join(missing))
+                    if violations:
+                        tips.append("规则问题：" + "；".join(violations))
+                    return {"ok": False, "step": step, "message": "；".join(tips) + "。请重新描述修改内容。"}
+
+                # 3) 更新；行已锁住且确认是 PENDING，并发的审批 / 取消只能排在本事务之后
+                step = "update"
+                fields = [k for k in MODIFIABLE_FIELDS if new_req.get(k) is not None]
+                cur.execute(
+                    "UPDATE leave_requests SET " + ", ".join(f"{k}=%s" for k in fields) +
+                    " WHERE leave_id=%s AND status='PENDING'",
+                    (*[new_req[k] for k in fields], leave_id),
+                )
+        return {"ok": True, "req": new_req}
+    except pymysql.MySQLError as e:
+        return {"ok": False, "step": "db", "message": f"修改失败（{step} 阶段数据库错误）：{e}"}
+
 
 def approve_leave_request(leave_id: str, approver: str) -> bool:
     with get_conn() as conn:
@@ -131,4 +374,93 @@ def reject_leave_request(leave_id: str, approver: str, reason: str | None = None
                 "WHERE leave_id=%s AND status='PENDING'",
                 (reason, leave_id),
             )
-            return cur.rowcount > 0
\ No newline at end of file
+            return cur.rowcount > 0
+
+
+BULK_BATCH_SIZE = 500
+
+
+def bulk_review_leave_requests(
+    decision: str,
+    approver: str,
+    leave_ids: list[str] | None = None,
+    leave_type: str | None = None,
+    start_from: str | None = None,
+    start_to: str | None = None,
+    reason: str | None = None,
+    max_items: int = 1000,
+) -> dict[str, str]:
+    """批量审批 / 驳回，一个事务内完成。
+
+    decision: "APPROVED" / "REJECTED"
+    leave_ids 和筛选条件（leave_type / start_from / start_to）二选一；按筛选时只处理 PENDING 的单。
+    和单条的 approve/reject 一样只改 PENDING 状态的单。
+    返回每个单号的结果：APPROVED / REJECTED（已更新）、not_found、not_pending:<当前状态>
+    """
+    if decision not in {"APPROVED", "REJECTED"}:
+        raise ValueError("decision must be APPROVED or REJECTED")
+
+    outcomes: dict[str, str] = {}
+    with transaction() as conn:
+        with conn.cursor() as cur:
+            if leave_ids:
+                ids = list(dict.fromkeys(leave_ids))[:max_items]  # 去重并保持顺序
+                for i in range(0, len(ids), BULK_BATCH_SIZE):
+                    batch = ids[i:i + BULK_BATCH_SIZE]
+                    marks = ",".join(["%s"] * len(batch))
+                    # 先锁住这些行拿到当前状态，保证下面的 UPDATE 和报告的结果一致
+                    cur.execute(
+                        f"SELECT leave_id, status FROM leave_requests WHERE leave_id IN ({marks}) FOR UPDATE",
+                        tuple(batch),
+                    )
+                    status = {row["leave_id"]: row["status"] for row in cur.fetchall()}
+                    _bulk_update(cur, [lid for lid in batch if status.get(lid) == "PENDING"], decision, reason)
+                    for lid in batch:
+                        if lid not in status:
+                            outcomes[lid] = "not_found"
+                        elif status[lid] != "PENDING":
+                            outcomes[lid] = f"not_pending:{status[lid]}"
+                        else:
+                            outcomes[lid] = decision
+            else:
+                sql = "SELECT leave_id FROM leave_requests WHERE status='PENDING' "
+                params: list = []
+                if leave_type:
+                    sql += "AND leave_type=%s "
+                    params.append(leave_type)
+                if start_from:
+                    sql += "AND start_time >= %s "
+                    params.append(start_from)
+                if start_to:
+                    sql += "AND start_time < %s "
+                    params.append(start_to)
+                sql += "ORDER BY start_time ASC, id ASC LIMIT %s FOR UPDATE"
+                params.append(max_items)
+                cur.execute(sql, tuple(params))
+                ids = [row["leave_id"] for row in cur.fetchall()]
+                for i in range(0, len(ids), BULK_BATCH_SIZE):
+                    _bulk_update(cur, ids[i:i + BULK_BATCH_SIZE], decision, reason)
+                outcomes = {lid: decision for lid in ids}
+    return outcomes
+
+
+def _bulk_update(cur, ids: list[str], decision: str, reason: str | None) -> None:
+    if not ids:
+        return
+    marks = ",".join(["%s"] * len(ids))
+    if decision == "REJECTED":
+        cur.execute(
+            f"UPDATE leave_requests SET status='REJECTED', reason=COALESCE(%s, reason) "
+            f"WHERE leave_id IN ({marks}) AND status='PENDING'",
+            (reason, *ids),
+        )
+    else:
+        cur.execute(
+            f"UPDATE leave_requests SET status='APPROVED' WHERE leave_id IN ({marks}) AND status='PENDING'",
+            tuple(ids),
+        )
+
+
+# 建 keyset 分页 / 冲突检测依赖的索引：python -m app.db.mysql
+if __name__ == "__main__":
+    print(ensure_leave_indexes() or "all leave indexes already exist")
@@ -3,16 +3,31 @@ import json
 import redis
 from typing import Any
 
-r = redis.Redis(
-    host="127.0.0.1",
-    port=6379,
-    decode_responses=True,
-)
+from app.config import settings
+
+_client: redis.Redis | None = None
+
+
+def get_redis() -> redis.Redis:
+    """懒加载的 redis 客户端：import 时不连接，第一次用到才建连接池。
+
+    redis 短暂不可用时服务仍能正常启动，/readyz 会报告它没就绪。
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=settings.redis_db,
+            decode_responses=True,
+            socket_connect_timeout=2,
+        )
+    return _client
 
 TTL_SECONDS = 604800  # 键多久会自动过期，此处是7天
 
 
-DROP_KEYS = {"docs", "messages", "chat_history", "retrieved_docs"}
+DROP_KEYS = {"docs", "messages", "chat_history", "retrieved_docs", "prefetched"}
 # 这是一个集合，集合中放的都是后面要存入redis的时候一些不要的键
 
 
@@ -25,15 +40,18 @@ def _safe_dumps(obj: Any) -> str:
 
 
 def load_session(session_id: str) -> dict | None:
-    s = r.get(session_id)  # 从redis中读取session_id这个键对应的值
+    s = get_redis().get(session_id)  # 从redis中读取session_id这个键对应的值
     return json.loads(s) if s else None
 
 
 def save_session(session_id: str, state: dict) -> None:
     safe_state = {k: v for k, v in state.items() if k not in DROP_KEYS}
     # 这一行其实是在过滤，去掉一些不想要的键值对，留下想要的存入redis
-    r.setex(session_id, TTL_SECONDS, _safe_dumps(safe_state))
+    get_redis().setex(session_id, TTL_SECONDS, _safe_dumps(safe_state))
     # setex(键，过期时间，值)
 
-save_session('s1', {'NAME':'TOM'})
-print(load_session('s1'))
\ No newline at end of file
+
+# 测试
+if __name__ == "__main__":
+    save_session('s1', {'NAME':'TOM'})
+    print(load_session('s1'))
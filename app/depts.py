@@ -15,34 +15,36 @@
 
 
 # 下面是针对deepseek和千问嵌入式模型的代码
-from langchain_openai import ChatOpenAI
-from langchain_community.embeddings import DashScopeEmbeddings
+# langchain_openai 导入要 1.5 秒以上，放到函数里，第一次调用时才加载
 from app.config import settings
 from app.rag.vectorstore import get_vectorstore
-from langchain_openai import OpenAIEmbeddings
 
 
 def get_llm():
-    return ChatOpenAI(
+    # 以前这里写死 qwen-max，换 deepseek 要改注释掉的代码；
+    # 现在由 LLMRouter 按 LLM_PROVIDERS 在千问 / deepseek / openai 之间按延迟和健康状况选路
+    from app.llm_router import get_router
 
-        # deepseek
-        # base_url=settings.deepseek_base_url,
-        # model="deepseek-chat",
-        # api_key=settings.deepseek_api_key,
+    return get_router()
 
-        # 千问
-        base_url=settings.qianwen_base_url,
-        model="qwen-max",
-        api_key=settings.qianwen_api_key,
+def get_embeddings():
+    from app.accounting import MeteredEmbeddings
 
-        temperature=0.2,
-        streaming=True,
-    )
+    if settings.embedding_backend != "dashscope":
+        # 本地 CPU 后端（哈希 TF-IDF / ONNX），不走网络；模型进程内只建一次
+        from app.rag.local_embeddings import get_local_embeddings
 
-def get_embeddings():
-    return DashScopeEmbeddings(
+        inner, model = get_local_embeddings()
+        return MeteredEmbeddings(inner, model=model)
+
+    from langchain_community.embeddings import DashScopeEmbeddings
+
+    return MeteredEmbeddings(  # 包一层做 token 记账
+        DashScopeEmbeddings(
+            model="text-embedding-v2",
+            dashscope_api_key=settings.qianwen_api_key,
+        ),
         model="text-embedding-v2",
-        dashscope_api_key=settings.qianwen_api_key,
     )
 
 
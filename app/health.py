@@ -0,0 +1,87 @@
+# app/health.py
+# 存活 / 就绪检查和启动预热。
+#   /healthz：进程活着就返回 ok，不碰任何外部依赖（给 k8s livenessProbe 用）
+#   /readyz ：逐个检查依赖（路由图、redis、mysql、chroma），全部就绪才 200
+# 每个检查都单独计时、单独捕获异常，一个依赖挂了不影响其它依赖的报告。
+
+import time
+from typing import Callable
+
+
+def check_graph() -> None:
+    from app.router_graph import router_graph_ready
+
+    if not router_graph_ready():
+        raise RuntimeError("router graph not compiled yet")
+
+
+def check_redis() -> None:
+    from app.db.redis_session import get_redis
+
+    get_redis().ping()
+
+
+def check_mysql() -> None:
+    from app.db.mysql import get_conn
+
+    with get_conn() as conn:
+        conn.ping(reconnect=False)
+
+
+def check_chroma() -> None:
+    from app.rag.vectorstore import get_chroma_client
+
+    get_chroma_client().heartbeat()
+
+
+CHECKS: dict[str, Callable[[], None]] = {
+    "graph": check_graph,
+    "redis": check_redis,
+    "mysql": check_mysql,
+    "chroma": check_chroma,
+}
+
+
+def readiness() -> tuple[bool, dict]:
+    """返回 (是否全部就绪, 每个依赖的状态)。"""
+    report = {}
+    ok = True
+    for name, check in CHECKS.items():
+        t0 = time.perf_counter()
+        try:
+            check()
+            report[name] = {"ready": True}
+        except Exception as e:
+            ok = False
+            report[name] = {"ready": False, "error": f"{type(e).__name__}: {e}"}
+        report[name]["latency_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return ok, report
+
+
+def warmup() -> dict:
+    """预热：提前建好连接和客户端，让第一个真实请求不用付冷启动的代价。
+
+    失败只记录不抛出——预热是锦上添花，不能挡住服务启动。
+    """
+    def _llm_clients() -> None:
+        from app.depts import get_embeddings, get_llm
+
+        get_llm()
+        get_embeddings()
+
+    steps = {
+        "redis": check_redis,
+        "mysql": check_mysql,
+        "chroma": check_chroma,
+        "llm_clients": _llm_clients,
+    }
+    report = {}
+    for name, step in steps.items():
+        t0 = time.perf_counter()
+        try:
+            step()
+            report[name] = "ok"
+        except Exception as e:
+            report[name] = f"{type(e).__name__}: {e}"
+        print(f"[warmup] {name}: {report[name]} ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+    return report
@@ -1,10 +1,18 @@
 from app.ingestion.loader import load_docs, split_docs
-from app.depts import get_embeddings, get_vs
+from app.depts import get_embeddings
+from app.rag.doc_summary import index_documents
+from app.rag.parent_store import store_parents_for
+from app.rag.vectorstore import add_documents_routed, corpus_writer
 
 def main():
-	docs = split_docs(load_docs("./data/docs"))
-	get_vs().add_documents(docs)
-	print(f"Indexed {len(docs)} chunks into Chroma.")
+	raw = load_docs("./data/docs")
+	docs = split_docs(raw)
+	embeddings = get_embeddings()
+	with corpus_writer() as base:  # /reindex 进行中会抛 CorpusBusy
+		add_documents_routed(embeddings, docs, base=base)
+		store_parents_for(raw, docs)
+		summarized = index_documents(raw, docs, embeddings)
+	print(f"Indexed {len(docs)} chunks into Chroma, {summarized} document summaries.")
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()
@@ -0,0 +1,303 @@
+# app/ingestion/dedup.py
+# 入库去重：给每个 chunk 算一个 64 位 SimHash 指纹，
+# 和已入库的 chunk 比较汉明距离，距离很小的就认为是“近似重复”，不再重复做 embedding。
+#
+# 为什么要分段（band）：
+#   64 位指纹切成 d+1 段。两个指纹汉明距离 <= d 时，按抽屉原理至少有 1 段完全相同，
+#   所以只要按段建倒排就能快速找到候选，不用两两比较。
+#   我们的 chunk 只有 200 字左右，改 3 个字距离就有 5~12，而不相关的 chunk 一般 >= 20，
+#   所以默认阈值取 8（9 段，每段约 7 位）。
+#
+# 只在同一个 visibility 内去重：public 的 chunk 和 hr 专属的 chunk 内容再像也都要留着，
+# 否则 public 用户会因为 hr 文档里有同样的段落而查不到这段内容。
+#
+# 被跳过的 chunk 靠保留下来的那份原件才查得到，所以每次跳过都记一条引用（dedup_refs：哪篇文档折叠进了哪篇）。
+# 原件所在的文档被 DELETE / PUT 掉时，按引用找出依赖它的文档重新入库一遍（见 main._restore_dependants），
+# 否则删掉 v1 会把内容几乎一样的 v2 一起“删”掉。
+
+import hashlib
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Iterable, List, Tuple
+
+from langchain_core.documents import Document
+
+from app.config import settings
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3  # 中文按字切 3-gram，不依赖分词
+
+_WS = re.compile(r"\s+")
+
+
+def _shingles(text: str) -> List[str]:
+    t = _WS.sub("", text or "")
+    if len(t) <= SHINGLE_SIZE:
+        return [t] if t else []
+    return [t[i:i + SHINGLE_SIZE] for i in range(len(t) - SHINGLE_SIZE + 1)]
+
+
+def simhash(text: str) -> int:
+    """计算文本的 64 位 SimHash。"""
+    weights = {}
+    for s in _shingles(text):
+        weights[s] = weights.get(s, 0) + 1
+
+    v = [0] * FINGERPRINT_BITS
+    for s, w in weights.items():
+        h = int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+        for i in range(FINGERPRINT_BITS):
+            v[i] += w if (h >> i) & 1 else -w
+
+    fp = 0
+    for i in range(FINGERPRINT_BITS):
+        if v[i] > 0:
+            fp |= 1 << i
+    return fp
+
+
+def fingerprint(text: str) -> str:
+    """元数据里存 16 位十六进制字符串（Chroma 的 int 元数据放不下无符号 64 位）。"""
+    return f"{simhash(text):016x}"
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def scope_of(metadata: dict[str, Any] | None) -> str:
+    """去重的范围：chunk 的 visibility（没有记录的按 public 算，和检索时的过滤一致）。"""
+    return str((metadata or {}).get("visibility") or "public").strip().lower()
+
+
+class SimHashIndex:
+    """按 band 建倒排的指纹索引，用来找近似重复的 chunk；倒排按 scope（visibility）分开。"""
+
+    def __init__(self, max_distance: int = 8):
+        self.max_distance = max(0, min(max_distance, FINGERPRINT_BITS - 1))
+        bands = self.max_distance + 1
+        width = FINGERPRINT_BITS // bands
+        # (起始位, 位宽)，最后一段把除不尽的位吃掉
+        self._spans = [(b * width, width) for b in range(bands - 1)]
+        self._spans.append(((bands - 1) * width, FINGERPRINT_BITS - (bands - 1) * width))
+        self._bands: dict[tuple[str, int, int], list[tuple[int, str]]] = {}
+        self.size = 0
+
+    def _band_keys(self, fp: int, scope: str) -> Iterable[tuple[str, int, int]]:
+        for b, (offset, width) in enumerate(self._spans):
+            yield scope, b, (fp >> offset) & ((1 << width) - 1)
+
+    def add(self, fp: int, ref: str, scope: str = "public") -> None:
+        for key in self._band_keys(fp, scope):
+            self._bands.setdefault(key, []).append((fp, ref))
+        self.size += 1
+
+    def remove(self, fp: int, ref: str, scope: str = "public") -> bool:
+        """删掉一条 (指纹, 引用)；文档被更新 / 删除后要把它的指纹拿掉，否则新版本会被当成重复。"""
+        removed = False
+        for key in self._band_keys(fp, scope):
+            entries = self._bands.get(key)
+            if not entries:
+                continue
+            for i, (other, r) in enumerate(entries):
+                if other == fp and r == ref:
+                    del entries[i]
+                    removed = True
+                    break
+            if not entries:
+                del self._bands[key]
+        if removed:
+            self.size -= 1
+        return removed
+
+    def find(self, fp: int, scope: str = "public") -> str | None:
+        """返回同一 scope 里已入库的近似重复 chunk 的引用（source），没有则返回 None。"""
+        for key in self._band_keys(fp, scope):
+            for other, ref in self._bands.get(key, ()):
+                if hamming(fp, other) <= self.max_distance:
+                    return ref
+        return None
+
+
+def ensure_fingerprint(chunk: Document) -> int:
+    chunk.metadata = dict(chunk.metadata or {})
+    fp = chunk.metadata.get("simhash")
+    if not fp:
+        fp = fingerprint(chunk.page_content)
+        chunk.metadata["simhash"] = fp
+    return int(fp, 16)
+
+
+def dedup_chunks(chunks: List[Document], index: SimHashIndex) -> Tuple[List[Document], List[dict]]:
+    """过滤掉与 index 中同一 visibility 的已有 chunk（或本批前面的 chunk）近似重复的 chunk。
+
+    返回 (要入库的 chunks, 被去重的记录)；保留下来的 chunk 会顺手加入 index。
+    """
+    kept: List[Document] = []
+    dropped: List[dict] = []
+    for c in chunks:
+        fp = ensure_fingerprint(c)
+        scope = scope_of(c.metadata)
+        dup_of = index.find(fp, scope)
+        if dup_of is not None:
+            dropped.append(
+                {"source": c.metadata.get("source"), "duplicate_of": dup_of, "visibility": scope, "doc_id": c.metadata.get("doc_id")}
+            )
+            continue
+        index.add(fp, str(c.metadata.get("source") or ""), scope)
+        kept.append(c)
+    return kept, dropped
+
+
+def index_from_metadatas(metadatas: Iterable[dict[str, Any] | None]) -> SimHashIndex:
+    index = SimHashIndex(max_distance=settings.dedup_max_distance)
+    for m in metadatas:
+        fp = (m or {}).get("simhash")
+        if fp:
+            index.add(int(fp, 16), str((m or {}).get("source") or ""), scope_of(m))
+    return index
+
+
+# ---------- 去重引用：被跳过的 chunk 折叠进了哪篇文档 ----------
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+
+_local = threading.local()
+
+
+def _conn() -> sqlite3.Connection:
+    """每个线程一个连接（sqlite 连接不能跨线程用）。"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        path = Path(settings.dedup_refs_path)
+        if not path.is_absolute():
+            path = ROOT_DIR / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(path), timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS dedup_refs ("
+            " source TEXT NOT NULL, original TEXT NOT NULL, visibility TEXT NOT NULL, doc_id TEXT,"
+            " PRIMARY KEY (source, original))"
+        )
+        _local.conn = conn
+    return conn
+
+
+def _ref_rows(dropped: Iterable[dict]) -> list[tuple]:
+    # 文档内部的重复段落指向自己，不算依赖
+    rows = {
+        (d["source"], d["duplicate_of"]): (d["source"], d["duplicate_of"], d.get("visibility") or "public", d.get("doc_id"))
+        for d in dropped
+        if d.get("source") and d.get("duplicate_of") and d["source"] != d["duplicate_of"]
+    }
+    return list(rows.values())
+
+
+def record_refs(dropped: Iterable[dict]) -> int:
+    """dedup_chunks 返回的去重记录写进引用表；在 chunk 真正写入向量库之后调用。"""
+    rows = _ref_rows(dropped)
+    if rows:
+        conn = _conn()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO dedup_refs VALUES (?, ?, ?, ?)", rows)
+    return len(rows)
+
+
+def replace_refs(dropped: Iterable[dict]) -> int:
+    """/reindex 切换版本后调用：引用表换成新版本建库时的去重记录。"""
+    rows = _ref_rows(dropped)
+    conn = _conn()
+    with conn:
+        conn.execute("DELETE FROM dedup_refs")
+        conn.executemany("INSERT OR REPLACE INTO dedup_refs VALUES (?, ?, ?, ?)", rows)
+    return len(rows)
+
+
+def take_dependants(sources: Iterable[str]) -> list[dict]:
+    """这些源文件要被删掉了：返回内容折叠进它们的其它文档 [{source, visibility, doc_id}]，
+    并清掉涉及它们的引用（调用方把返回的文档重新入库时会记下新的引用）。"""
+    sources = list(dict.fromkeys(s for s in sources if s))
+    if not sources:
+        return []
+    marks = ",".join("?" * len(sources))
+    conn = _conn()
+    with conn:
+        rows = conn.execute(
+            f"SELECT source, visibility, doc_id FROM dedup_refs WHERE original IN ({marks}) AND source NOT IN ({marks})",
+            sources + sources,
+        ).fetchall()
+        conn.execute(f"DELETE FROM dedup_refs WHERE original IN ({marks}) OR source IN ({marks})", sources + sources)
+    dependants: dict[str, dict] = {}
+    for src, visibility, doc_id in rows:
+        dependants.setdefault(src, {"source": src, "visibility": visibility, "doc_id": doc_id})
+    return list(dependants.values())
+
+
+# ---------- 进程内指纹缓存 ----------
+# (collection 名, {collection: 内容代次}, 索引)。别的 worker 写入 / 删除 / reindex 之后指针或代次会变，
+# get_index 发现对不上就从向量库重新加载；本进程自己的写入用 sync_generations 跟上代次，不用重新加载。
+_INDEX: tuple[str, dict[str, int], SimHashIndex] | None = None
+
+
+def get_index(embeddings, base: str) -> SimHashIndex:
+    """base 这个语料版本（所有分区）的指纹索引。"""
+    global _INDEX
+    from app.rag.quantized import corpus_generations
+    from app.rag.vectorstore import corpus_stores
+
+    gens = corpus_generations(base)  # 先读代次再拉数据：中间有写入的话下次会再加载一遍，不会漏
+    cached = _INDEX
+    if cached and cached[0] == base and cached[1] == gens:
+        return cached[2]
+    metadatas: list = []
+    for store in corpus_stores(embeddings, base):
+        metadatas.extend(store.get(include=["metadatas"]).get("metadatas") or [])
+    index = index_from_metadatas(metadatas)
+    _INDEX = (base, gens, index)
+    return index
+
+
+def sync_generations(base: str, touched: Iterable[str]) -> None:
+    """本进程刚写过 touched 这些 collection（每个代次 +1）、并且已经把指纹增量加进 / 移出了缓存。
+    代次正好只多了这一次说明期间没有别人写，缓存继续用；否则丢掉，下次重新加载。"""
+    global _INDEX
+    from app.rag.quantized import corpus_generations
+
+    cached = _INDEX
+    if not cached or cached[0] != base:
+        return
+    touched = set(touched)
+    gens = corpus_generations(base)
+    for name, gen in gens.items():
+        if gen != cached[1].get(name, 0) + (name in touched):
+            _INDEX = None
+            return
+    _INDEX = (base, gens, cached[2])
+
+
+def forget_fingerprints(metadatas: Iterable[dict[str, Any] | None]) -> int:
+    """从缓存的索引里移除这些 chunk 的指纹（还没加载过就不用管，下次会从向量库重新加载）。"""
+    if _INDEX is None:
+        return 0
+    index = _INDEX[2]
+    n = 0
+    for m in metadatas:
+        fp = (m or {}).get("simhash")
+        if fp:
+            n += index.remove(int(fp, 16), str((m or {}).get("source") or ""), scope_of(m))
+    return n
+
+
+def reset_index(index: SimHashIndex | None = None, base: str | None = None) -> None:
+    """/reindex 之后用新建的索引替换缓存（传 None 表示下次重新从向量库加载）；写入失败时也要调，
+    dedup_chunks 已经把没写进去的 chunk 加进了索引。"""
+    global _INDEX
+    if index is None or base is None:
+        _INDEX = None
+        return
+    from app.rag.quantized import corpus_generations
+
+    _INDEX = (base, corpus_generations(base), index)
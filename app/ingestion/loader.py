@@ -1,14 +1,15 @@
+import json
 from pathlib import Path
 from typing import List
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from pypdf import PdfReader
-import docx
 from app.config import settings
+from app.ingestion.dedup import ensure_fingerprint
 
 
 def load_pdf(path: Path) -> List[Document]:
     """下面的代码将pdf分割成单独的页面，每一个页面的文本被封装成一个Document放入list"""
+    from pypdf import PdfReader  # 解析库只在真正入库时才加载，避免拖慢服务启动
+
     reader = PdfReader(str(path))
     docs = []
     for i, page in enumerate(reader.pages):
@@ -21,10 +22,69 @@ def load_pdf(path: Path) -> List[Document]:
     return docs
 
 
+def _heading_level(style_name: str) -> int:
+    """'Heading 2' / '标题 2' -> 2；不是标题返回 0。"""
+    for prefix in ("Heading", "标题"):
+        if style_name.startswith(prefix):
+            tail = style_name[len(prefix):].strip()
+            return int(tail) if tail.isdigit() else 1
+    return 0
+
+
 def load_docx(path: Path) -> List[Document]:
+    """按二级及以下标题切成小节，每个小节一个Document（父段落检索的“父”）；一级标题当文档标题。"""
+    import docx
+
     d = docx.Document(str(path))
-    text = "\n".join(p.text for p in d.paragraphs if p.text.strip())
-    return [Document(page_content=text, metadata={"source": str(path)})] if text else []
+    title = ""
+    sections: list[tuple[str, list[str]]] = [("", [])]
+    for p in d.paragraphs:
+        text = p.text.strip()
+        if not text:
+            continue
+        level = _heading_level(p.style.name if p.style is not None else "")
+        if level == 1 and not title:
+            title = text
+            sections[-1][1].append(text)
+        elif level >= 2:
+            sections.append((text, [text]))
+        else:
+            sections[-1][1].append(text)
+
+    docs = []
+    for heading, lines in sections:
+        if not lines:
+            continue
+        meta = {"source": str(path)}
+        if heading:
+            meta["section"] = heading
+        if title:
+            meta["title"] = title
+        docs.append(Document(page_content="\n".join(lines), metadata=meta))
+    return docs
+
+
+def load_markdown(path: Path) -> List[Document]:
+    """按 # 标题切成小节；没有标题的 md 整篇一个Document。"""
+    text = path.read_text(encoding="utf-8")
+    docs, heading, lines = [], "", []
+
+    def _flush():
+        body = "\n".join(lines).strip()
+        if body:
+            meta = {"source": str(path)}
+            if heading:
+                meta["section"] = heading
+            docs.append(Document(page_content=body, metadata=meta))
+
+    for line in text.splitlines():
+        if line.startswith("#"):
+            _flush()
+            heading, lines = line.lstrip("#").strip(), [line]
+        else:
+            lines.append(line)
+    _flush()
+    return docs
 
 
 def load_txt(path: Path) -> List[Document]:
@@ -43,17 +103,72 @@ def load_docs(dir_path: str) -> List[Document]:
             docs.extend(load_pdf(f))
         elif f.suffix.lower() in [".docx", ".doc"]:
             docs.extend(load_docx(f))
-        elif f.suffix.lower() in [".md", ".txt"]:
-            docs.append(Document(page_content=f.read_text(encoding="utf-8"),
-                                 metadata={"source": str(f)}))
+        elif f.suffix.lower() == ".md":
+            docs.extend(load_markdown(f))
+        elif f.suffix.lower() == ".txt":
+            docs.extend(load_txt(f))
     return docs
 
+# /ingest 上传的文件旁边放一个 <文件名>.meta.json，记下 visibility / doc_id，
+# /reindex 从磁盘重建时据此恢复，按 doc_id 更新 / 删除文档也靠它找到源文件。
+META_SUFFIX = ".meta.json"
+
+
+def write_doc_meta(path: Path, **meta) -> None:
+    Path(f"{path}{META_SUFFIX}").write_text(
+        json.dumps({k: v for k, v in meta.items() if v is not None}, ensure_ascii=False), encoding="utf-8"
+    )
+
+
+def read_doc_meta(path: Path) -> dict:
+    try:
+        return json.loads(Path(f"{path}{META_SUFFIX}").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def apply_doc_meta(chunks: List[Document], default_visibility: str) -> List[Document]:
+    """重建时给 chunk 补上上传时记录的 visibility / doc_id；没有记录的用默认 visibility。"""
+    cache: dict[str, dict] = {}
+    for c in chunks:
+        c.metadata = dict(c.metadata or {})
+        src = str(c.metadata.get("source") or "")
+        if src not in cache:
+            cache[src] = read_doc_meta(Path(src)) if src else {}
+        meta = cache[src]
+        c.metadata.setdefault("visibility", meta.get("visibility") or default_visibility)
+        if meta.get("doc_id"):
+            c.metadata.setdefault("doc_id", meta["doc_id"])
+    return chunks
+
+
+def assign_parents(docs: List[Document]) -> List[Document]:
+    """每个加载出来的Document（docx 小节 / PDF 页 / md 小节 / txt 整篇）就是一个父段落，
+    给它一个 parent_id，切块时子 chunk 会继承这个元数据。
+
+    这里不写 parent_store：去重之后、向量真正写进去了，调用方再用 store_parents_for 存被引用到的父段落。"""
+    from app.rag.parent_store import parent_id_for
+
+    for d in docs:
+        d.metadata = dict(d.metadata or {})
+        locator = f"page={d.metadata.get('page', '')};section={d.metadata.get('section', '')}"
+        d.metadata["parent_id"] = parent_id_for(d, locator)
+    return docs
+
+
 def split_docs(docs: List[Document]) -> List[Document]:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    if settings.parent_retrieval:
+        docs = assign_parents(docs)
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=settings.chunk_size,
         chunk_overlap=settings.chunk_overlap
     )
-    return splitter.split_documents(docs)
+    chunks = splitter.split_documents(docs)
+    for c in chunks:
+        ensure_fingerprint(c)  # 切块时顺便算 SimHash 指纹，入库去重用
+    return chunks
 
 # if __name__ == "__main__":
 #     for l in load_docs('../../data/docs'):
@@ -73,9 +188,10 @@ def load_single_file(path: Path) -> List[Document]:
         return load_pdf(path)
     if suf in [".docx", ".doc"]:
         return load_docx(path)
-    if suf in [".md", ".txt"]:
-        text = path.read_text(encoding="utf-8")
-        return [Document(page_content=text, metadata={"source": str(path)})] if text.strip() else []
+    if suf == ".md":
+        return load_markdown(path)
+    if suf == ".txt":
+        return load_txt(path)
     return []
 
 # 第二个函数主要是把一批Document切成小块，并且给每一小块贴上权限标签visibility和文档ID。
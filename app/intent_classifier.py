@@ -0,0 +1,319 @@
+# app/intent_classifier.py
+# 路由 + 请假意图的一次性分类。
+#
+# 以前一条请假消息要先在 router_graph.decide_route 里扫一遍关键词，
+# 进了 leave 子图再在 decide_intent 里最多扫 8 遍 any(k in text ...)。
+# 现在把所有关键词编译成一个 Aho-Corasick 自动机，一遍扫描拿到全部命中，
+# 再按规则同时给出 route（qa/leave）和 intent（apply/query/...）。
+# 规则拿不准的情况（比如“年假要提前多久申请？”既像请假又像问制度），
+# 交给一个本地的字 bigram 朴素贝叶斯分类器来判。
+#
+# 评估：python -m app.intent_classifier  （读取 data/eval/route_intent.jsonl，输出准确率和耗时）
+
+from __future__ import annotations
+
+import json
+import math
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Iterator
+
+EVAL_SET = Path(__file__).resolve().parent.parent / "data" / "eval" / "route_intent.jsonl"
+
+
+# ========= Aho-Corasick =========
+
+class AhoCorasick:
+    """多模式串匹配：一次扫描找出文本里出现的所有关键词。"""
+
+    def __init__(self, patterns: dict[str, Iterable[str]]):
+        # 每个节点：goto 表、fail 指针、输出（命中的关键词）
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[str]] = [[]]
+        self.tags: dict[str, frozenset[str]] = {}
+
+        for pat, tags in patterns.items():
+            if not pat:
+                continue
+            self.tags[pat] = frozenset(tags)
+            node = 0
+            for ch in pat:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(pat)
+
+        # BFS 建 fail 指针
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = 0 if node == 0 else self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter_matches(self, text: str) -> Iterator[str]:
+        node = 0
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            yield from self._out[node]
+
+
+# ========= 关键词表 =========
+# tag 含义：
+#   leave        —— 请假领域词，命中则倾向 leave 路由
+#   it / finance —— 其它业务领域词，命中则倾向 qa 路由（例如“查一下报修进度”）
+#   ask          —— 制度类提问词（多久/怎么/规定…），和 leave 同时出现时需要模型判
+#   act          —— 明确的办理动作（我要请/帮我请/明天…）
+#   q            —— 疑问句标记（谁/吗/？…）
+#   i:<intent>   —— 请假子意图
+#   obj:query / obj:list —— query/list 意图需要同时出现的“对象”词
+
+KEYWORDS: dict[str, set[str]] = {}
+
+
+def _kw(tag: str, words: Iterable[str]) -> None:
+    for w in words:
+        KEYWORDS.setdefault(w.lower(), set()).add(tag)
+
+
+_kw("leave", ["请假", "年假", "病假", "事假", "休假", "调休", "假期", "请一天假", "请半天假", "审批"])
+_kw("it", ["报修", "维修", "工单", "电脑", "笔记本", "打印机", "网络", "wifi", "vpn", "账号", "密码", "邮箱", "设备", "it"])
+_kw("finance", ["报销", "发票", "差旅", "借款", "付款", "工资", "预算"])
+_kw("ask", ["多久", "多少", "怎么", "如何", "规定", "制度", "政策", "流程", "哪些", "什么", "是否", "能不能", "可以吗", "吗", "谁", "?", "？"])
+# 疑问句标记（ask 里去掉“规定 / 制度”这类名词）：问句永远不会触发审批这种写操作
+_kw("q", ["多久", "多少", "怎么", "如何", "哪些", "什么", "是否", "能不能", "可以吗", "吗", "谁", "?", "？"])
+_kw("act", ["我要请", "我想请", "想请", "帮我请", "给我请", "请一天", "请半天", "明天", "后天", "下周", "本周", "这周", "号", "上午", "下午", "全天", "确认"])
+
+_kw("i:cancel", ["取消", "撤销", "作废"])
+_kw("i:pending", ["待审批", "待审核", "审批队列", "待处理的请假", "未审批"])
+_kw("i:query", ["查询", "查", "状态", "进度", "结果"])
+_kw("obj:query", ["请假", "年假", "病假", "事假", "休假", "调休", "假期", "申请", "单"])
+_kw("i:list", ["最近", "列表", "我的请假", "请假记录", "历史请假"])
+_kw("obj:list", ["请假", "年假", "病假", "事假", "休假", "假期", "记录"])
+_kw("i:modify", ["修改", "变更", "调整", "改期", "改到", "改为"])
+_kw("i:approve", ["批准", "同意", "通过", "审批通过"])
+_kw("i:reject", ["驳回", "拒绝", "不通过", "审批拒绝"])
+_kw("bulk", ["批量", "全部", "所有", "全都", "一起"])
+
+# 和旧版 decide_intent 的判断顺序保持一致
+INTENT_ORDER = ["cancel", "pending", "query", "list", "modify", "approve", "reject"]
+INTENT_REQUIRES = {"query": "obj:query", "list": "obj:list"}
+
+_LEAVE_ID = re.compile(r"\bLV-[0-9a-fA-F]{6,12}\b")
+_ISO_DATE = re.compile(r"\d{4}-\d{1,2}-\d{1,2}|\d{1,2}月\d{1,2}[日号]")
+
+
+@lru_cache(maxsize=1)
+def _matcher() -> AhoCorasick:
+    return AhoCorasick(KEYWORDS)
+
+
+# ========= 朴素贝叶斯（只判 qa / leave） =========
+
+# 训练语料只用来判“模棱两可”的句子，评估集在 data/eval 里，两者不重叠
+_SEED_EXAMPLES: list[tuple[str, str]] = [
+    ("年假有几天", "qa"),
+    ("年假需要提前几天申请", "qa"),
+    ("病假需要提供什么证明", "qa"),
+    ("事假扣工资吗", "qa"),
+    ("请假制度是怎么规定的", "qa"),
+    ("调休的规则是什么", "qa"),
+    ("婚假有多少天", "qa"),
+    ("请假审批要几级", "qa"),
+    ("年假可以跨年使用吗", "qa"),
+    ("病假期间工资怎么算", "qa"),
+    ("公司的休假政策", "qa"),
+    ("假期余额怎么计算", "qa"),
+    ("我要请年假", "leave"),
+    ("帮我请两天病假", "leave"),
+    ("我想请下周一的事假", "leave"),
+    ("明天请一天年假", "leave"),
+    ("后天上午请半天假", "leave"),
+    ("我要调休一天", "leave"),
+    ("申请下周三年假", "leave"),
+    ("我身体不舒服要请病假", "leave"),
+    ("下周二想休假一天", "leave"),
+    ("我要请三天假回老家", "leave"),
+    ("帮我提交一个请假申请", "leave"),
+    ("周五下午请假", "leave"),
+]
+
+
+def _scan(text: str) -> dict[str, set[str]]:
+    """一遍 AC 扫描，返回 {tag: 命中的关键词}。"""
+    hits: dict[str, set[str]] = {}
+    m = _matcher()
+    for kw in m.iter_matches(text):
+        for tag in m.tags[kw]:
+            hits.setdefault(tag, set()).add(kw)
+    return hits
+
+
+def _features(text: str, hits: dict[str, set[str]] | None = None) -> list[str]:
+    """特征 = 字 bigram + 关键词 tag（“#ask”“#act” 这类词比单个 bigram 更有区分度）。"""
+    t = re.sub(r"\s+", "", text.lower())
+    grams = [t[i:i + 2] for i in range(len(t) - 1)] if len(t) >= 2 else ([t] if t else [])
+    if hits is None:
+        hits = _scan(t)
+    return grams + [f"#{tag}" for tag in hits for _ in hits[tag]]
+
+
+class NaiveBayes:
+    """多项式朴素贝叶斯，带拉普拉斯平滑。"""
+
+    def __init__(self, examples: Iterable[tuple[str, str]]):
+        self.counts: dict[str, dict[str, int]] = {}
+        self.totals: dict[str, int] = {}
+        self.docs: dict[str, int] = {}
+        vocab: set[str] = set()
+        for text, label in examples:
+            c = self.counts.setdefault(label, {})
+            self.docs[label] = self.docs.get(label, 0) + 1
+            for g in _features(text):
+                c[g] = c.get(g, 0) + 1
+                self.totals[label] = self.totals.get(label, 0) + 1
+                vocab.add(g)
+        self.vocab_size = max(1, len(vocab))
+        n = sum(self.docs.values())
+        self.priors = {k: math.log(v / n) for k, v in self.docs.items()}
+
+    def predict_proba(self, text: str, hits: dict[str, set[str]] | None = None) -> dict[str, float]:
+        grams = _features(text, hits)
+        logp = {}
+        for label, prior in self.priors.items():
+            c = self.counts[label]
+            denom = self.totals.get(label, 0) + self.vocab_size
+            logp[label] = prior + sum(math.log((c.get(g, 0) + 1) / denom) for g in grams)
+        m = max(logp.values())
+        z = sum(math.exp(v - m) for v in logp.values())
+        return {k: math.exp(v - m) / z for k, v in logp.items()}
+
+
+@lru_cache(maxsize=1)
+def _model() -> NaiveBayes:
+    return NaiveBayes(_SEED_EXAMPLES)
+
+
+# ========= 对外接口 =========
+
+@dataclass(frozen=True)
+class Classification:
+    route: str | None   # "qa" / "leave"；None 表示没有任何信号（交给调用方沿用上一轮路由）
+    intent: str         # apply / query / cancel / list / pending / modify / approve / reject / bulk_approve / bulk_reject
+    confidence: float
+    source: str         # "rules" / "model" / "default"
+
+
+def classify(text: str) -> Classification:
+    """一遍扫描同时给出路由和请假意图。"""
+    t = (text or "").lower()
+    hits = _scan(t)
+    n_ids = len(set(_LEAVE_ID.findall(text or "")))
+    has_id = n_ids > 0
+
+    # 被更长关键词包含的短词不算（“不通过”里的“通过”不是批准）
+    matched = {kw for kws in hits.values() for kw in kws}
+    for tag in [k for k in hits if k.startswith("i:")]:
+        hits[tag] = {kw for kw in hits[tag] if not any(kw != o and kw in o for o in matched)}
+        if not hits[tag]:
+            del hits[tag]
+
+    # ---- intent ----
+    intent = "apply"
+    for name in INTENT_ORDER:
+        if f"i:{name}" not in hits:
+            continue
+        need = INTENT_REQUIRES.get(name)
+        if need and need not in hits and not has_id:  # 带了 LV- 单号本身就说明是在说请假单
+            continue
+        intent = name
+        break
+
+    if "q" in hits and intent in {"approve", "reject"}:
+        # 问句（“LV-xxx 批准了吗？”“年假需要谁同意？”）不能落到审批这种写操作上：
+        # 带单号的当成查询，带“待审批”的当成查队列，其余交给下面的路由判断
+        intent = "query" if has_id else "pending" if "i:pending" in hits else "apply"
+
+    # 批量审批：多个单号，或者“批量 / 全部 / 所有”这类批量词 / 以批准、驳回开头的祈使句 + 批准/驳回
+    # （“批准所有待审批的年假”是批量批准，不是查队列）；问句一律不升级
+    if intent in {"pending", "approve", "reject"} and "q" not in hits:
+        decision = intent if intent != "pending" else (
+            "approve" if "i:approve" in hits else "reject" if "i:reject" in hits else None
+        )
+        # “批准待审批的年假”：待审批 + 以批准/驳回开头才算祈使句；单条“批准 LV-xxx”仍是单条审批
+        imperative = intent == "pending" and any(t.lstrip().startswith(kw) for kw in hits.get(f"i:{decision}", ()))
+        if decision and (n_ids > 1 or "bulk" in hits or imperative):
+            intent = f"bulk_{decision}"
+
+    # ---- route ----
+    leave = "leave" in hits
+    other = "it" in hits or "finance" in hits
+
+    if has_id:
+        return Classification("leave", intent, 1.0, "rules")
+    if other and not leave:
+        return Classification("qa", intent, 1.0, "rules")
+    if leave and intent != "apply":
+        return Classification("leave", intent, 1.0, "rules")
+    if leave and ("act" in hits or _ISO_DATE.search(t)) and "ask" not in hits:
+        return Classification("leave", intent, 1.0, "rules")
+    if leave and "ask" not in hits and not other:
+        return Classification("leave", intent, 0.9, "rules")
+
+    if leave or other or "ask" in hits:
+        # 模棱两可：请假词 + 提问词，或者请假词和其它领域词混在一起
+        proba = _model().predict_proba(t, hits)
+        route = max(proba, key=proba.get)
+        return Classification(route, intent, round(proba[route], 3), "model")
+
+    return Classification(None, intent, 0.0, "default")
+
+
+# ========= 评估 =========
+
+def evaluate(path: Path = EVAL_SET) -> dict:
+    rows = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+    _matcher(), _model()  # 预热，不计入耗时
+
+    route_ok = intent_ok = 0
+    errors = []
+    t0 = time.perf_counter()
+    for row in rows:
+        c = classify(row["text"])
+        route = c.route or "qa"
+        r_ok = route == row["route"]
+        i_ok = row["route"] != "leave" or c.intent == row["intent"]
+        route_ok += r_ok
+        intent_ok += r_ok and i_ok
+        if not (r_ok and i_ok):
+            errors.append({**row, "got_route": route, "got_intent": c.intent, "source": c.source})
+    elapsed = time.perf_counter() - t0
+
+    n = max(1, len(rows))
+    return {
+        "samples": len(rows),
+        "route_accuracy": round(route_ok / n, 4),
+        "joint_accuracy": round(intent_ok / n, 4),
+        "avg_latency_us": round(elapsed / n * 1e6, 1),
+        "errors": errors,
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(evaluate(), ensure_ascii=False, indent=2))
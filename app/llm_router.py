@@ -0,0 +1,341 @@
+# app/llm_router.py
+# 多模型供应商路由：get_llm() 返回的就是这里的 LLMRouter。
+#
+# - 每个供应商（千问 / deepseek / openai，都是 OpenAI 兼容接口）维护滚动窗口内的延迟和错误统计
+# - 默认把请求发给“最快且健康”的供应商，失败自动切到下一个
+# - 可选对冲（hedge）：主供应商超过自己的 p95 还没返回，就同时向第二快的供应商再发一份，谁先回来用谁
+# - 熔断：连续失败 N 次后熔断一段时间，冷却后放一个探测请求（half-open），成功就恢复
+# - 每个供应商一个并发池（app/admission.py 的 llm:<name>），排不上队就换下一家，全都排不上返回 503
+#
+# 供应商列表、base_url、模型名都来自 Settings，所以可以直接指向本地的 OpenAI 兼容 stub 服务做测试：
+#   LLM_PROVIDERS=qianwen,deepseek QIANWEN_BASE_URL=http://127.0.0.1:9001/v1 DEEPSEEK_BASE_URL=http://127.0.0.1:9002/v1
+
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Iterator
+
+from app.accounting import record_llm_response
+from app.admission import AdmissionRejected, acquire as admission_acquire
+from app.config import settings
+
+
+@dataclass(frozen=True)
+class Provider:
+    name: str
+    base_url: str
+    api_key: str
+    model: str
+
+
+def providers_from_settings() -> list[Provider]:
+    known = {
+        "qianwen": Provider("qianwen", settings.qianwen_base_url, settings.qianwen_api_key, settings.qianwen_chat_model),
+        "deepseek": Provider("deepseek", settings.deepseek_base_url, settings.deepseek_api_key, settings.deepseek_chat_model),
+        "openai": Provider("openai", settings.openai_base_url, settings.openai_api_key, settings.model_name),
+    }
+    names = [n.strip().lower() for n in settings.llm_providers.split(",") if n.strip()]
+    return [known[n] for n in names if n in known]
+
+
+class ProviderStats:
+    """滚动窗口统计：最近 N 次调用的延迟和成败。"""
+
+    def __init__(self, window: int):
+        self.latencies: deque[float] = deque(maxlen=window)  # 只记成功调用
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(latency)
+
+    def percentile(self, q: float) -> float | None:
+        with self._lock:
+            data = sorted(self.latencies)
+        if not data:
+            return None
+        return data[min(len(data) - 1, int(q * len(data)))]
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def snapshot(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "samples": len(self.outcomes),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 3),
+        }
+
+
+class CircuitBreaker:
+    """closed -> (连续失败 N 次) -> open -> (冷却结束) -> half_open -> 成功 closed / 失败 open"""
+
+    def __init__(self, failure_threshold: int, cooldown_s: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_s:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True  # 冷却后只放一个探测请求
+                return True
+            return False
+
+    def release_probe(self) -> None:
+        """allow() 放行的探测请求根本没发出去（比如供应商并发池满了）：交还探测名额，不改变熔断状态。"""
+        with self._lock:
+            self._probing = False
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def on_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class AllProvidersFailed(RuntimeError):
+    pass
+
+
+class LLMRouter:
+    """对调用方来说和 ChatOpenAI 一样用：llm.invoke(messages).content / llm.stream(messages)。"""
+
+    def __init__(self, providers: list[Provider] | None = None):
+        self.providers = providers if providers is not None else providers_from_settings()
+        if not self.providers:
+            raise ValueError("no LLM provider configured (check LLM_PROVIDERS)")
+        self.stats = {p.name: ProviderStats(settings.llm_stats_window) for p in self.providers}
+        self.breakers = {
+            p.name: CircuitBreaker(settings.llm_breaker_failures, settings.llm_breaker_cooldown_s)
+            for p in self.providers
+        }
+        self._clients: dict[str, Any] = {}
+        self._pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+
+    # ---------- 选路 ----------
+
+    def _client(self, p: Provider):
+        client = self._clients.get(p.name)
+        if client is None:
+            from langchain_openai import ChatOpenAI
+
+            client = ChatOpenAI(
+                base_url=p.base_url,
+                model=p.model,
+                api_key=p.api_key,
+                temperature=0.2,
+                streaming=True,
+                timeout=settings.llm_timeout_s,
+                max_retries=0,  # 重试交给路由器换供应商做
+                stream_usage=True,  # 流式时也让供应商回传 usage，记账用
+            )
+            self._clients[p.name] = client
+        return client
+
+    def ranked(self) -> list[Provider]:
+        """按 p50 延迟 × (1 + 错误率) 排序；样本太少的按配置顺序排在前面，先探一探。"""
+        def score(item: tuple[int, Provider]) -> tuple[int, float, int]:
+            i, p = item
+            st = self.stats[p.name]
+            p50 = st.percentile(0.5)
+            if len(st.outcomes) < settings.llm_min_samples or p50 is None:
+                return 0, 0.0, i
+            return 1, p50 * (1 + 4 * st.error_rate), i
+
+        order = [p for _, p in sorted(enumerate(self.providers), key=score)]
+        return [p for p in order if self.breakers[p.name].state != "open"]
+
+    def _call(self, p: Provider, messages, **kwargs):
+        # 供应商并发池满了抛 AdmissionRejected：不算供应商的失败，不记统计、不触发熔断。
+        # 调用方已经 allow() 过，half-open 时占着探测名额，请求没发出去就得还回去，否则熔断永远不恢复
+        try:
+            slot = admission_acquire(f"llm:{p.name}")
+        except AdmissionRejected:
+            self.breakers[p.name].release_probe()
+            raise
+        t0 = time.monotonic()
+        try:
+            out = self._client(p).invoke(messages, **kwargs)
+        except Exception:
+            self.stats[p.name].record(time.monotonic() - t0, False)
+            self.breakers[p.name].on_failure()
+            raise
+        finally:
+            slot.release()
+        latency = time.monotonic() - t0
+        self.stats[p.name].record(latency, True)
+        self.breakers[p.name].on_success()
+        record_llm_response(p.name, p.model, messages, out, latency)
+        return out
+
+    def _submit(self, p: Provider, messages, **kwargs):
+        # 复制 contextvars，让 langchain 回调 / langgraph 配置能传到线程池里
+        ctx = contextvars.copy_context()
+        return self._pool.submit(ctx.run, self._call, p, messages, **kwargs)
+
+    # ---------- 对外接口 ----------
+
+    def invoke(self, messages, **kwargs):
+        candidates = self.ranked()
+        if not candidates:
+            raise AllProvidersFailed("all LLM providers are unavailable (circuit open)")
+
+        primary, backups = candidates[0], candidates[1:]
+        deadline = self.stats[primary.name].percentile(0.95)
+        hedge = (
+            settings.llm_hedge_enabled
+            and backups
+            and deadline is not None
+            and len(self.stats[primary.name].latencies) >= settings.llm_min_samples
+        )
+        if not hedge or not self.breakers[primary.name].allow():
+            return self._invoke_failover(candidates if not hedge else backups, messages, **kwargs)
+
+        pending = {self._submit(primary, messages, **kwargs): primary}
+        done, _ = wait(pending, timeout=deadline)
+        if not done:
+            # 主供应商超过 p95 还没回来，对冲一份给第二快的
+            while backups:
+                backup = backups.pop(0)
+                if self.breakers[backup.name].allow():
+                    pending[self._submit(backup, messages, **kwargs)] = backup
+                    break
+
+        errors = []
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                p = pending.pop(fut)
+                try:
+                    return fut.result()
+                except Exception as e:
+                    errors.append(f"{p.name}: {type(e).__name__}: {e}")
+        # 对冲的都失败了，剩下的按顺序兜底
+        if backups:
+            return self._invoke_failover(backups, messages, **kwargs)
+        raise AllProvidersFailed("; ".join(errors))
+
+    def _invoke_failover(self, candidates: list[Provider], messages, **kwargs):
+        errors = []
+        rejections = []
+        for p in candidates:
+            if not self.breakers[p.name].allow():
+                continue
+            try:
+                return self._call(p, messages, **kwargs)
+            except AdmissionRejected as e:
+                rejections.append(e)  # 这家排不上队，换下一家
+                errors.append(f"{p.name}: {e}")
+            except Exception as e:
+                errors.append(f"{p.name}: {type(e).__name__}: {e}")
+        if rejections and len(rejections) == len(errors):
+            raise rejections[0]  # 每一家都是准入拒绝：让接口返回 503 + Retry-After，而不是 500
+        raise AllProvidersFailed("; ".join(errors) or "all LLM providers are unavailable (circuit open)")
+
+    def stream(self, messages, **kwargs) -> Iterator[Any]:
+        """流式输出不做对冲；在吐出第一个 token 之前失败才切换供应商。"""
+        errors = []
+        rejections = []
+        for p in self.ranked():
+            if not self.breakers[p.name].allow():
+                continue
+            try:
+                slot = admission_acquire(f"llm:{p.name}")
+            except AdmissionRejected as e:
+                self.breakers[p.name].release_probe()
+                rejections.append(e)
+                errors.append(f"{p.name}: {e}")
+                continue
+            t0 = time.monotonic()
+            started = False
+            merged = None
+            try:
+                for chunk in self._client(p).stream(messages, **kwargs):
+                    started = True
+                    merged = chunk if merged is None else merged + chunk
+                    yield chunk
+            except GeneratorExit:
+                # 调用方提前不要了（客户端断开、对冲去重）。能走到 yield 说明供应商已经在正常出 token，
+                # 按成功结束熔断（half-open 的探测名额也就还回去了）；不完整的耗时不进延迟统计，token 照常记账
+                self.breakers[p.name].on_success()
+                record_llm_response(p.name, p.model, messages, merged, time.monotonic() - t0)
+                raise
+            except Exception as e:
+                self.stats[p.name].record(time.monotonic() - t0, False)
+                self.breakers[p.name].on_failure()
+                if started:
+                    raise
+                errors.append(f"{p.name}: {type(e).__name__}: {e}")
+                continue
+            finally:
+                slot.release()
+            latency = time.monotonic() - t0
+            self.stats[p.name].record(latency, True)
+            self.breakers[p.name].on_success()
+            record_llm_response(p.name, p.model, messages, merged, latency)
+            return
+        if rejections and len(rejections) == len(errors):
+            raise rejections[0]  # 和 _invoke_failover 一样：全是准入拒绝时 /chat/stream 返回 503 + Retry-After
+        raise AllProvidersFailed("; ".join(errors) or "all LLM providers are unavailable (circuit open)")
+
+    def status(self) -> list[dict]:
+        return [
+            {
+                "name": p.name,
+                "model": p.model,
+                "base_url": p.base_url,
+                "circuit": self.breakers[p.name].state,
+                **self.stats[p.name].snapshot(),
+            }
+            for p in self.providers
+        ]
+
+
+_router: LLMRouter | None = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> LLMRouter:
+    """进程内单例：统计和熔断状态要跨请求保留。"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = LLMRouter()
+    return _router
@@ -9,23 +9,182 @@
 # 前台：网页、微信小程序、app。主要做展示和信息收集
 
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+# 启动速度：import 这个模块时不连接任何外部服务、不编译图。
+# langgraph / langchain_openai / chromadb 这些重量级依赖都延迟到 lifespan 或第一次请求时才加载，
+# 可以用 python -X importtime -c "import app.main" 查看各模块的导入耗时。
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from app.router_graph import router_graph
-from app.depts import get_vs, get_embeddings
-from app.ingestion.loader import load_single_file, split_with_visibility, load_docs, split_docs
+from app.depts import get_embeddings
+from app.ingestion.loader import (
+    load_single_file,
+    split_with_visibility,
+    load_docs,
+    split_docs,
+    write_doc_meta,
+    read_doc_meta,
+    apply_doc_meta,
+    META_SUFFIX,
+)
+from app.ingestion.dedup import (
+    SimHashIndex,
+    dedup_chunks,
+    get_index,
+    reset_index,
+    forget_fingerprints,
+    sync_generations,
+    record_refs,
+    replace_refs,
+    take_dependants,
+)
+from app.rag.doc_summary import delete_summaries, index_documents as index_summaries, prune_summaries
+from app.rag.parent_store import delete_parents, prune_parents, store_parents_for
 from app.config import settings
+from app.health import readiness, warmup
+from app.admission import AdmissionRejected, admit, acquire as admission_acquire, snapshot as admission_snapshot
+from app.profiling import list_profiles, profile_file, profile_request, wanted_mode
+from app.accounting import (
+    attribution,
+    annotate,
+    mark_failed,
+    record_request,
+    summary as cost_summary,
+    DIMENSIONS as COST_DIMENSIONS,
+)
+from app.rag.vectorstore import (
+    get_chroma_client,
+    new_collection_name,
+    activate_collection,
+    gc_collections,
+    corpus_status,
+    version_of,
+    add_documents_routed,
+    collection_for,
+    delete_corpus,
+    delete_documents_where,
+    list_partitions,
+    CorpusBusy,
+    begin_reindex,
+    end_reindex,
+    corpus_writer,
+)
+import asyncio
+import itertools
+import json
 import time
 import uuid
 from pathlib import Path
 from typing import Optional
-import chromadb
 from app.db.redis_session import load_session, save_session
+from app.db.mysql import get_leave_history_page, get_pending_leave_requests, bulk_review_leave_requests
 
-app = FastAPI(title="Enterprise KB Assistant")
 DATA_DOCS_DIR = Path("./data/docs")
 SESSIONS: dict[str, dict] = {}
-DATA_DOCS_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def _router_graph():
+    from app.router_graph import get_router_graph
+
+    return get_router_graph()
+
+
+def _route_pool(payload: dict) -> str:
+    from app.router_graph import decide_route
+
+    return f"route:{decide_route(payload)}"
+
+
+def _invoke_admitted(payload: dict, route: Optional[str] = None) -> dict:
+    """在路由的并发池里跑一次 router graph；route 不传就先分类一次。"""
+    with admit(f"route:{route}" if route else _route_pool(payload)):
+        return _router_graph().invoke(payload)
+
+
+def _ensure_leave_indexes() -> None:
+    """请假历史 / 待审批队列的 keyset 分页依赖的索引；MySQL 连不上只记录，不挡住服务启动。"""
+    from app.db.mysql import ensure_leave_indexes
+
+    try:
+        created = ensure_leave_indexes()
+        if created:
+            print(f"[startup] created leave indexes: {created}")
+    except Exception as e:
+        print(f"[startup] ensure leave indexes failed: {type(e).__name__}: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    DATA_DOCS_DIR.mkdir(parents=True, exist_ok=True)
+    # 编译图放在启动阶段（而不是 import 时），worker 起来后第一个请求不用再等
+    await asyncio.to_thread(_router_graph)
+    if settings.warmup_on_start:
+        await asyncio.to_thread(warmup)
+    if settings.mysql_ensure_indexes:
+        await asyncio.to_thread(_ensure_leave_indexes)
+    yield
+
+
+app = FastAPI(title="Enterprise KB Assistant", lifespan=lifespan)
+
+# 这些路径不记账（探针、监控本身）
+UNMETERED_PATHS = {"/", "/healthz", "/readyz", "/metrics/cost", "/metrics/admission", "/metrics/singleflight", "/llm/providers", "/corpus", "/docs", "/openapi.json"}
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    """并发池和等待队列都满了：快速失败，告诉客户端多久后再试。"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "服务繁忙，请稍后重试", "pool": exc.pool, "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(CorpusBusy)
+async def corpus_busy(request: Request, exc: CorpusBusy):
+    """正在 /reindex：增量写入先拒掉，建完再来（不然只会写进马上要退役的旧版本）。"""
+    return JSONResponse(
+        status_code=409,
+        content={"detail": "正在重建索引，请稍后重试", "collection": exc.collection},
+        headers={"Retry-After": "30"},
+    )
+
+
+@app.middleware("http")
+async def metering(request: Request, call_next):
+    """请求期间所有 LLM / embedding 调用的 token 和费用都记到这个 endpoint 名下。
+
+    请求级延迟在响应体发完时才记（/chat/stream 要等流结束，而不是拿到 StreamingResponse 就算完）；
+    状态码 >= 400（包括 503 / 409 这些异常处理器返回的、HTTPException）或者流中途出错都记成错误。
+    """
+    path = request.url.path
+    if path in UNMETERED_PATHS:
+        return await call_next(request)
+    t0 = time.perf_counter()
+    with attribution(path) as ctx:
+        try:
+            response = await call_next(request)
+        except Exception:
+            record_request(path, time.perf_counter() - t0, ok=False)
+            raise
+
+    body = response.body_iterator
+
+    async def _metered_body():
+        ok = response.status_code < 400
+        try:
+            async for chunk in body:
+                yield chunk
+        except Exception:
+            ok = False
+            raise
+        finally:
+            record_request(path, time.perf_counter() - t0, ok=ok and not ctx.get("failed"))
+
+    response.body_iterator = _metered_body()
+    return response
 
 
 # 请求：前台发给后台的内容就叫请求
@@ -47,8 +206,8 @@ class ChatResp(BaseModel):
 {"answer":""}
 
 
-@app.post("/chat", response_model=ChatResp)
-def chat(req: ChatReq):
+def _load_chat_state(req: ChatReq) -> tuple[str, dict]:
+    annotate(requester=req.requester, user_role=req.user_role)
     payload = req.model_dump()
     text = payload.get("text") or payload.get("question") or ""
 
@@ -61,14 +220,29 @@ def chat(req: ChatReq):
     if prev_state:
         merged = {**prev_state, **payload}
         merged["text"] = text
+        merged["question"] = text  # 上一轮（可能被改写过的）question 不能带到这一轮
         payload = merged
+    return sid, payload
 
-    # 3) run router graph
-    out = router_graph.invoke(payload)
 
-    # 4) save new state to redis
-    new_state = {**payload, **out}
-    save_session(sid, new_state)
+@app.post("/chat", response_model=ChatResp)
+def chat(req: ChatReq, request: Request):
+    # 带 X-Profile 头 / ?profile= 或被抽样到的请求，整轮处理过程写一份剖析文件（见 app/profiling.py）
+    with profile_request(wanted_mode(request.headers, request.query_params), "/chat") as tags:
+        sid, payload = _load_chat_state(req)
+
+        # 3) run router graph（按路由过准入控制，池满了直接 503）
+        out = _invoke_admitted(payload)
+
+        # 4) save new state to redis
+        new_state = {**payload, **out}
+        save_session(sid, new_state)
+        tags.update(
+            session_id=sid,
+            route=new_state.get("active_route"),
+            leave_intent=new_state.get("leave_intent") if new_state.get("active_route") == "leave" else None,
+            requester=req.requester,
+        )
 
     return {
         "answer": out.get("answer"),
@@ -78,17 +252,222 @@ def chat(req: ChatReq):
 # chat函数什么时候执行：只要有前台调用了http://localhost:8000/chat之后就会立刻执行
 
 
-@app.post("/ingest")
-async def ingest(
-    file: UploadFile = File(...),
-    visibility: str = Form("public"),
-    doc_id: Optional[str] = Form(None)):
+# 流式输出时只转发生成答案那个节点的 token（改写问题、请假抽取这些中间调用不发给前端）
+STREAM_NODES = {"generate"}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@app.post("/chat/stream")
+def chat_stream(req: ChatReq):
+    """和 /chat 一样的会话语义，用 SSE 边生成边返回。
+
+    事件：token（答案增量）、done（完整答案 + session_id + active_route）、error。
+    请假流程的回复不是大模型逐字生成的，只有 done 事件。
+    """
+    sid, payload = _load_chat_state(req)
+    slot = admission_acquire(_route_pool(payload))  # 池满了在这里就 503，不开始流
+
+    def _events():
+        out: dict = {}
+        run_id = None
+        sent = False  # 已经发出过 token：之后再出错只能发 error 事件，不能再改状态码
+        try:
+            # subgraphs=True 才能拿到 qa 子图里 generate 节点的 token；状态更新只收顶层的（和 /chat 的 invoke 结果一致）
+            # 合并后的问答（qa_graph.shared_answer）不一定自己调大模型，token 从 custom 流过来
+            stream = _router_graph().stream(payload, stream_mode=["messages", "custom", "updates"], subgraphs=True)
+            for namespace, mode, item in stream:
+                if mode == "custom":
+                    if isinstance(item, dict) and item.get("token"):
+                        sent = True
+                        yield _sse("token", {"delta": item["token"]})
+                elif mode == "messages":
+                    chunk, meta = item
+                    if meta.get("langgraph_node") not in STREAM_NODES or not getattr(chunk, "content", ""):
+                        continue
+                    run_id = run_id or chunk.id  # 对冲请求时两个供应商都会吐 token，只转发先到的那个
+                    if chunk.id == run_id:
+                        sent = True
+                        yield _sse("token", {"delta": chunk.content})
+                elif not namespace:
+                    for update in item.values():
+                        out.update(update or {})
+        except AdmissionRejected as e:
+            if not sent:
+                raise  # 还没发出任何东西：交给 chat_stream 返回 503 + Retry-After
+            mark_failed()
+            yield _sse("error", {"message": str(e), "retry_after": e.retry_after, "session_id": sid})
+            return
+        except Exception as e:
+            mark_failed()
+            yield _sse("error", {"message": f"{type(e).__name__}: {e}", "session_id": sid})
+            return
+        finally:
+            slot.release()
+        new_state = {**payload, **out}
+        save_session(sid, new_state)
+        yield _sse("done", {
+            "answer": out.get("answer"),
+            "session_id": sid,
+            "active_route": new_state.get("active_route"),
+        })
+
+    # 先跑到第一个事件再开始响应：所有 LLM 供应商都排不上队时还来得及返回 503，而不是 200 + error 事件
+    events = _events()
+    try:
+        first = next(events)
+    except StopIteration:
+        first = None
+    except AdmissionRejected:
+        slot.release()
+        raise
+    body = itertools.chain([first] if first is not None else [], events)
+    # 客户端在流开始前就断开时生成器不会继续运行，靠 background 兜底释放名额（release 可重复调用）
+    return StreamingResponse(body, media_type="text/event-stream", background=BackgroundTask(slot.release))
+
+
+# ---------- 批量问答 ----------
 
+class BatchChatItem(BaseModel):
+    text: str
+    user_role: str = "public"
+    requester: str = "anonymous"
+    mode: Optional[str] = None
+
+
+class BatchChatReq(BaseModel):
+    items: list[BatchChatItem]
+    concurrency: Optional[int] = None  # 不传就用 settings.batch_max_concurrency
+
+
+class BatchChatItemResp(BaseModel):
+    index: int
+    answer: Optional[str] = None
+    active_route: Optional[str] = None
+    latency_ms: float
+    error: Optional[str] = None
+
+
+class BatchChatResp(BaseModel):
+    results: list[BatchChatItemResp]
+    unique_questions: int
+    total_ms: float
+
+
+def _normalize_question(text: str) -> str:
+    return " ".join((text or "").split()).lower()
+
+
+def _prefetch_qa(question: str, role: str, embedding: list[float]) -> dict:
+    """/chat/batch 的预取：FAQ 能直接回答的不检索（qa 子图会用这里的向量再命中一次，不重复 embed）。
+    返回 state["prefetched"]；带 docs 键表示检索过（可能为空 = 没有证据）。"""
+    prefetched = {"question": question, "embedding": embedding}
+    if settings.faq_enabled:
+        from app.rag.faq import lookup
+
+        try:
+            if lookup(question, role, embedding=embedding)[0]:
+                return prefetched
+        except Exception as e:
+            print(f"[batch] faq lookup failed: {e}")
+    from app.rag.qa_graph import search_docs
+
+    prefetched["docs"], prefetched["debug"] = search_docs(question, role, embedding)
+    return prefetched
+
+
+@app.post("/chat/batch", response_model=BatchChatResp)
+async def chat_batch(req: BatchChatReq):
+    """一次提交多个问题，并发跑 router graph。
+
+    - QA 问题按 (归一化问题, 角色) 去重：相同问题只检索、生成一次，结果分发给所有重复项
+    - 所有 QA 问题的 query embedding 合并成一次 embed_documents 调用
+    - 请假类问题和 requester 相关，逐条单独跑
+    - 预取的检索结果放在 state["prefetched"] 里交给 qa 子图：FAQ 照样先查，singleflight 照样合并
+    - 每组的 token / 费用记到这一组的 requester / user_role 名下（合并的重复问题记在第一条上）
+    不读写 session，每条都是独立的一轮对话。
+    """
+    if not req.items:
+        raise HTTPException(status_code=400, detail="Empty items")
+    if len(req.items) > settings.batch_max_items:
+        raise HTTPException(status_code=400, detail=f"Too many items (max {settings.batch_max_items})")
+
+    from app.router_graph import decide_route
+
+    started = time.perf_counter()
+    limit = max(1, min(req.concurrency or settings.batch_max_concurrency, settings.batch_max_concurrency))
+    sem = asyncio.Semaphore(limit)
+
+    # 1) 分组：QA 问题按 (问题, 角色) 合并，请假问题各自一组
+    groups: dict[tuple, dict] = {}
+    for i, item in enumerate(req.items):
+        payload = item.model_dump()
+        route = decide_route(payload)
+        if route == "qa":
+            key = ("qa", _normalize_question(item.text), (item.user_role or "public").lower())
+        else:
+            key = ("leave", i)
+        group = groups.setdefault(key, {"payload": payload, "indexes": [], "route": route})
+        group["indexes"].append(i)
+
+    qa_keys = [k for k in groups if k[0] == "qa"]
+
+    # 2) 一次性 embed 所有去重后的 QA 问题，再并发检索
+    if qa_keys:
+        questions = [groups[k]["payload"]["text"] for k in qa_keys]
+        vectors = await asyncio.to_thread(get_embeddings().embed_documents, questions)
+
+        async def _prefetch(key, vector):
+            payload = groups[key]["payload"]
+            payload["user_role"] = key[2]
+            t0 = time.perf_counter()
+            with attribution("/chat/batch", requester=payload.get("requester"), user_role=key[2]):
+                async with sem:
+                    payload["prefetched"] = await asyncio.to_thread(_prefetch_qa, payload["text"], key[2], vector)
+            groups[key]["prefetch_ms"] = (time.perf_counter() - t0) * 1000
+
+        await asyncio.gather(*(_prefetch(k, v) for k, v in zip(qa_keys, vectors)))
+
+    # 3) 每组跑一次 router graph
+    results: list[Optional[dict]] = [None] * len(req.items)
+
+    async def _run(group):
+        payload = group["payload"]
+        payload["question"] = payload["text"]
+        t0 = time.perf_counter()
+        with attribution("/chat/batch", requester=payload.get("requester"), user_role=payload.get("user_role")):
+            async with sem:
+                try:
+                    out = await asyncio.to_thread(_invoke_admitted, payload, group["route"])
+                    answer, route, error = out.get("answer"), out.get("active_route"), None
+                except Exception as e:
+                    answer, route, error = None, None, f"{type(e).__name__}: {e}"
+        latency_ms = round((time.perf_counter() - t0) * 1000 + group.get("prefetch_ms", 0.0), 1)
+        for i in group["indexes"]:
+            results[i] = {
+                "index": i,
+                "answer": answer,
+                "active_route": route,
+                "latency_ms": latency_ms,
+                "error": error,
+            }
+
+    await asyncio.gather(*(_run(g) for g in groups.values()))
+
+    return {
+        "results": results,
+        "unique_questions": len(groups),
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+async def _save_upload(file: UploadFile, visibility: str, doc_id: Optional[str]) -> tuple[Path, list]:
+    """落盘（连同 .meta.json）并解析上传的文件；解析失败时把文件删掉再报 400。"""
     if not file.filename:
         raise HTTPException(status_code=400, detail="Empty filename")
 
-    visibility = (visibility or "public").strip().lower()
-
     suffix = Path(file.filename).suffix
     safe_name = f"{int(time.time())}_{uuid.uuid4().hex}{suffix}"
     save_path = DATA_DOCS_DIR / safe_name
@@ -100,45 +479,375 @@ async def ingest(
 
     docs = load_single_file(save_path)
     if not docs:
+        save_path.unlink(missing_ok=True)
         raise HTTPException(status_code=400, detail=f"Unsupported or empty file type: {suffix}")
+    write_doc_meta(save_path, visibility=visibility, doc_id=doc_id)
+    return save_path, docs
+
 
+def _index_docs(docs: list, visibility: str, doc_id: Optional[str], base: str, dedup: Optional[bool] = None) -> dict:
+    """base：corpus_writer() 给出的（现读的）当前 collection。dedup 不传时按 dedup_enabled。"""
     chunks = split_with_visibility(docs, visibility=visibility, doc_id=doc_id)
 
-    vs = get_vs()
-    vs.add_documents(chunks)
+    embeddings = get_embeddings()
+    dedup = settings.dedup_enabled if dedup is None else dedup
+    deduplicated = []
+    if dedup:
+        chunks, deduplicated = dedup_chunks(chunks, get_index(embeddings, base))
+    try:
+        written = add_documents_routed(embeddings, chunks, base=base)  # 分区布局下按 visibility 写进对应分区
+    except Exception:
+        reset_index()  # dedup_chunks 已经把这批指纹加进了缓存，没写进去就不能留着
+        raise
+    if dedup:
+        sync_generations(base, written)
+        record_refs(deduplicated)  # 被跳过的 chunk 依赖哪篇文档，删那篇时要把它们找回来
+    store_parents_for(docs, chunks)  # 只存真正入库的 chunk 引用到的父段落
+    summarized = index_summaries(docs, chunks, embeddings)  # 文档级摘要，两步检索的第一步用
+    return {"chunks": len(chunks), "deduplicated": len(deduplicated), "collections": written, "summarized": summarized}
+
+
+def _remove_doc(doc_id: str, base: str, exclude: Optional[Path] = None) -> dict:
+    """删掉 doc_id 的所有 chunk（每个 collection 一次批量删除）、它们的去重指纹、父段落和源文件。
+
+    exclude：PUT 替换时刚落盘的新文件，它的 .meta.json 里也是这个 doc_id，不能跟着旧版本一起删。
+    返回里的 dependants：入库时有 chunk 被当成这篇的重复跳过的其它文档，调用方要在同一个 corpus_writer 里
+    用 _restore_dependants 把它们补回来。
+    """
+    removed = delete_documents_where(get_embeddings(), {"doc_id": doc_id}, base=base)
+    forget_fingerprints(removed)
+    sync_generations(base, {collection_for(base, m.get("visibility")) for m in removed})
+    delete_parents(m.get("parent_id") for m in removed)
+    files = []
+    docs_root = DATA_DOCS_DIR.resolve()
+    sources = {m.get("source") for m in removed if m.get("source")}
+    # 整篇都被去重掉的上传没有 chunk 可查，靠 .meta.json 里的 doc_id 找到源文件
+    for meta_path in DATA_DOCS_DIR.glob(f"*{META_SUFFIX}"):
+        src = str(meta_path)[: -len(META_SUFFIX)]
+        if src not in sources and read_doc_meta(Path(src)).get("doc_id") == doc_id:
+            sources.add(src)
+    if exclude is not None:
+        keep = exclude.resolve()
+        sources = {s for s in sources if Path(s).resolve() != keep}
+    dependants = take_dependants(sources)
+    delete_summaries(sources)
+    for src in sources:
+        path = Path(src).resolve()
+        if docs_root in path.parents:  # 只删 data/docs 下的文件
+            for f in (path, Path(f"{path}{META_SUFFIX}")):
+                if f.exists():
+                    f.unlink()
+                    files.append(str(f))
+    return {"chunks_deleted": len(removed), "files_deleted": files, "removed": removed, "dependants": dependants}
+
+
+def _restore_dependants(dependants: list[dict], base: str) -> list[str]:
+    """把内容折叠进被删文档的那些文档重新入库一遍（一定带去重）：之前被跳过的 chunk 这次找不到原件就真正写进去，
+    本来就在库里的 chunk 会被当成自己的重复跳过，不会重复 embedding。源文件已经不在的跳过。"""
+    restored = []
+    for dep in dependants:
+        path = Path(dep["source"])
+        docs = load_single_file(path) if path.exists() else []
+        if not docs:
+            continue
+        _index_docs(docs, dep["visibility"], dep.get("doc_id"), base, dedup=True)
+        restored.append(dep["source"])
+    return restored
+
+
+@app.post("/ingest")
+async def ingest(
+    file: UploadFile = File(...),
+    visibility: str = Form("public"),
+    doc_id: Optional[str] = Form(None)):
+
+    visibility = (visibility or "public").strip().lower()
+    # 落盘之前就登记写入：reindex 进行中直接 409，不会留下一个只写进旧版本的文件
+    with corpus_writer() as base:
+        save_path, docs = await _save_upload(file, visibility, doc_id)
+        result = await asyncio.to_thread(_index_docs, docs, visibility, doc_id, base)
 
     return {
         "saved_as": str(save_path),
         "visibility": visibility,
         "doc_id": doc_id,
-        "chunks": len(chunks),
+        **result,
+    }
+
+
+@app.put("/docs/{doc_id}")
+async def replace_doc(
+    doc_id: str,
+    file: UploadFile = File(...),
+    visibility: Optional[str] = Form(None)):
+    """用新文件替换 doc_id：删旧 chunk / 指纹 / 源文件，再入库新内容。代价只和这一篇文档的大小有关。
+    不传 visibility 时沿用旧版本的。"""
+    with corpus_writer() as base:
+        # 先把新文件落盘解析成功，再动旧数据；新文件有问题时旧版本原样保留
+        save_path, docs = await _save_upload(file, (visibility or "public").strip().lower(), doc_id)
+        old = await asyncio.to_thread(_remove_doc, doc_id, base, save_path)
+        if not save_path.exists():
+            # 源文件没了还入库的话，向量能查到，下一次 /reindex 却会把这篇文档悄悄丢掉
+            raise HTTPException(status_code=500, detail=f"new upload {save_path.name} was removed while replacing {doc_id}")
+        if not visibility:
+            visibility = next((m.get("visibility") for m in old["removed"] if m.get("visibility")), "public")
+            write_doc_meta(save_path, visibility=visibility, doc_id=doc_id)
+        visibility = visibility.strip().lower()
+        result = await asyncio.to_thread(_index_docs, docs, visibility, doc_id, base)
+        restored = await asyncio.to_thread(_restore_dependants, old["dependants"], base)
+
+    return {
+        "doc_id": doc_id,
+        "saved_as": str(save_path),
+        "visibility": visibility,
+        "replaced_chunks": old["chunks_deleted"],
+        "files_deleted": old["files_deleted"],
+        "restored": restored,
+        **result,
+    }
+
+
+@app.delete("/docs/{doc_id}")
+def delete_doc(doc_id: str):
+    """删除 doc_id 的所有 chunk、去重指纹和源文件，不用整库 /reindex；
+    入库时被当成它的重复而跳过的其它文档在同一个写入区间里补回来。"""
+    with corpus_writer() as base:
+        result = _remove_doc(doc_id, base)
+        restored = _restore_dependants(result["dependants"], base)
+    if not result["chunks_deleted"] and not result["files_deleted"]:
+        raise HTTPException(status_code=404, detail=f"doc_id {doc_id} not found")
+    return {
+        "doc_id": doc_id,
+        "chunks_deleted": result["chunks_deleted"],
+        "files_deleted": result["files_deleted"],
+        "restored": restored,
     }
 
 
 @app.post("/reindex")
 def reindex(visibility_default: str = Form("public")):
+    """蓝绿重建：建到一个新版本的 collection 里，建完再切指针；建库期间查询照常走当前版本。
+
+    建库期间 /ingest、PUT/DELETE /docs 返回 409（见 vectorstore.begin_reindex），
+    扫描 data/docs 之前先等正在进行的写入结束，所以新版本和磁盘上的文件一致，不会漏写也不会把删掉的文档复活。
+    """
     visibility_default = (visibility_default or "public").strip().lower()
 
-    client = chromadb.HttpClient(host=settings.chroma_host, port=settings.chroma_port)
+    name = new_collection_name()
     try:
-        client.delete_collection(settings.collection_name)
-    except Exception:
-        print('================删除chromadb报错了')
-    client.get_or_create_collection(settings.collection_name)
+        running = begin_reindex(name)
+    except TimeoutError as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "30"})
+    if running:
+        raise HTTPException(status_code=409, detail=f"reindex already in progress ({running})", headers={"Retry-After": "30"})
+
+    try:
+        raw_docs = load_docs(str(DATA_DOCS_DIR))
+        if not raw_docs:
+            return {"chunks": 0, "docs": 0, "message": "No documents found in data/docs"}
+
+        embeddings = get_embeddings()
+        if not settings.vector_partitioning:
+            get_chroma_client().get_or_create_collection(name)  # 单 collection 布局；分区布局写入时按需建分区
+
+        # 重建时从空索引开始，只在本次语料内部去重
+        index = SimHashIndex(max_distance=settings.dedup_max_distance) if settings.dedup_enabled else None
+        try:
+            # 上传时记录的 visibility / doc_id 从 .meta.json 恢复，没有记录的用 visibility_default
+            chunks = apply_doc_meta(split_docs(raw_docs), visibility_default)
+            deduplicated = []
+            if index is not None:
+                chunks, deduplicated = dedup_chunks(chunks, index)
+            add_documents_routed(embeddings, chunks, base=name)
+            store_parents_for(raw_docs, chunks)
+            index_summaries(raw_docs, chunks, embeddings)  # 内容没变的文件沿用已有摘要
+        except Exception:
+            delete_corpus(name)  # 建失败了，半成品直接删，指针不动
+            raise
+
+        previous = activate_collection(name)
+        reset_index(index, name)
+        replace_refs(deduplicated)  # 引用表换成新版本的
+        # 新版本没引用到的父段落（旧版本的、之前失败的重建留下的）清掉；
+        # 宽限期内还在查旧版本的请求找不到父段落时会退回用子 chunk
+        pruned_parents = prune_parents(c.metadata.get("parent_id") for c in chunks)
+        # 摘要同理：只留新版本里有 chunk 的 source
+        pruned_summaries = prune_summaries(str(c.metadata.get("source") or "") for c in chunks)
+    finally:
+        end_reindex(name)
+    gc_deleted = gc_collections()
+
+    return {
+        "docs": len(raw_docs),
+        "chunks": len(chunks),
+        "deduplicated": len(deduplicated),
+        "visibility_default": visibility_default,
+        "collection": name,
+        "corpus_version": version_of(name),
+        "previous_collection": previous,
+        "partitions": sorted(list_partitions(name)),
+        "gc_deleted": gc_deleted,
+        "pruned_parents": pruned_parents,
+        "pruned_summaries": pruned_summaries,
+    }
+
+
+@app.get("/corpus")
+def corpus():
+    """当前语料版本（激活的 collection）和等待回收的旧版本。"""
+    return corpus_status()
+
+
+# ---------- 请假单查询（keyset 分页） ----------
+
+APPROVER_ROLES = {"admin", "hr"}
+
+
+@app.get("/leave/history")
+def leave_history(requester: str, cursor: Optional[str] = None, limit: int = 20):
+    """员工请假历史，新的在前；把返回的 next_cursor 原样带回来取下一页。"""
+    try:
+        rows, next_cursor = get_leave_history_page(requester, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": rows, "next_cursor": next_cursor}
+
+
+@app.get("/leave/pending")
+def leave_pending(
+    user_role: str = "public",
+    leave_type: Optional[str] = None,
+    start_from: Optional[str] = None,
+    start_to: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+):
+    """HR/Admin 待审批队列，按开始时间排序，可按类型和开始时间范围 [start_from, start_to) 筛选。"""
+    if (user_role or "").lower() not in APPROVER_ROLES:
+        raise HTTPException(status_code=403, detail="需要 HR/Admin 角色")
+    try:
+        rows, next_cursor = get_pending_leave_requests(
+            leave_type=leave_type,
+            start_from=start_from,
+            start_to=start_to,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": rows, "next_cursor": next_cursor}
+
+
+class BulkReviewReq(BaseModel):
+    decision: str  # approve / reject
+    approver: str
+    user_role: str = "public"
+    leave_ids: Optional[list[str]] = None
+    # 不给 leave_ids 时按筛选条件处理待审批队列
+    leave_type: Optional[str] = None
+    start_from: Optional[str] = None
+    start_to: Optional[str] = None
+    reason: Optional[str] = None
+    max_items: int = 500
+
+
+@app.post("/leave/bulk_review")
+def leave_bulk_review(req: BulkReviewReq):
+    """批量批准 / 驳回，一个事务内完成，返回每个单号的处理结果。
+    只处理 PENDING 的单；其余单号报告 not_found 或 not_pending:<当前状态>。"""
+    if (req.user_role or "").lower() not in APPROVER_ROLES:
+        raise HTTPException(status_code=403, detail="需要 HR/Admin 角色")
+    decision = {"approve": "APPROVED", "reject": "REJECTED"}.get((req.decision or "").lower())
+    if not decision:
+        raise HTTPException(status_code=400, detail="decision 只能是 approve 或 reject")
+    if not req.leave_ids and not (req.leave_type or req.start_from or req.start_to):
+        raise HTTPException(status_code=400, detail="需要 leave_ids 或至少一个筛选条件")
+    if req.leave_ids and len(req.leave_ids) > req.max_items:
+        raise HTTPException(status_code=400, detail=f"一次最多处理 {req.max_items} 条")
+
+    outcomes = bulk_review_leave_requests(
+        decision,
+        approver=req.approver,
+        leave_ids=req.leave_ids,
+        leave_type=req.leave_type,
+        start_from=req.start_from,
+        start_to=req.start_to,
+        reason=req.reason,
+        max_items=req.max_items,
+    )
+    return {
+        "decision": decision,
+        "updated": sum(1 for o in outcomes.values() if o == decision),
+        "results": [{"leave_id": lid, "outcome": o} for lid, o in outcomes.items()],
+    }
+
+
+# ---------- 剖析文件 ----------
+
+@app.get("/profiles")
+def profiles(user_role: str = "public", limit: int = 50, session_id: Optional[str] = None, route: Optional[str] = None):
+    """最近的单请求剖析文件（新的在前），可按 session_id / route 过滤。"""
+    if (user_role or "").lower() != "admin":
+        raise HTTPException(status_code=403, detail="需要 Admin 角色")
+    return {"items": list_profiles(limit=max(1, min(limit, 500)), session_id=session_id, route=route)}
+
+
+@app.get("/profiles/{profile_id}")
+def profile_download(profile_id: str, user_role: str = "public"):
+    """下载剖析文件：.prof 用 pstats / snakeviz 打开，.folded 用 flamegraph.pl / speedscope 画火焰图。"""
+    if (user_role or "").lower() != "admin":
+        raise HTTPException(status_code=403, detail="需要 Admin 角色")
+    path = profile_file(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="profile not found")
+    return FileResponse(path, filename=path.name, media_type="application/octet-stream")
+
+
+@app.get("/healthz")
+def healthz():
+    """存活检查：只说明进程还活着，不检查外部依赖。"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    """就绪检查：逐个报告依赖状态，任一依赖未就绪返回 503。"""
+    ok, report = readiness()
+    return JSONResponse(
+        status_code=200 if ok else 503,
+        content={"status": "ready" if ok else "not_ready", "checks": report},
+    )
+
+
+@app.get("/llm/providers")
+def llm_providers():
+    """各 LLM 供应商的滚动延迟 / 错误率 / 熔断状态。"""
+    from app.llm_router import get_router
+
+    return {"providers": get_router().status()}
+
+
+@app.get("/metrics/admission")
+def metrics_admission():
+    """各并发池（route:qa / route:leave / llm:<供应商>）的在途数、排队数、放行 / 拒绝次数和等待时间。"""
+    return {"enabled": settings.admission_enabled, "pools": admission_snapshot()}
+
 
-    vs = get_vs()
-    raw_docs = load_docs(str(DATA_DOCS_DIR))
-    if not raw_docs:
-        return {"chunks": 0, "docs": 0, "message": "No documents found in data/docs"}
+@app.get("/metrics/singleflight")
+def singleflight_metrics():
+    """相同问题请求合并的计数：leader 真正算了几次，进程内 / 跨 worker 各跟了多少次，失败自己算了几次。"""
+    from app import singleflight
 
-    chunks = split_docs(raw_docs)
-    for c in chunks:
-        c.metadata = dict(c.metadata or {})
-        c.metadata.setdefault("visibility", visibility_default)
+    return {"enabled": settings.singleflight_enabled, "redis": settings.singleflight_redis, **singleflight.snapshot()}
 
-    vs.add_documents(chunks)
 
-    return {"docs": len(raw_docs), "chunks": len(chunks), "visibility_default": visibility_default}
+@app.get("/metrics/cost")
+def metrics_cost(dimension: str = "endpoint", day: Optional[str] = None):
+    """按天汇总 token / 费用 / 延迟。dimension: endpoint/route/node/requester/user_role/model/provider，
+    day 格式 YYYYMMDD，默认今天。"""
+    if dimension not in COST_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"dimension must be one of {COST_DIMENSIONS}")
+    return cost_summary(dimension, day)
 
 
 @app.get("/")
@@ -0,0 +1,196 @@
+# app/profiling.py
+# 按需的单请求性能剖析：某一轮 /chat 慢了，看时间到底花在 LangGraph、langchain 还是 DB 辅助函数里。
+#
+# 触发方式（任一）：
+#   - 请求头 X-Profile: <token> 或查询参数 ?profile=<token>，必须和 Settings.profile_token 一致；
+#     没配 profile_token 时不认这两个触发（否则任何客户端都能让每个请求跑 cProfile、写盘）
+#   - 按 Settings.profile_sample_rate 随机抽样（0 = 关闭）
+# 剖析方式（X-Profile-Mode 或 Settings.profile_mode）：
+#   cprofile：cProfile 记录处理线程里的每个函数调用，写 .prof（pstats 格式，snakeviz / pstats 直接打开）
+#   sample  ：另起一个线程每隔几毫秒抓一次处理线程的调用栈，写 .folded（flamegraph.pl / speedscope 能画火焰图）
+#             开销小，cProfile 正被别的请求占用时也自动退到这个方式
+# 两种都只看处理这个请求的线程；LLM 对冲、分区检索线程池里的工作只体现为等待时间。
+#
+# 每个剖析文件旁边有一个 .json，记 session_id、route、请假子意图、耗时等，/profiles 列出、下载用。
+# 目录里只保留最新的 Settings.profile_keep 个。
+
+from __future__ import annotations
+
+import cProfile
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+from app.config import settings
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+PROFILE_HEADER = "X-Profile"
+MODE_HEADER = "X-Profile-Mode"
+MODES = {"cprofile": ".prof", "sample": ".folded"}
+PROFILE_ID_RE = re.compile(r"^[0-9]{8}T[0-9]{9}_[0-9a-f]{8}$")
+
+# 同一时刻只让一个请求用 cProfile（同进程里多个 cProfile 互相干扰，3.12 起会直接报错）
+_cprofile_lock = threading.Lock()
+
+
+def profile_dir() -> Path:
+    path = Path(settings.profile_dir)
+    return path if path.is_absolute() else ROOT_DIR / path
+
+
+def wanted_mode(headers, query) -> str | None:
+    """这个请求要不要剖析、用哪种方式；不剖析返回 None。"""
+    flag = None
+    token = headers.get(PROFILE_HEADER) or query.get("profile")
+    if token and settings.profile_token and hmac.compare_digest(token.encode(), settings.profile_token.encode()):
+        flag = "requested"
+    elif settings.profile_sample_rate > 0 and random.random() < settings.profile_sample_rate:
+        flag = "sampled"
+    if not flag:
+        return None
+    mode = (headers.get(MODE_HEADER) or settings.profile_mode).lower()
+    return mode if mode in MODES else "cprofile"
+
+
+class _StackSampler(threading.Thread):
+    """定时抓目标线程的调用栈，按“折叠栈”计数。"""
+
+    def __init__(self, target_ident: int, interval_s: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.target = target_ident
+        self.interval = interval_s
+        self.counts: Counter[str] = Counter()
+        self._stop_evt = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_evt.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stop_evt.set()
+        self.join()
+
+    def dump(self, path: Path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in self.counts.most_common():
+                f.write(f"{stack} {n}\n")
+
+
+@contextmanager
+def profile_request(mode: str | None, endpoint: str) -> Iterator[dict]:
+    """包住请求处理；调用方往 yield 出来的 dict 里补 session_id / route / leave_intent 等标签。
+
+    mode 为 None 时什么都不做（调用方不用写两套分支）。
+    """
+    tags: dict = {}
+    if mode is None:
+        yield tags
+        return
+
+    profiler = sampler = None
+    if mode == "cprofile" and _cprofile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+    else:
+        mode = "sample"
+        sampler = _StackSampler(threading.get_ident(), settings.profile_sample_interval_ms / 1000)
+
+    started = time.time()
+    t0 = time.perf_counter()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        else:
+            sampler.start()
+        yield tags
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        else:
+            sampler.stop()
+        duration_ms = (time.perf_counter() - t0) * 1000
+        try:
+            _save(profiler, sampler, mode, endpoint, tags, started, duration_ms)
+        except Exception as e:
+            print(f"[profiling] save failed: {e}")
+        finally:
+            if profiler is not None:
+                _cprofile_lock.release()
+
+
+def _save(profiler, sampler, mode: str, endpoint: str, tags: dict, started: float, duration_ms: float) -> None:
+    out = profile_dir()
+    out.mkdir(parents=True, exist_ok=True)
+    # 毫秒时间戳开头，按文件名排序就是按时间排序
+    profile_id = f"{datetime.fromtimestamp(started).strftime('%Y%m%dT%H%M%S%f')[:-3]}_{uuid.uuid4().hex[:8]}"
+    data_path = out / f"{profile_id}{MODES[mode]}"
+    if profiler is not None:
+        profiler.dump_stats(str(data_path))
+    else:
+        sampler.dump(data_path)
+    meta = {
+        "id": profile_id,
+        "mode": mode,
+        "endpoint": endpoint,
+        "started_at": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+        "duration_ms": round(duration_ms, 1),
+        "file": data_path.name,
+        **{k: v for k, v in tags.items() if v is not None},
+    }
+    (out / f"{profile_id}.json").write_text(json.dumps(meta, ensure_ascii=False, default=str), encoding="utf-8")
+    _prune(out)
+
+
+def _prune(out: Path) -> None:
+    metas = sorted(out.glob("*.json"), reverse=True)  # id 以时间开头，倒序就是新的在前
+    for meta_path in metas[settings.profile_keep:]:
+        for f in out.glob(f"{meta_path.stem}.*"):
+            f.unlink(missing_ok=True)
+
+
+def list_profiles(limit: int = 50, session_id: str | None = None, route: str | None = None) -> list[dict]:
+    out = profile_dir()
+    if not out.exists():
+        return []
+    items = []
+    for meta_path in sorted(out.glob("*.json"), reverse=True):
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if session_id and meta.get("session_id") != session_id:
+            continue
+        if route and meta.get("route") != route:
+            continue
+        items.append(meta)
+        if len(items) >= limit:
+            break
+    return items
+
+
+def profile_file(profile_id: str) -> Path | None:
+    """按 id 找剖析文件；id 格式不对（防路径穿越）或文件不存在返回 None。"""
+    if not PROFILE_ID_RE.match(profile_id or ""):
+        return None
+    for suffix in MODES.values():
+        path = profile_dir() / f"{profile_id}{suffix}"
+        if path.exists():
+            return path
+    return None
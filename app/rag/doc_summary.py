@@ -0,0 +1,221 @@
+# app/rag/doc_summary.py
+# 文档级摘要索引：每个源文件一条摘要 embedding，检索分两步——先挑文档，再只在这些文档的 chunk 里找。
+#
+# 以前每个问题都在全部 chunk 里检索。部门制度一多，请假问题会和 IT 报修的 chunk 抢名额：
+# 精度下降，chunk 越多检索也越慢。
+# 现在：
+#   - 入库时（/ingest、PUT /docs、/reindex、build_index）按 source 把加载出来的Document拼起来，
+#     生成一段摘要（doc_summary_mode=llm 调大模型，失败或 extractive 时取标题 + 小节标题 + 开头），
+#     embed 后和 visibility / doc_id 一起存进本地 sqlite。内容哈希没变的文件不重新生成（/reindex 不会重复花钱）
+#   - 检索时（qa_graph._search_chunks）：问题向量先和 public + 本角色可见的摘要比余弦相似度，
+#     取前 doc_summary_top_docs 个文档，chunk 检索加上 source in (...) 的限制；
+#     可见文档本来就不多于这个数、或者限制后什么都没查到时，照旧全量检索
+# 摘要矩阵在进程内存里（一篇文档一行，几百篇也就几百 KB），每 corpus_pointer_ttl_s 秒检查一次 sqlite 有没有变。
+#
+# 延迟 / 召回实测：python -m bench.bench_doc_summary
+
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from app.config import settings
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+
+_local = threading.local()
+
+
+def _conn() -> sqlite3.Connection:
+    """每个线程一个连接（sqlite 连接不能跨线程用）。"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        path = Path(settings.doc_summary_path)
+        if not path.is_absolute():
+            path = ROOT_DIR / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(path), timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS doc_summaries ("
+            " source TEXT PRIMARY KEY, content_hash TEXT NOT NULL, visibility TEXT NOT NULL,"
+            " doc_id TEXT, title TEXT, summary TEXT NOT NULL, embedding BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        _local.conn = conn
+    return conn
+
+
+# ---------- 入库 ----------
+
+def _extractive_summary(title: str, docs: list[Document], max_chars: int) -> str:
+    sections = [d.metadata.get("section") for d in docs if (d.metadata or {}).get("section")]
+    head = " ".join(" ".join(d.page_content.split()) for d in docs[:2])
+    text = "；".join([title] * bool(title) + list(dict.fromkeys(sections)) + [head])
+    return text[:max_chars]
+
+
+def summarize(title: str, docs: list[Document], llm=None) -> str:
+    max_chars = settings.doc_summary_chars
+    if settings.doc_summary_mode != "llm":
+        return _extractive_summary(title, docs, max_chars)
+    from app.rag.prompts import DOC_SUMMARY_SYSTEM, DOC_SUMMARY_USER
+
+    if llm is None:
+        from app.depts import get_llm
+
+        llm = get_llm()
+    content = "\n".join(d.page_content for d in docs)[: settings.doc_summary_input_chars]
+    try:
+        out = llm.invoke([
+            SystemMessage(content=DOC_SUMMARY_SYSTEM.format(max_chars=max_chars)),
+            HumanMessage(content=DOC_SUMMARY_USER.format(title=title or "（无）", content=content)),
+        ]).content.strip()
+    except Exception as e:
+        print(f"[doc_summary] summarize failed, using extractive summary: {e}")
+        out = ""
+    return out[: max_chars * 2] or _extractive_summary(title, docs, max_chars)
+
+
+def index_documents(docs: list[Document], chunks: list[Document], embeddings=None) -> int:
+    """给这批加载出来的文档生成 / 更新摘要；visibility、doc_id 取自（去重后）真正入库的 chunk。
+
+    整篇都被去重掉的文档没有 chunk 可查，不建摘要。返回新生成的摘要数。
+    """
+    if not settings.doc_summary_retrieval:
+        return 0
+    by_source: dict[str, list[Document]] = {}
+    for d in docs:
+        src = str((d.metadata or {}).get("source") or "")
+        if src:
+            by_source.setdefault(src, []).append(d)
+    chunk_meta: dict[str, dict] = {}
+    for c in chunks:
+        src = str((c.metadata or {}).get("source") or "")
+        if src in by_source:
+            chunk_meta.setdefault(src, c.metadata)
+
+    conn = _conn()
+    known = dict(conn.execute("SELECT source, content_hash FROM doc_summaries").fetchall())
+    todo = []
+    for src, parts in by_source.items():
+        meta = chunk_meta.get(src)
+        if meta is None:
+            continue
+        digest = hashlib.sha1("\x00".join(p.page_content for p in parts).encode("utf-8")).hexdigest()
+        visibility = meta.get("visibility") or "public"
+        if known.get(src) == digest:
+            # 内容没变，只同步可见性 / doc_id（PUT /docs 可能改了 visibility）
+            with conn:
+                conn.execute(
+                    "UPDATE doc_summaries SET visibility = ?, doc_id = ?, updated_at = ? WHERE source = ?",
+                    (visibility, meta.get("doc_id"), time.time(), src),
+                )
+            continue
+        title = next((p.metadata.get("title") for p in parts if p.metadata.get("title")), "") or parts[0].page_content.split("\n", 1)[0][:50]
+        todo.append((src, digest, visibility, meta.get("doc_id"), title, summarize(title, parts)))
+    if not todo:
+        return 0
+
+    if embeddings is None:
+        from app.depts import get_embeddings
+
+        embeddings = get_embeddings()
+    vectors = embeddings.embed_documents([f"{title}\n{summary}" for _, _, _, _, title, summary in todo])
+    now = time.time()
+    rows = [
+        (*row, np.asarray(vec, dtype=np.float32).tobytes(), now)
+        for row, vec in zip(todo, vectors)
+    ]
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO doc_summaries"
+            " (source, content_hash, visibility, doc_id, title, summary, embedding, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+    return len(rows)
+
+
+def delete_summaries(sources: Iterable[str]) -> int:
+    sources = list(dict.fromkeys(s for s in sources if s))
+    if not sources:
+        return 0
+    conn = _conn()
+    with conn:
+        cur = conn.executemany("DELETE FROM doc_summaries WHERE source = ?", [(s,) for s in sources])
+    return cur.rowcount
+
+
+def prune_summaries(keep: Iterable[str]) -> int:
+    """删掉 keep 以外的所有摘要。/reindex 切换版本后调用：
+    表是全局的，不按 collection 分；不经过 DELETE /docs 删掉的文件、失败的重建留下的行，
+    在新版本里已经没有 chunk，留着会白占 candidate_sources 的名额。
+    """
+    keep = list(dict.fromkeys(s for s in keep if s))
+    conn = _conn()
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_sources (source TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM keep_sources")
+        conn.executemany("INSERT INTO keep_sources (source) VALUES (?)", [(s,) for s in keep])
+        cur = conn.execute("DELETE FROM doc_summaries WHERE source NOT IN (SELECT source FROM keep_sources)")
+        conn.execute("DELETE FROM keep_sources")
+    return cur.rowcount
+
+
+# ---------- 检索第一步：挑文档 ----------
+
+class _SummaryMatrix:
+    def __init__(self, rows: list[tuple[str, str, bytes]]):
+        self.sources = [r[0] for r in rows]
+        self.visibility = np.array([r[1] for r in rows], dtype=object)
+        vecs = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows]) if rows else np.zeros((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True) if rows else None
+        if rows:
+            norms[norms == 0] = 1.0
+            vecs = vecs / norms
+        self.vectors = vecs
+
+
+_matrix: tuple[_SummaryMatrix, tuple, float] | None = None  # (矩阵, sqlite 状态, 下次检查的时间)
+_matrix_lock = threading.Lock()
+
+
+def _summary_matrix() -> _SummaryMatrix:
+    global _matrix
+    now = time.monotonic()
+    if _matrix and _matrix[2] > now:
+        return _matrix[0]
+    with _matrix_lock:
+        conn = _conn()
+        state = tuple(conn.execute("SELECT COUNT(*), COALESCE(MAX(updated_at), 0) FROM doc_summaries").fetchone())
+        if _matrix is None or _matrix[1] != state:
+            rows = conn.execute("SELECT source, visibility, embedding FROM doc_summaries ORDER BY source").fetchall()
+            _matrix = (_SummaryMatrix(rows), state, now + settings.corpus_pointer_ttl_s)
+        else:
+            _matrix = (_matrix[0], state, now + settings.corpus_pointer_ttl_s)
+        return _matrix[0]
+
+
+def candidate_sources(embedding: list[float], role: str, top_docs: int | None = None) -> list[str] | None:
+    """按摘要相似度挑出最相关的几个源文件；不值得分两步（没有摘要、可见文档不多于 top_docs）时返回 None。"""
+    top_docs = top_docs or settings.doc_summary_top_docs
+    m = _summary_matrix()
+    if not m.sources:
+        return None
+    visible = np.flatnonzero(np.isin(m.visibility, ["public", role]))
+    if len(visible) <= top_docs:
+        return None
+    q = np.asarray(embedding, dtype=np.float32)
+    if q.shape[0] != m.vectors.shape[1]:
+        return None  # 换了 embedding 模型、摘要还没重建
+    scores = m.vectors[visible] @ (q / (np.linalg.norm(q) or 1.0))
+    top = visible[np.argsort(-scores)[:top_docs]]
+    return [m.sources[i] for i in top]
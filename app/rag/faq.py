@@ -0,0 +1,286 @@
+# app/rag/faq.py
+# 预先生成的 FAQ 答案索引：高频问题离线检索 + 生成一次，线上命中就直接返回，不再检索、不调大模型。
+#
+# QA 流量大部分是围着几十个制度问题打转的长尾（年假提前几天申请、IT 工单 SLA……），
+# 每次都完整走一遍 embed -> 检索 -> qwen-max 很浪费。
+#
+# 离线任务（python -m app.rag.faq build）：
+#   - 问题来源：管理员维护的列表（Settings.faq_questions_file）+ 会话里挖出来的高频问题
+#     （redis 里 sid-* 会话的最近几轮，同一会话只算一次，出现 >= faq_session_min_count 次）
+#   - 每个问题按角色（默认只有 public）正常检索、生成；没检索到、只能靠无过滤兜底检索到、
+#     或者答案里没有引用编号的都不收（答案必须有据可查）
+#   - 问题的 embedding + 答案落盘到 app/faq_index/<当前语料 collection>/，
+#     同时记下生成时各 collection 的内容代次（quantized.generation）
+# 线上（qa_graph.decide_retrieve_node）：
+#   - 归一化后完全相同的问题直接命中；否则按 embedding 余弦相似度，>= faq_min_score 才算命中
+#   - 只匹配 public 和本角色的条目；语料换了版本、或者当前语料被写入过（代次变了），索引自动作废
+#   - 没命中时把算好的 embedding 交给后面的检索，不会多 embed 一次
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import shutil
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from app.config import settings
+from app.db.llm_cache import normalize_text
+
+INDEX_DIR = Path(__file__).resolve().parent.parent / "faq_index"
+ROOT_DIR = Path(__file__).resolve().parents[2]
+CITATION_RE = re.compile(r"\[\d+\]")
+
+
+class FAQIndex:
+    def __init__(self, entries: list[dict], vectors: np.ndarray, meta: dict):
+        self.entries = entries
+        self.meta = meta
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(entries), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.vectors = vectors / norms
+        self.roles = np.array([e["role"] for e in entries], dtype=object)
+        self.exact = {(e["norm"], e["role"]): i for i, e in enumerate(entries)}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def match_exact(self, question: str, roles: tuple[str, ...]) -> dict | None:
+        norm = normalize_text(question)
+        for role in roles:
+            i = self.exact.get((norm, role))
+            if i is not None:
+                return {**self.entries[i], "score": 1.0}
+        return None
+
+    def match_vector(self, embedding: list[float], roles: tuple[str, ...]) -> dict | None:
+        q = np.asarray(embedding, dtype=np.float32)
+        if q.shape[0] != self.vectors.shape[1]:
+            return None  # 换了 embedding 后端、FAQ 索引还没重建
+        q = q / (np.linalg.norm(q) or 1.0)
+        scores = np.where(np.isin(self.roles, roles), self.vectors @ q, -1.0)
+        i = int(np.argmax(scores))
+        if scores[i] < settings.faq_min_score:
+            return None
+        return {**self.entries[i], "score": round(float(scores[i]), 4)}
+
+    def save(self, path: Path) -> None:
+        tmp = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        np.save(tmp / "vectors.npy", self.vectors)
+        with open(tmp / "entries.json", "w", encoding="utf-8") as f:
+            json.dump({**self.meta, "entries": self.entries}, f, ensure_ascii=False)
+        # 先写临时目录再换上去，线上进程不会读到写了一半的索引
+        shutil.rmtree(path, ignore_errors=True)
+        tmp.rename(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "FAQIndex":
+        with open(path / "entries.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        entries = meta.pop("entries")
+        return cls(entries, np.load(path / "vectors.npy"), meta)
+
+
+def _generations(base: str) -> dict[str, int]:
+    from app.rag.quantized import corpus_generations
+
+    return corpus_generations(base)
+
+
+# ---------- 线上查询 ----------
+
+_cache: dict[str, tuple[FAQIndex | None, float]] = {}  # collection -> (索引或 None, 下次检查的时间)
+_lock = threading.Lock()
+
+
+def get_faq_index() -> FAQIndex | None:
+    """当前语料对应的 FAQ 索引；没建过或已经过期返回 None。每 corpus_pointer_ttl_s 秒最多检查一次。"""
+    from app.rag.vectorstore import active_collection_name
+
+    base = active_collection_name()
+    now = time.monotonic()
+    cached = _cache.get(base)
+    if cached and cached[1] > now:
+        return cached[0]
+    with _lock:
+        cached = _cache.get(base)
+        if cached and cached[1] > now:
+            return cached[0]
+        index = None
+        path = INDEX_DIR / base
+        if (path / "entries.json").exists():
+            try:
+                index = FAQIndex.load(path)
+                if index.meta.get("generations") != _generations(base):
+                    index = None  # 建索引之后语料又被写入过，答案可能过时了
+            except Exception as e:
+                print(f"[faq] load {path} failed: {e}")
+                index = None
+        _cache[base] = (index, now + settings.corpus_pointer_ttl_s)
+        return index
+
+
+def lookup(question: str, role: str, embedding: list[float] | None = None) -> tuple[dict | None, list[float] | None]:
+    """返回 (命中的条目, 问题的 embedding)。
+
+    embedding：调用方已经算好的问题向量（/chat/batch 批量 embed 过），传了就不再 embed。
+    没有可用索引、或者归一化后完全命中时不做 embedding，返回的 embedding 就是传进来的（可能为 None）。
+    """
+    index = get_faq_index()
+    if index is None or not len(index):
+        return None, embedding
+    roles = (role, "public") if role != "public" else ("public",)
+    hit = index.match_exact(question, roles)
+    if hit is not None:
+        return hit, embedding
+    if embedding is None:
+        from app.depts import get_embeddings
+
+        embedding = get_embeddings().embed_query(question)
+    return index.match_vector(embedding, roles), embedding
+
+
+# ---------- 离线构建 ----------
+
+def read_question_file(path: str | Path) -> list[str]:
+    path = Path(path)
+    if not path.is_absolute():
+        path = ROOT_DIR / path
+    if not path.exists():
+        return []
+    lines = path.read_text(encoding="utf-8").splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.lstrip().startswith("#")]
+
+
+def mine_session_questions(min_count: int, limit: int) -> list[str]:
+    """从 redis 里还没过期的会话中挑出问得多的 QA 问题（同一会话只算一次）。"""
+    from app.db.redis_session import get_redis
+
+    r = get_redis()
+    counts: Counter[str] = Counter()
+    first_seen: dict[str, str] = {}
+    for key in r.scan_iter(match="sid-*", count=500):
+        try:
+            state = json.loads(r.get(key) or "{}")
+        except Exception:
+            continue
+        if not isinstance(state, dict):
+            continue
+        asked = [t.get("q") for t in (state.get("memory") or {}).get("turns") or []]
+        if state.get("active_route") == "qa":
+            asked.append(state.get("question") or state.get("text"))
+        seen = set()
+        for q in asked:
+            norm = normalize_text(q or "")
+            if norm and norm not in seen and not norm.endswith("…"):  # 记忆里截断过的问题不要
+                seen.add(norm)
+                counts[norm] += 1
+                first_seen.setdefault(norm, q.strip())
+    return [first_seen[n] for n, c in counts.most_common(limit) if c >= min_count]
+
+
+def build(questions: list[str], roles: list[str], force: bool = False) -> FAQIndex | None:
+    """给当前语料生成 FAQ 索引；语料没变且不 force 时直接用已有的。"""
+    from app.depts import get_embeddings, get_llm
+    from app.rag.qa_graph import answer_messages, search_docs
+    from app.rag.vectorstore import active_collection_name
+
+    base = active_collection_name()
+    path = INDEX_DIR / base
+    gens = _generations(base)
+    if not force and (path / "entries.json").exists():
+        try:
+            existing = FAQIndex.load(path)
+            if existing.meta.get("generations") == gens:
+                print(f"[faq] {base}: index is up to date ({len(existing)} entries), use --force to rebuild")
+                return existing
+        except Exception as e:
+            print(f"[faq] existing index unreadable, rebuilding: {e}")
+
+    # 归一化后相同的问题只留第一个
+    unique: dict[str, str] = {}
+    for q in questions:
+        unique.setdefault(normalize_text(q), q.strip())
+
+    llm = get_llm()
+    entries, skipped = [], []
+    for role in roles:
+        for norm, q in unique.items():
+            docs, debug = search_docs(q, role)
+            if not docs or debug == "fallback_unfiltered":
+                skipped.append((role, q, "no visible evidence"))
+                continue
+            answer = llm.invoke(answer_messages(q, docs)).content.strip()
+            if not CITATION_RE.search(answer):
+                skipped.append((role, q, "answer has no citation"))
+                continue
+            entries.append({
+                "question": q,
+                "norm": norm,
+                "role": role,
+                "answer": answer,
+                "sources": [{"source": d.metadata.get("source"), "page": d.metadata.get("page")} for d in docs[:6]],
+            })
+
+    texts = list(dict.fromkeys(e["question"] for e in entries))
+    vectors = get_embeddings().embed_documents(texts) if texts else []
+    by_text = dict(zip(texts, vectors))
+    index = FAQIndex(
+        entries,
+        np.asarray([by_text[e["question"]] for e in entries], dtype=np.float32),
+        {"collection": base, "generations": gens, "built_at": time.strftime("%Y-%m-%d %H:%M:%S")},
+    )
+    index.save(path)
+    # 旧语料版本的 FAQ 索引用不到了
+    for old in INDEX_DIR.iterdir():
+        if old.is_dir() and old != path:
+            shutil.rmtree(old, ignore_errors=True)
+    _cache.pop(base, None)
+    for role, q, reason in skipped:
+        print(f"[faq] skipped ({role}) {q}: {reason}")
+    print(f"[faq] {base}: {len(entries)} entries, {len(skipped)} skipped")
+    return index
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="预生成 FAQ 答案索引")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="给当前语料生成 FAQ 索引")
+    b.add_argument("--questions", default=settings.faq_questions_file, help="管理员维护的问题列表（一行一个）")
+    b.add_argument("--no-sessions", action="store_true", help="不从会话里挖高频问题")
+    b.add_argument("--min-count", type=int, default=settings.faq_session_min_count)
+    b.add_argument("--max-questions", type=int, default=settings.faq_max_questions)
+    b.add_argument("--roles", default="public", help="逗号分隔，按角色分别生成（答案只用该角色可见的文档）")
+    b.add_argument("--force", action="store_true")
+    sub.add_parser("show", help="查看当前语料的 FAQ 索引")
+    args = parser.parse_args()
+
+    if args.cmd == "show":
+        index = get_faq_index()
+        if index is None:
+            print("no usable FAQ index for the active corpus")
+            return
+        print(json.dumps(index.meta, ensure_ascii=False))
+        for e in index.entries:
+            print(f"({e['role']}) {e['question']}")
+        return
+
+    questions = read_question_file(args.questions)
+    if not args.no_sessions:
+        try:
+            questions += mine_session_questions(args.min_count, args.max_questions)
+        except Exception as e:
+            print(f"[faq] mining sessions failed: {e}")
+    build(questions, [r.strip() for r in args.roles.split(",") if r.strip()], force=args.force)
+
+
+if __name__ == "__main__":
+    main()
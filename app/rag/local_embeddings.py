@@ -0,0 +1,273 @@
+# app/rag/local_embeddings.py
+# 纯 CPU 的本地 embedding：不走网络，离线部署 / 没有外网的环境也能入库、检索、跑测试。
+#
+# get_embeddings() 以前只有 DashScope（text-embedding-v2），每个查询都要付一次公网往返，
+# 没网的时候入库和测试都跑不起来。Settings.embedding_backend 现在可以选：
+#   dashscope：原来的远程模型（默认）
+#   hashing  ：字符 n-gram 哈希 TF-IDF。文本按 unicode 码点转成 numpy 数组，n-gram 的哈希、
+#              分桶计数全是向量化运算；带符号哈希减小冲突偏差，tf 取 log1p，乘 idf 后 L2 归一化
+#              idf 用 python -m app.rag.local_embeddings fit 在语料上统计一次（没有就全按 1 算）
+#   onnx     ：本地小模型（比如导出成 ONNX 的 bge-small-zh），目录里放 model.onnx + tokenizer.json，
+#              需要额外装 onnxruntime 和 tokenizers
+# 两种本地后端都按 local_embedding_batch_size 分批、多线程跑（numpy / onnxruntime 计算时会释放 GIL）。
+#
+# 注意：不同后端（以及不同的维度 / n-gram / idf）产生的向量互不兼容，切换后要 /reindex，FAQ 索引也要重建。
+# 和远程模型的召回 / 延迟对比：python -m bench.bench_embeddings
+
+from __future__ import annotations
+
+import argparse
+import json
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.config import settings
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+
+_PRIME = np.uint64(1_000_003)
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _resolve(path: str) -> Path:
+    p = Path(path)
+    return p if p.is_absolute() else ROOT_DIR / p
+
+
+def _normalize(text: str) -> str:
+    # 全角半角、大小写、空白统一掉，“ＶＰＮ”和“vpn”算同一个词
+    return " ".join(unicodedata.normalize("NFKC", text or "").lower().split())
+
+
+class _Batched(Embeddings):
+    """分批 + 多线程的公共部分；子类实现 _embed_batch(texts) -> (n, dim) 的 float32 矩阵。"""
+
+    batch_size: int
+    threads: int
+
+    def _embed_batch(self, texts: list[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    @property
+    def _pool(self) -> ThreadPoolExecutor:
+        pool = getattr(self, "_pool_obj", None)
+        if pool is None:
+            pool = self._pool_obj = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="embed")
+        return pool
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or self.threads <= 1:
+            parts = [self._embed_batch(b) for b in batches]
+        else:
+            parts = list(self._pool.map(self._embed_batch, batches))
+        return np.concatenate(parts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed_batch([text])[0].tolist()
+
+
+class HashingEmbeddings(_Batched):
+    """字符 n-gram 哈希 TF-IDF。"""
+
+    def __init__(
+        self,
+        dim: int = 1024,
+        ngrams: tuple[int, ...] = (1, 2, 3),
+        idf: np.ndarray | None = None,
+        batch_size: int = 64,
+        threads: int = 4,
+    ):
+        self.dim = dim
+        self.ngrams = tuple(ngrams)
+        self.idf = idf.astype(np.float32) if idf is not None else None
+        self.batch_size = batch_size
+        self.threads = threads
+
+    def _counts(self, texts: list[str]) -> np.ndarray:
+        """整批文本的带符号 n-gram 桶计数，(len(texts), dim)。
+
+        整批文本的码点拼成一个数组，n-gram 哈希、分桶、计数都是对整批做的向量化运算；
+        跨越两段文本边界的 n-gram 丢掉。
+        """
+        cps = [np.frombuffer(_normalize(t).encode("utf-32-le"), dtype=np.uint32) for t in texts]
+        lens = np.fromiter((len(c) for c in cps), dtype=np.int64, count=len(cps))
+        out = np.zeros(len(texts) * self.dim, dtype=np.float64)
+        if not lens.sum():
+            return out.reshape(len(texts), self.dim)
+        cp = np.concatenate(cps).astype(np.uint64)
+        row = np.repeat(np.arange(len(texts), dtype=np.int64), lens)
+        with np.errstate(over="ignore"):  # uint64 乘法溢出就是要的取模效果
+            for n in self.ngrams:
+                m = len(cp) - n + 1
+                if m <= 0:
+                    continue
+                h = np.full(m, n, dtype=np.uint64)
+                for j in range(n):
+                    h = h * _PRIME + cp[j:j + m]
+                keep = row[:m] == row[n - 1:n - 1 + m]
+                h = h[keep]
+                h ^= h >> np.uint64(29)
+                h *= _MIX
+                h ^= h >> np.uint64(32)
+                flat = row[:m][keep] * self.dim + (h % np.uint64(self.dim)).astype(np.int64)
+                signs = np.where((h >> np.uint64(63)) == 1, -1.0, 1.0)
+                out += np.bincount(flat, weights=signs, minlength=len(out))
+        return out.reshape(len(texts), self.dim)
+
+    def _embed_batch(self, texts: list[str]) -> np.ndarray:
+        v = self._counts(texts)
+        v = np.sign(v) * np.log1p(np.abs(v))  # 次线性 tf，长文本里重复的词不会压倒一切
+        if self.idf is not None:
+            v *= self.idf
+        v = v.astype(np.float32)
+        norms = np.linalg.norm(v, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return v / norms
+
+    def fit_idf(self, texts: list[str]) -> np.ndarray:
+        """按桶统计文档频率：idf = ln((1 + N) / (1 + df)) + 1。"""
+        df = np.zeros(self.dim, dtype=np.float64)
+        for i in range(0, len(texts), self.batch_size):
+            df += (self._counts(texts[i:i + self.batch_size]) != 0).sum(axis=0)
+        return (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+
+
+class OnnxEmbeddings(_Batched):
+    """本地 ONNX 句向量模型（BERT 类），CLS 或 mean pooling 后 L2 归一化。"""
+
+    def __init__(
+        self,
+        model_dir: str | Path,
+        pooling: str = "cls",
+        query_instruction: str = "",
+        max_length: int = 512,
+        batch_size: int = 32,
+        threads: int = 4,
+    ):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(model_dir / "model.onnx"), opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.pooling = pooling
+        self.query_instruction = query_instruction
+        self.batch_size = batch_size
+        # onnxruntime 自己在算子内部多线程，外面再开线程只会抢核；分批并发只开 1 路
+        self.threads = 1
+
+    def _embed_batch(self, texts: list[str]) -> np.ndarray:
+        enc = self.tokenizer.encode_batch([t or " " for t in texts])
+        ids = np.asarray([e.ids for e in enc], dtype=np.int64)
+        mask = np.asarray([e.attention_mask for e in enc], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(ids)
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        if self.pooling == "mean":
+            m = mask[:, :, None].astype(np.float32)
+            vecs = (hidden * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+        else:
+            vecs = hidden[:, 0]
+        vecs = vecs.astype(np.float32)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vecs / norms
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed_batch([self.query_instruction + text])[0].tolist()
+
+
+# ---------- 按 Settings 构造（进程内只建一次，ONNX 模型加载很慢） ----------
+
+def _ngrams() -> tuple[int, ...]:
+    return tuple(int(n) for n in settings.local_embedding_ngrams.split(",") if n.strip())
+
+
+def _load_idf(dim: int, ngrams: tuple[int, ...]) -> np.ndarray | None:
+    path = _resolve(settings.local_embedding_idf_path)
+    if not path.exists():
+        return None
+    meta_path = path.with_suffix(".json")
+    meta = json.loads(meta_path.read_text(encoding="utf-8")) if meta_path.exists() else {}
+    if meta.get("dim") != dim or tuple(meta.get("ngrams") or ()) != ngrams:
+        print(f"[local_embeddings] {path} was fitted with dim={meta.get('dim')} ngrams={meta.get('ngrams')}, ignoring")
+        return None
+    return np.load(path)
+
+
+@lru_cache(maxsize=1)
+def get_local_embeddings() -> tuple[Embeddings, str]:
+    """返回 (embedding 模型, 记账用的模型名)。"""
+    backend = settings.embedding_backend
+    if backend == "hashing":
+        dim, ngrams = settings.local_embedding_dim, _ngrams()
+        emb = HashingEmbeddings(
+            dim=dim,
+            ngrams=ngrams,
+            idf=_load_idf(dim, ngrams),
+            batch_size=settings.local_embedding_batch_size,
+            threads=settings.local_embedding_threads,
+        )
+        return emb, f"local-hashing-{dim}"
+    if backend == "onnx":
+        if not settings.onnx_embedding_model:
+            raise ValueError("EMBEDDING_BACKEND=onnx needs ONNX_EMBEDDING_MODEL (directory with model.onnx + tokenizer.json)")
+        path = _resolve(settings.onnx_embedding_model)
+        emb = OnnxEmbeddings(
+            path,
+            pooling=settings.onnx_embedding_pooling,
+            query_instruction=settings.onnx_query_instruction,
+            batch_size=settings.local_embedding_batch_size,
+            threads=settings.local_embedding_threads,
+        )
+        return emb, f"onnx:{path.name}"
+    raise ValueError(f"unsupported embedding backend: {backend}")
+
+
+def fit(docs_dir: str) -> Path:
+    """在语料的 chunk 上统计哈希 TF-IDF 的 idf 并落盘；之后要 /reindex，库里的向量才会用上新的 idf。"""
+    from app.ingestion.loader import load_docs
+
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=settings.chunk_size, chunk_overlap=settings.chunk_overlap)
+    texts = [c.page_content for c in splitter.split_documents(load_docs(docs_dir))]
+    dim, ngrams = settings.local_embedding_dim, _ngrams()
+    idf = HashingEmbeddings(dim=dim, ngrams=ngrams).fit_idf(texts)
+    path = _resolve(settings.local_embedding_idf_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.save(path, idf)
+    path.with_suffix(".json").write_text(
+        json.dumps({"dim": dim, "ngrams": list(ngrams), "chunks": len(texts)}), encoding="utf-8"
+    )
+    get_local_embeddings.cache_clear()
+    print(f"[local_embeddings] idf fitted on {len(texts)} chunks -> {path}")
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地哈希 TF-IDF embedding 的 idf 统计")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    f = sub.add_parser("fit", help="在语料上统计 idf")
+    f.add_argument("--docs", default="data/docs")
+    args = parser.parse_args()
+    if args.cmd == "fit":
+        fit(args.docs)
+
+
+if __name__ == "__main__":
+    main()
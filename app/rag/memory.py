@@ -0,0 +1,125 @@
+# app/rag/memory.py
+# 多轮问答的会话记忆：最近 N 轮原样保留 + 更早对话的滚动摘要，总量限定在固定 token 预算内。
+#
+# 以前 QAState 里有 messages，但 save_session 会把它丢掉（DROP_KEYS），
+# “那病假呢？”这种追问只能拿着 4 个字去检索。把完整历史存下来又会让每轮的 prompt 和 redis 里的 session 无限变大。
+#
+# 现在 session 里存一个 memory 字典：
+#   {"summary": "...", "turns": [{"q": ..., "a": ...}, ...], "folded": 已折叠进摘要的轮数}
+# - 每轮回答后 remember()：新的一轮追加到 turns；超过 memory_max_turns 轮、或者总 token 超预算时，
+#   最早的几轮连同旧摘要交给大模型合并成新摘要（增量更新，不会把全部历史重新摘要一遍）
+# - 检索前 condense_question()：看起来像追问的问题，结合记忆改写成完整问题再去检索
+# 不管会话多长，记忆和改写用的 prompt 都是常数大小。
+
+from __future__ import annotations
+
+from typing import Any
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from app.accounting import count_tokens
+from app.config import settings
+from app.rag.prompts import CONDENSE_SYSTEM, CONDENSE_USER, MEMORY_SUMMARY_SYSTEM, MEMORY_SUMMARY_USER
+
+# 追问的特征：以这些词开头，或者句子里带指代 / “呢”
+FOLLOWUP_PREFIXES = ("那", "还有", "另外", "再", "它", "这", "同样", "如果", "假如", "要是")
+FOLLOWUP_MARKERS = ("呢", "它", "这个", "那个", "这种", "那种", "上面", "刚才", "前面", "同上", "一样")
+FOLLOWUP_MAX_LEN = 8  # 这么短的问题基本都要靠上下文
+
+
+def empty_memory() -> dict:
+    return {"summary": "", "turns": [], "folded": 0}
+
+
+def _clip(text: str, max_chars: int) -> str:
+    text = (text or "").strip()
+    return text if len(text) <= max_chars else text[:max_chars] + "…"
+
+
+def _clip_tokens(text: str, max_tokens: int) -> str:
+    """超预算时保留末尾（摘要越往后越新）。"""
+    while text and count_tokens(text) > max_tokens:
+        text = text[len(text) // 8 + 1:]
+    return text
+
+
+def render(memory: dict | None) -> str:
+    memory = memory or {}
+    lines = []
+    if memory.get("summary"):
+        lines.append(f"（更早的对话摘要）{memory['summary']}")
+    for t in memory.get("turns") or []:
+        lines.append(f"用户：{t['q']}")
+        lines.append(f"助手：{t['a']}")
+    return "\n".join(lines)
+
+
+def memory_tokens(memory: dict | None) -> int:
+    return count_tokens(render(memory))
+
+
+def is_followup(question: str) -> bool:
+    q = (question or "").strip()
+    if not q:
+        return False
+    return len(q) <= FOLLOWUP_MAX_LEN or q.startswith(FOLLOWUP_PREFIXES) or any(m in q for m in FOLLOWUP_MARKERS)
+
+
+def condense_question(question: str, memory: dict | None, llm: Any = None) -> str:
+    """追问 + 记忆 -> 可以单独检索的完整问题；不是追问、没有记忆或改写失败时原样返回。"""
+    if not memory or not (memory.get("turns") or memory.get("summary")) or not is_followup(question):
+        return question
+    if llm is None:
+        from app.depts import get_llm
+
+        llm = get_llm()
+    try:
+        out = llm.invoke([
+            SystemMessage(content=CONDENSE_SYSTEM),
+            HumanMessage(content=CONDENSE_USER.format(history=render(memory), question=question)),
+        ]).content.strip()
+    except Exception as e:
+        print(f"[memory] condense failed: {e}")
+        return question
+    # 改写结果明显不对（空的、长篇大论）就不用
+    if not out or len(out) > max(100, len(question) * 10):
+        return question
+    return out
+
+
+def _summarize(summary: str, evicted: list[dict], llm: Any = None) -> str:
+    max_tokens = settings.memory_summary_tokens
+    turns = "\n".join(f"用户：{t['q']}\n助手：{t['a']}" for t in evicted)
+    if llm is None:
+        from app.depts import get_llm
+
+        llm = get_llm()
+    try:
+        new = llm.invoke([
+            SystemMessage(content=MEMORY_SUMMARY_SYSTEM.format(max_chars=max_tokens)),
+            HumanMessage(content=MEMORY_SUMMARY_USER.format(summary=summary or "（无）", turns=turns)),
+        ]).content.strip()
+    except Exception as e:
+        # 摘要失败不影响回答：退化成把移出的问题直接拼到摘要后面
+        print(f"[memory] summarize failed: {e}")
+        new = "；".join([summary] * bool(summary) + [f"问过：{t['q']}" for t in evicted])
+    return _clip_tokens(new, max_tokens)
+
+
+def remember(memory: dict | None, question: str, answer: str, llm: Any = None) -> dict:
+    """记下一轮问答，必要时把最早的几轮折叠进摘要，返回新的 memory。"""
+    memory = memory or empty_memory()
+    turns = list(memory.get("turns") or [])
+    turns.append({"q": _clip(question, settings.memory_answer_chars), "a": _clip(answer, settings.memory_answer_chars)})
+
+    # 超过轮数上限时一次折叠到只剩一半，摘要调用摊到每几轮一次，而不是每轮都调
+    max_turns = max(1, settings.memory_max_turns)
+    n_evict = len(turns) - max(1, max_turns // 2) if len(turns) > max_turns else 0
+    summary = memory.get("summary") or ""
+    # 轮数没超但 token 超预算（回答都很长）时，多折叠几轮；至少保留最新一轮
+    while n_evict < len(turns) - 1 and memory_tokens({"summary": summary, "turns": turns[n_evict:]}) > settings.memory_token_budget:
+        n_evict += 1
+
+    if n_evict:
+        summary = _summarize(summary, turns[:n_evict], llm)
+    return {"summary": summary, "turns": turns[n_evict:], "folded": int(memory.get("folded") or 0) + n_evict}
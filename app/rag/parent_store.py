@@ -0,0 +1,151 @@
+# app/rag/parent_store.py
+# 小块检索、大块作答（parent document retrieval）用的父文档存储。
+#
+# 200 字的 chunk 适合做向量匹配，但拿来回答问题太碎：generate_answer 要塞 6 块还经常缺上下文。
+# 现在入库时每个“父段落”（docx 的一个标题小节 / PDF 的一页 / md 的一个标题段）
+# 生成一个 parent_id 写进它所有子 chunk 的元数据，父段落原文只在这里存一份（不做 embedding）；
+# 检索命中子 chunk 后按 parent_id 去重，换成完整的父段落交给大模型。
+#
+# 存储用本地 sqlite（标准库自带，单文件，多进程读没问题）；parent_id 是 来源 + 位置 + 内容 的哈希，
+# 同一段内容重复入库只会覆盖成同一行。
+# 父段落在向量写入之后才存，而且只存被入库 chunk 引用到的（store_parents_for）；
+# /reindex 切换版本后按新版本引用到的 parent_id 清理一遍（prune_parents），库不会越积越大。
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable
+
+from langchain_core.documents import Document
+
+from app.config import settings
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+
+_local = threading.local()
+
+
+def parent_id_for(doc: Document, locator: str) -> str:
+    src = str((doc.metadata or {}).get("source") or "")
+    raw = f"{src}\x00{locator}\x00{doc.page_content}".encode("utf-8")
+    return "p_" + hashlib.sha1(raw).hexdigest()[:20]
+
+
+def _conn() -> sqlite3.Connection:
+    """每个线程一个连接（sqlite 连接不能跨线程用）。"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        path = Path(settings.parent_store_path)
+        if not path.is_absolute():
+            path = ROOT_DIR / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(path), timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS parents ("
+            " id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        _local.conn = conn
+    return conn
+
+
+def put_parents(docs: Iterable[Document]) -> int:
+    """写入父段落（按 metadata["parent_id"]），已存在的覆盖。"""
+    rows = [
+        (d.metadata["parent_id"], d.page_content, json.dumps(d.metadata, ensure_ascii=False, default=str))
+        for d in docs
+        if (d.metadata or {}).get("parent_id")
+    ]
+    if rows:
+        conn = _conn()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO parents (id, content, metadata) VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+
+def store_parents_for(docs: Iterable[Document], chunks: Iterable[Document]) -> int:
+    """只写入真正入库的 chunk 引用到的父段落：子 chunk 全被去重掉的父段落不存。"""
+    used = {(c.metadata or {}).get("parent_id") for c in chunks}
+    used.discard(None)
+    return put_parents(d for d in docs if (d.metadata or {}).get("parent_id") in used)
+
+
+def prune_parents(keep: Iterable[str]) -> int:
+    """删掉 keep 以外的所有父段落。/reindex 切换版本后调用，清理旧版本和失败的重建留下的行。"""
+    keep = list(dict.fromkeys(i for i in keep if i))
+    conn = _conn()
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_parents (id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM keep_parents")
+        conn.executemany("INSERT INTO keep_parents (id) VALUES (?)", [(i,) for i in keep])
+        cur = conn.execute("DELETE FROM parents WHERE id NOT IN (SELECT id FROM keep_parents)")
+        conn.execute("DELETE FROM keep_parents")
+    return cur.rowcount
+
+
+def get_parents(ids: list[str]) -> dict[str, Document]:
+    if not ids:
+        return {}
+    marks = ",".join("?" * len(ids))
+    cur = _conn().execute(f"SELECT id, content, metadata FROM parents WHERE id IN ({marks})", ids)
+    return {pid: Document(page_content=content, metadata=json.loads(meta)) for pid, content, meta in cur}
+
+
+def delete_parents(ids: Iterable[str]) -> int:
+    ids = list(dict.fromkeys(i for i in ids if i))
+    if not ids:
+        return 0
+    conn = _conn()
+    with conn:
+        cur = conn.executemany("DELETE FROM parents WHERE id = ?", [(i,) for i in ids])
+    return cur.rowcount
+
+
+def _window(parent: str, child: str, max_chars: int) -> str:
+    """父段落太长时，截取以命中子块为中心的 max_chars 个字。"""
+    if len(parent) <= max_chars:
+        return parent
+    pos = parent.find(child[:50]) if child else -1
+    if pos < 0:
+        return parent[:max_chars]
+    start = max(0, min(pos + len(child) // 2 - max_chars // 2, len(parent) - max_chars))
+    return parent[start:start + max_chars]
+
+
+def expand_to_parents(chunks: list[Document], max_parents: int | None = None, max_chars: int | None = None) -> list[Document]:
+    """子 chunk（按相关度排好序）-> 去重后的父段落，保持首次命中的顺序。
+
+    没有 parent_id（旧数据）或者父段落查不到的，原样保留子 chunk。
+    """
+    max_parents = max_parents or settings.parent_max
+    max_chars = max_chars or settings.parent_max_chars
+    order: list[str | Document] = []
+    first_child: dict[str, Document] = {}
+    for c in chunks:
+        pid = (c.metadata or {}).get("parent_id")
+        if not pid:
+            order.append(c)
+        elif pid not in first_child:
+            first_child[pid] = c
+            order.append(pid)
+        if len(order) >= max_parents:
+            break
+
+    parents = get_parents(list(first_child))
+    out = []
+    for item in order:
+        if isinstance(item, Document):
+            out.append(item)
+            continue
+        child = first_child[item]
+        parent = parents.get(item)
+        if parent is None:
+            out.append(child)
+            continue
+        meta = {**parent.metadata, **{k: v for k, v in child.metadata.items() if k in ("visibility", "doc_id")}}
+        out.append(Document(page_content=_window(parent.page_content, child.page_content, max_chars), metadata=meta))
+    return out
@@ -61,4 +61,43 @@ TIME_USER = """现在时间是：{now}
 - 如果文本里已经出现 ISO 时间，直接按其输出
 - 不要编造不存在的日期
 - 只输出 JSON
-"""
\ No newline at end of file
+"""
+CONDENSE_SYSTEM = (
+    "你是问题改写器。"
+    "结合对话历史，把用户的追问改写成一个不依赖上下文、可以直接拿去检索的完整问题。"
+    "只输出改写后的问题，不要解释；如果原问题已经完整，原样输出。"
+)
+
+CONDENSE_USER = """对话历史：
+{history}
+
+追问：{question}
+
+改写后的完整问题："""
+
+MEMORY_SUMMARY_SYSTEM = (
+    "你是对话摘要器。"
+    "把已有摘要和新移出的几轮对话合并成一段新的摘要，保留用户关心的主题、涉及的制度/假期类型、已经给出的关键结论。"
+    "只输出摘要正文，不超过{max_chars}个字。"
+)
+
+MEMORY_SUMMARY_USER = """已有摘要：
+{summary}
+
+新移出的对话：
+{turns}
+
+新的摘要："""
+
+DOC_SUMMARY_SYSTEM = (
+    "你是文档摘要器。"
+    "用一段话概括这份企业文档：它是什么制度/规范、适用于谁、覆盖哪些主题（列出关键名词，便于检索）。"
+    "只输出摘要正文，不超过{max_chars}个字。"
+)
+
+DOC_SUMMARY_USER = """文档标题：{title}
+
+文档内容（可能只截取了开头）：
+{content}
+
+摘要："""
@@ -6,13 +6,16 @@
 # 节点的返回值是一个字典，字典的键就是状态中的某个或者某几个变量
 # 用来表示这个节点对这个状态的修改
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import TypedDict, List, Any
 
 from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import HumanMessage, AIMessage
 
 from app.rag.prompts import QA_SYSTEM, QA_USER
-from app.depts import get_llm, get_vs
+from app.depts import get_llm, get_vs, get_embeddings
+from app.config import settings
+from app.rag.vectorstore import active_collection_name, get_vectorstore, is_partitioned, visible_collections
 
 class QAState(TypedDict, total=False):
     question: str
@@ -21,6 +24,12 @@ class QAState(TypedDict, total=False):
     docs: List[Any]
     answer: str
     messages: List[Any]
+    memory: dict       # 会话记忆（最近几轮 + 滚动摘要），见 app/rag/memory.py
+    faq: dict          # 本轮命中的预生成 FAQ 条目（见 app/rag/faq.py），没命中为 None
+    query_embedding: List[float]  # FAQ 查询时算好的问题向量，检索直接复用
+    # /chat/batch 预取的结果 {"question", "embedding", "docs", "debug"}：FAQ 先查，没命中才用它代替检索；
+    # docs 为空表示检索过、没有证据
+    prefetched: dict
 
 
 def decide_retrieve(state: QAState) -> str:
@@ -28,47 +37,224 @@ def decide_retrieve(state: QAState) -> str:
     条件函数：决定走检索还是直答
     返回值必须对应 add_conditional_edges 的 key
     """
-    # 简化版：永远检索
+    if state.get("faq"):
+        return "faq"  # 命中预生成的 FAQ 答案，不检索也不调大模型
+    if settings.singleflight_enabled:
+        return "shared"  # 相同问题的并发请求合并成一次检索 + 生成（有预取结果时 leader 直接用）
+    prefetched = _usable_prefetch(state)
+    if prefetched is not None:
+        return "direct" if prefetched["docs"] else "refuse"  # /chat/batch 已经检索过了
     return "retrieve"  # 跳到下一个叫做retrieve的节点
 
 
+def _usable_prefetch(state: QAState) -> dict | None:
+    """/chat/batch 预取的结果；问题被改写过（和预取时不是同一个问题）就不能用。"""
+    prefetched = state.get("prefetched")
+    if not prefetched or "docs" not in prefetched:
+        return None
+    if prefetched.get("question") != (state.get("question") or state.get("text") or ""):
+        return None
+    return prefetched
+
+
 def decide_retrieve_node(state: QAState) -> dict:
     """
-    节点 runnable：必须返回 dict
-    这里只是一个 no-op 节点，真正路由在 decide_retrieve() 里完成
+    节点 runnable：必须返回 dict，真正路由在 decide_retrieve() 里完成
+    这里做检索前的准备：追问改写成完整问题，再查预生成的 FAQ 答案索引
     """
-    return {} # 当一个节点返回空字典，表示什么也不做。
+    role = state.get("user_role", "public")
+    query = _standalone_question(state)
+    update = {"question": query, "faq": None, "query_embedding": None}
+    raw = state.get("prefetched") or {}
+    if raw.get("question") == query:
+        update["query_embedding"] = raw.get("embedding")  # FAQ 命中的预取没有 docs，向量照样能用
+    prefetched = _usable_prefetch({**state, "question": query})
+    if prefetched is not None:
+        update["docs"] = prefetched["docs"]  # 没命中 FAQ 时 generate 直接用
+    if not settings.faq_enabled:
+        return update
+
+    from app.rag.faq import lookup
+
+    try:
+        hit, embedding = lookup(query, role, embedding=update["query_embedding"])
+    except Exception as e:
+        print(f"[qa] faq lookup failed: {e}")
+        return update
+    update["query_embedding"] = embedding
+    if hit:
+        from langgraph.config import get_stream_writer
+
+        get_stream_writer()({"token": hit["answer"]})  # /chat/stream 也能拿到
+        update["answer"] = hit["answer"]
+        update["faq"] = {"question": hit["question"], "score": hit["score"], "sources": hit["sources"]}
+    return update
 
 
 # ---------- retrieval / generation ----------
 
-def retrieve(state: QAState) -> dict:
-    """从 Chroma 检索相关文档。
+RETRIEVE_K = 8  # 最多查8个结果
 
-    先按 visibility 做过滤；如果元数据里没有该字段导致检索为空，则回退到无过滤检索。
+# 分区检索的并发线程池（public + 本角色，一般就两个分区）
+_partition_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieve")
+
+
+def search_partitions(
+    query: str,
+    role: str,
+    embedding: List[float] | None = None,
+    k: int = RETRIEVE_K,
+    sources: List[str] | None = None,
+) -> List[Any]:
+    """分区布局：并行查 public 和本角色的分区，按距离合并取前 k。
+
+    各分区用同一个 embedding 模型、同一种距离，距离可以直接比较。
+    只查角色有权看的分区，所以不需要（也不会）回退到无过滤检索。
+    sources 不为空时只查这些源文件的 chunk（文档摘要索引挑出来的候选）。
     """
-    vs = get_vs()
-    role = state.get("user_role", "public")
-    query = state.get("question") or state.get("text") or ""
+    names = visible_collections(role)
+    if not names:
+        return []
+    if embedding is None:
+        embedding = get_embeddings().embed_query(query)  # 只 embed 一次，所有分区共用
+
+    hits = []
+    if settings.vector_quantization != "none":
+        from app.rag.quantized import search_collection
+
+        # 量化索引在进程内存里，numpy 暴力检索本身很快，不用再开线程
+        only = set(sources) if sources else None
+        pending = []
+        for n in names:
+            found = search_collection(n, embedding, k, sources=only)
+            if found is None:
+                pending.append(n)  # 这个分区的量化索引还在后台建，先查 Chroma
+            else:
+                hits += found
+        names = pending
+
+    where = {"source": {"$in": list(sources)}} if sources else None
+    stores = [get_vectorstore(get_embeddings(), collection_name=n) for n in names]
+    if len(stores) == 1:
+        hits += stores[0].similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=where)
+    elif stores:
+        futures = [
+            _partition_pool.submit(s.similarity_search_by_vector_with_relevance_scores, embedding, k, where)
+            for s in stores
+        ]
+        hits += [h for f in futures for h in f.result()]
+    hits.sort(key=lambda h: h[1])  # 分数是距离，越小越相似
+    return [doc for doc, _ in hits[:k]]
+
+
+def _to_parents(docs: List[Any]) -> List[Any]:
+    """小块检索、大块作答：命中的子 chunk 换成去重后的父段落（见 app/rag/parent_store.py）。"""
+    if not settings.parent_retrieval or not docs:
+        return docs
+    from app.rag.parent_store import expand_to_parents
+
+    try:
+        return expand_to_parents(docs)
+    except Exception as e:
+        print(f"[qa] parent expansion failed, using chunks: {e}")
+        return docs
+
+
+def search_docs(query: str, role: str, embedding: List[float] | None = None, vs=None) -> tuple[List[Any], str]:
+    """按 visibility 过滤检索；为空时回退到无过滤检索。
+
+    embedding 不为空时直接按向量检索（批量接口会一次性把问题都 embed 好）。
+    语料是按 visibility 分区存的（且没有指定 vs）时走 search_partitions。
+    开启 parent_retrieval 时返回的是子 chunk 所在的父段落。
+    返回 (docs, debug)。
+    """
+    if vs is None and settings.doc_summary_retrieval:
+        # 两步检索：先按文档摘要挑候选文档，再只在它们的 chunk 里找（见 app/rag/doc_summary.py）
+        if embedding is None:
+            embedding = get_embeddings().embed_query(query)
+        sources = _candidate_sources(embedding, role)
+        if sources:
+            docs, debug = _search_chunks(query, role, embedding, None, sources)
+            if docs:
+                return _to_parents(docs), f"{debug}+doc_summary"
+    docs, debug = _search_chunks(query, role, embedding, vs)
+    return _to_parents(docs), debug
+
+
+def _candidate_sources(embedding: List[float], role: str) -> List[str] | None:
+    from app.rag.doc_summary import candidate_sources
+
+    try:
+        return candidate_sources(embedding, role)
+    except Exception as e:
+        print(f"[qa] doc summary lookup failed, searching all chunks: {e}")
+        return None
+
+
+def _search_chunks(
+    query: str,
+    role: str,
+    embedding: List[float] | None,
+    vs,
+    sources: List[str] | None = None,
+) -> tuple[List[Any], str]:
+    if vs is None and is_partitioned():
+        return search_partitions(query, role, embedding, sources=sources), "partitioned"
+    quantized = vs is None and settings.vector_quantization != "none"
+    vs = vs or get_vs()
+
+    def _search(filter_: dict | None) -> List[Any]:
+        nonlocal embedding
+        if quantized:
+            from app.rag.quantized import search_collection
+
+            if embedding is None:
+                embedding = get_embeddings().embed_query(query)
+            visibility = set(filter_["visibility"]["$in"]) if filter_ else None
+            hits = search_collection(
+                active_collection_name(), embedding, RETRIEVE_K,
+                visibility=visibility, sources=set(sources) if sources else None,
+            )
+            if hits is not None:
+                return [doc for doc, _ in hits]
+            # 量化索引还在后台建：这次照常查 Chroma
+        if sources:
+            filter_ = {"$and": [filter_, {"source": {"$in": list(sources)}}]}
+        if embedding is not None:
+            return vs.similarity_search_by_vector(embedding, k=RETRIEVE_K, filter=filter_)
+        search_kwargs = {"k": RETRIEVE_K}
+        if filter_:
+            search_kwargs["filter"] = filter_
+        retriever = vs.as_retriever(search_kwargs=search_kwargs)  # as_retriever用于构造一个要检索的需求
+        return retriever.invoke(query)  # invoke就是真的去向量数据库查询
 
     # 1) filtered retrieval first
-    retriever = vs.as_retriever(  # as_retriever用于构造一个要检索的需求
-        search_kwargs={
-            "k": 8,  # 最多查8个结果
-            "filter": {"visibility": {"$in": ["public", role]}},
-            # 只查询向量数据库中那些public的文档
-        }
-    )
-    docs = retriever.invoke(query) # invoke就是真的去向量数据库查询
-    # docs表示从向量数据库中查出来的文档
+    docs = _search({"visibility": {"$in": ["public", role]}})  # 只查询 public 和本角色可见的文档
+    if docs or sources:
+        return docs, "filtered"  # 候选文档本来就是按可见性挑的，不做无过滤回退
 
     # 2) fallback to unfiltered if empty (common when metadata doesn't contain `visibility`)
-    if not docs: # 如果docs查出东西，下面就不执行了
-        retriever2 = vs.as_retriever(search_kwargs={"k": 8})
-        docs = retriever2.invoke(query)
-        return {"docs": docs, "question": query, "debug": "fallback_unfiltered"}
+    return _search(None), "fallback_unfiltered"
+
+
+def _standalone_question(state: QAState) -> str:
+    query = state.get("question") or state.get("text") or ""
+    if settings.memory_enabled:
+        from app.rag.memory import condense_question
 
-    return {"docs": docs, "question": query, "debug": "filtered"}
+        query = condense_question(query, state.get("memory"))  # “那病假呢？”-> 完整问题再检索
+    return query
+
+
+def retrieve(state: QAState) -> dict:
+    """从 Chroma 检索相关文档。
+
+    先按 visibility 做过滤；如果元数据里没有该字段导致检索为空，则回退到无过滤检索。
+    """
+    role = state.get("user_role", "public")
+    query = state.get("question") or state.get("text") or ""  # decide_retrieve_node 已经改写过
+    docs, debug = search_docs(query, role, embedding=state.get("query_embedding"))
+    return {"docs": docs, "question": query, "debug": debug}
 
 
 def grade_evidence(state: QAState) -> str:
@@ -76,25 +262,89 @@ def grade_evidence(state: QAState) -> str:
     return "good" if state.get("docs") else "bad"
 
 
-def generate_answer(state: QAState) -> dict:
-    """带引用生成答案。"""
-    llm = get_llm()
-    docs = state.get("docs", [])
-
+def answer_messages(question: str, docs: List[Any]) -> list:
     context = "\n\n".join(
         f"[{i+1}] {d.page_content}\n(source={d.metadata.get('source')}, page={d.metadata.get('page')})"
         for i, d in enumerate(docs[:6])
     )  # 将我检索出的内容拼接成一个大的字符串
 
-    prompt = QA_USER.format(question=state["question"], context=context)
-    messages = [
+    prompt = QA_USER.format(question=question, context=context)
+    return [
         AIMessage(content=QA_SYSTEM),
         HumanMessage(content=prompt)
     ]
+
+
+def generate_answer(state: QAState) -> dict:
+    """带引用生成答案。"""
+    llm = get_llm()
+    question = state.get("question") or state.get("text") or ""
+    messages = answer_messages(question, state.get("docs", []))
     ans = llm.invoke(messages).content  # content表示大模型返回的结果
     return {"answer": ans}
 
 
+def shared_answer(state: QAState) -> dict:
+    """检索 + 生成，和同一时刻问同样问题（同样可见范围）的请求共用一次（见 app/singleflight.py）。
+
+    token 不走 messages 流（只有 leader 真正调了大模型），而是用 custom 流推给每个请求，
+    /chat/stream 两种都转发。
+    """
+    from langchain_core.documents import Document
+    from langgraph.config import get_stream_writer
+
+    from app import singleflight
+    from app.db.llm_cache import normalize_text
+    from app.rag.vectorstore import corpus_version
+
+    role = state.get("user_role", "public")
+    query = state.get("question") or state.get("text") or ""
+    embedding = state.get("query_embedding")
+    prefetched = _usable_prefetch(state)
+
+    def compute(on_token) -> dict:
+        if prefetched is not None:
+            docs, debug = prefetched["docs"], prefetched.get("debug") or "prefetched"
+        else:
+            docs, debug = search_docs(query, role, embedding=embedding)
+        if not docs:
+            return {"docs": [], "answer": None, "debug": debug}
+        parts = []
+        for chunk in get_llm().stream(answer_messages(query, docs)):
+            if chunk.content:
+                parts.append(chunk.content)
+                on_token(chunk.content)
+        return {
+            "docs": [{"page_content": d.page_content, "metadata": d.metadata} for d in docs],
+            "answer": "".join(parts),
+            "debug": debug,
+        }
+
+    writer = get_stream_writer()
+    streamed = False
+
+    def on_token(token: str) -> None:
+        nonlocal streamed
+        streamed = True
+        writer({"token": token})
+
+    # 可见范围只取决于角色（public + 本角色）；语料换版本后不能和旧版本的请求合并
+    key = singleflight.flight_key("qa", normalize_text(query), role, corpus_version())
+    out = singleflight.run(key, compute, on_token)
+    if out["answer"] and not streamed:
+        writer({"token": out["answer"]})  # 直接拿到的是别的 worker 刚算完的结果，整段推一次
+    return {
+        "docs": [Document(**d) for d in out["docs"]],
+        "answer": out["answer"],
+        "question": query,
+        "debug": out["debug"],
+    }
+
+
+def grade_shared(state: QAState) -> str:
+    return "good" if state.get("answer") else "bad"
+
+
 def refuse_or_clarify(state: QAState) -> dict:
     """无证据兜底。"""
     return {
@@ -102,6 +352,16 @@ def refuse_or_clarify(state: QAState) -> dict:
     }
 
 
+def remember_turn(state: QAState) -> dict:
+    """把这一轮问答记进会话记忆（超出的轮次折叠进摘要）。"""
+    if not settings.memory_enabled:
+        return {}
+    from app.rag.memory import remember
+
+    question = state.get("question") or state.get("text") or ""
+    return {"memory": remember(state.get("memory"), question, state.get("answer") or "")}
+
+
 def build_qa_graph():
     g = StateGraph(QAState)
 
@@ -109,7 +369,9 @@ def build_qa_graph():
     g.add_node("decide_retrieve", decide_retrieve_node)
     g.add_node("retrieve", retrieve)
     g.add_node("generate", generate_answer)
+    g.add_node("shared", shared_answer)
     g.add_node("refuse", refuse_or_clarify)
+    g.add_node("remember", remember_turn)
 
     # START -> decide_retrieve
     g.add_edge(START, "decide_retrieve")
@@ -121,6 +383,9 @@ def build_qa_graph():
         {
             "retrieve": "retrieve",
             "direct": "generate",
+            "shared": "shared",
+            "faq": "remember",
+            "refuse": "refuse",
         },
     )
 
@@ -134,7 +399,17 @@ def build_qa_graph():
         },
     )
 
-    g.add_edge("generate", END)
-    g.add_edge("refuse", END)
+    g.add_conditional_edges(
+        "shared",
+        grade_shared,
+        {
+            "good": "remember",
+            "bad": "refuse",
+        },
+    )
+
+    g.add_edge("generate", "remember")
+    g.add_edge("refuse", "remember")
+    g.add_edge("remember", END)
 
     return g.compile()
\ No newline at end of file
@@ -0,0 +1,449 @@
+# app/rag/quantized.py
+# 量化向量索引：把 collection 里的 embedding 压成 float16 或 int8（每条向量一个缩放系数），
+# 放在进程内存里用 numpy 矩阵乘做暴力检索；可选地对前 N 个候选用 float32 原向量重新打分。
+#
+# text-embedding-v2 是 1536 维，float32 一条 6KB；chunk_size=200 切得很碎，条数一多，
+# 向量占的内存远大于文本本身。
+#   float16：2 字节/维，是 float32 的一半，精度几乎无损
+#   int8   ：1 字节/维 + 每条 4 字节 scale，约 1/4，靠 float32 重打分把召回拉回来
+# float32 原向量存在磁盘上，只有重打分时按行 pread 候选，不常驻进程内存（只占 page cache）。
+#
+# 注意这不是 Chroma 的替代存储：Chroma 仍然是数据的来源，它自己的 float32 HNSW 也还在
+# （写入、建本索引时都会加载）。本索引常驻的只有 ids、量化后的向量、范数和过滤用的两列
+# （visibility / source 编成整数），文本和元数据查到之后按 id 回 Chroma 取。
+# 所以它换来的是检索更快、召回可控，以及比在进程里再放一份 float32 矩阵小；
+# 和只用 Chroma 比，进程总内存是多出这一份，不是省下来的。整进程 RSS 实测见 bench。
+#
+# 本索引按 collection 构建，落盘到 app/quant_index/<collection>@<代次>/，collection 被写入后按代次（redis 计数）失效，
+# 在后台线程里重建，建好之前查询继续用旧的索引；进程里还没有任何可用的索引（冷启动）时返回 None，
+# 调用方直接查 Chroma，请求线程不做全量扫描。
+# 开关：Settings.vector_quantization = none / float16 / int8
+#
+# 内存（整进程 RSS）/ 召回实测：python -m bench.bench_quantization
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 flock，只靠临时目录 + rename 保证不读到半成品
+    fcntl = None
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.config import settings
+
+INDEX_DIR = Path(__file__).resolve().parent.parent / "quant_index"
+GEN_KEY_PREFIX = "kb:quant_gen:"
+BLOCK_ROWS = 4096  # 分块做矩阵乘，避免 int8 -> float32 一次性放大整个矩阵
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """返回 (codes, scales)。int8 为对称量化：scale = max|v| / 127，v ≈ codes * scale。"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1, initial=0.0) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"unsupported quantization: {dtype}")
+
+
+FILTER_FIELDS = ("visibility", "source")  # 检索时要按它们过滤，常驻内存；别的元数据查到后回 Chroma 取
+
+
+class QuantizedIndex:
+    def __init__(
+        self,
+        ids: list[str],
+        vectors: np.ndarray,
+        metadatas: list[dict] | None = None,
+        dtype: str = "int8",
+        full_path: str | Path | None = None,
+    ):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2:
+            vectors = vectors.reshape(len(ids), -1)
+        self.ids = list(ids)
+        self.dtype = dtype
+        self.dim = vectors.shape[1] if len(ids) else 0
+        self.codes, self.scales = quantize(vectors, dtype)
+        self.sq_norms = (vectors ** 2).sum(axis=1).astype(np.float32)  # L2 距离要用，和 Chroma 默认度量一致
+        metadatas = metadatas or [{}] * len(self.ids)
+        self.columns = {f: _encode_column([(m or {}).get(f) for m in metadatas]) for f in FILTER_FIELDS}
+        self._full = None
+        self._groups: dict[str, dict] = {}
+        if full_path is not None and len(ids):
+            vectors.tofile(full_path)  # float32 原向量落盘，重打分时按行读
+            self._full = _FullVectors(Path(full_path), vectors.shape)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def memory_bytes(self) -> int:
+        """常驻内存的数组部分（codes + scales + 范数 + 过滤列），不含 ids、磁盘上的 float32 原向量和 Chroma 本身。"""
+        n = self.codes.nbytes + self.sq_norms.nbytes + sum(codes.nbytes for _, codes in self.columns.values())
+        return n + (self.scales.nbytes if self.scales is not None else 0)
+
+    def _approx_dots(self, q: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        codes = self.codes if rows is None else self.codes[rows]
+        out = np.empty(len(codes), dtype=np.float32)
+        for i in range(0, len(codes), BLOCK_ROWS):
+            out[i:i + BLOCK_ROWS] = codes[i:i + BLOCK_ROWS].astype(np.float32) @ q
+        if self.scales is not None:
+            out *= self.scales if rows is None else self.scales[rows]
+        return out
+
+    def search(
+        self,
+        query: list[float] | np.ndarray,
+        k: int = 8,
+        rescore: int | None = None,
+        visibility: set[str] | None = None,
+        sources: set[str] | None = None,
+    ) -> list[tuple[int, float]]:
+        """返回 [(行号, L2 距离平方)]，距离小的在前。
+
+        rescore：先用量化向量取前 k*rescore 个候选，再用 float32 原向量重算距离；None/0 不重打分。
+        visibility：只在这些可见性的行里找（单 collection 布局用；分区布局不需要）。
+        sources：只在这些源文件的行里找（文档摘要两步检索用）。
+        """
+        if not self.ids:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        rows = None
+        if visibility is not None:
+            rows = self._rows_for("visibility", visibility)
+        if sources is not None:
+            by_source = self._rows_for("source", sources)
+            rows = by_source if rows is None else np.intersect1d(rows, by_source, assume_unique=True)
+        if rows is not None and not len(rows):
+            return []
+        norms = self.sq_norms if rows is None else self.sq_norms[rows]
+        dist = norms - 2 * self._approx_dots(q, rows) + float(q @ q)
+
+        n_cand = min(len(dist), k * rescore if rescore and self._full is not None else k)
+        cand = np.argpartition(dist, n_cand - 1)[:n_cand] if n_cand < len(dist) else np.arange(len(dist))
+        if rows is not None:
+            cand_rows = rows[cand]
+        else:
+            cand_rows = cand
+        if rescore and self._full is not None:
+            order = np.sort(cand_rows)  # 按文件顺序读更快
+            full = self._full.rows(order)
+            exact = ((full - q) ** 2).sum(axis=1)
+            top = np.argsort(exact)[:k]
+            return [(int(order[i]), float(exact[i])) for i in top]
+        cand_dist = dist[cand]
+        top = np.argsort(cand_dist)[:k]
+        return [(int(cand_rows[i]), float(cand_dist[i])) for i in top]
+
+    def _rows_for(self, field: str, values: set[str]) -> np.ndarray:
+        """过滤列 field 取值在 values 里的行号（升序）。按取值分组的行号第一次用到时建好缓存，之后每次查询不用再扫。"""
+        groups = self._groups.get(field)
+        if groups is None:
+            vocab, codes = self.columns[field]
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(vocab) + 1))
+            groups = self._groups[field] = {v: order[bounds[i]:bounds[i + 1]] for i, v in enumerate(vocab)}
+        parts = [groups[v] for v in values if v in groups]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+    # ---------- 持久化 ----------
+
+    def save(self, path: Path) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "codes.npy", self.codes)
+        np.save(path / "sq_norms.npy", self.sq_norms)
+        if self.scales is not None:
+            np.save(path / "scales.npy", self.scales)
+        for field, (_, codes) in self.columns.items():
+            np.save(path / f"col_{field}.npy", codes)
+        with open(path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(
+                {"dtype": self.dtype, "dim": self.dim, "ids": self.ids,
+                 "columns": {field: vocab for field, (vocab, _) in self.columns.items()}},
+                f, ensure_ascii=False,
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "QuantizedIndex":
+        with open(path / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        self = cls.__new__(cls)
+        self.ids = meta["ids"]
+        self.dtype, self.dim = meta["dtype"], meta["dim"]
+        self.columns = {field: (vocab, np.load(path / f"col_{field}.npy")) for field, vocab in meta["columns"].items()}
+        self._groups = {}
+        self.codes = np.load(path / "codes.npy")
+        self.sq_norms = np.load(path / "sq_norms.npy")
+        self.scales = np.load(path / "scales.npy") if (path / "scales.npy").exists() else None
+        full = path / "full.f32"
+        self._full = _FullVectors(full, (len(self.ids), self.dim)) if full.exists() and self.ids else None
+        return self
+
+
+class _FullVectors:
+    """磁盘上的 float32 原向量，按行号读。
+
+    用 os.pread 而不是 np.memmap：memmap 缺页时内核会把相邻的一大片页一起映射进来，
+    随机读几百次候选，进程 RSS 就涨到和整个文件一样大（bench_quantization 实测）；
+    pread 读过的页只留在 page cache 里，不算进程内存。fd 跟着 inode 走，目录改名后照样能读。
+    没有 pread 的平台（Windows）退回 memmap。
+    """
+
+    def __init__(self, path: Path, shape: tuple[int, int]):
+        self.shape = shape
+        self._row_bytes = shape[1] * 4
+        self._fd = os.open(path, os.O_RDONLY) if hasattr(os, "pread") else None
+        self._mm = None if self._fd is not None else np.memmap(path, dtype=np.float32, mode="r", shape=shape)
+
+    def rows(self, rows: np.ndarray) -> np.ndarray:
+        if self._mm is not None:
+            return np.asarray(self._mm[rows])
+        out = np.empty((len(rows), self.shape[1]), dtype=np.float32)
+        for j, r in enumerate(rows):
+            out[j] = np.frombuffer(os.pread(self._fd, self._row_bytes, int(r) * self._row_bytes), dtype=np.float32)
+        return out
+
+    def __del__(self):
+        if getattr(self, "_fd", None) is not None:
+            os.close(self._fd)
+
+
+def _encode_column(values: list) -> tuple[list, np.ndarray]:
+    """一列元数据编成 (去重后的取值, 每行的取值下标 int32)。"""
+    vocab: dict = {}
+    codes = np.fromiter((vocab.setdefault(v, len(vocab)) for v in values), dtype=np.int32, count=len(values))
+    return list(vocab), codes
+
+
+# ---------- 按 collection 构建 / 缓存 ----------
+
+_cache: dict[str, tuple[QuantizedIndex, int, float]] = {}  # name -> (索引, 代次, 下次检查代次的时间)
+_lock = threading.Lock()
+
+
+def _redis():
+    from app.db.redis_session import get_redis
+
+    return get_redis()
+
+
+def generation(name: str) -> int:
+    """collection 的内容代次：每次写入 / 删除 +1（别的按 collection 缓存的索引也用它判断过期）。"""
+    try:
+        return int(_redis().get(GEN_KEY_PREFIX + name) or 0)
+    except Exception:
+        return 0  # redis 不可用时只靠进程内失效
+
+
+def corpus_generations(base: str) -> dict[str, int]:
+    """一个语料版本下每个 collection（分区）的内容代次；按语料缓存的东西拿它判断有没有被写过。"""
+    from app.rag.vectorstore import corpus_collections
+
+    return {name: generation(name) for name in corpus_collections(base)}
+
+
+def bump_generation(name: str) -> None:
+    """collection 被写入 / 删除后调用：所有进程里这个 collection 的量化索引在后台重建，建好之前先用旧的。"""
+    try:
+        _redis().incr(GEN_KEY_PREFIX + name)
+    except Exception as e:
+        print(f"[quantized] bump generation failed: {e}")
+        drop_index(name)  # 代次没加上，只能把本进程的缓存和落盘文件删掉，下次查询当场重建
+        return
+    cached = _cache.get(name)
+    if cached:
+        _cache[name] = (cached[0], cached[1], 0.0)  # 本进程下一次查询就去看代次，不用等缓存过期
+
+
+def _index_path(name: str, gen: int) -> Path:
+    return INDEX_DIR / f"{name}@{gen}"
+
+
+@contextmanager
+def _build_lock(name: str, gen: int) -> Iterator[None]:
+    """同一个 name@gen 所有 worker 只有一个在建（文件锁），其余的等它建完直接加载。"""
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    with open(INDEX_DIR / f".{name}@{gen}.lock", "w") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _load(name: str, gen: int) -> QuantizedIndex | None:
+    path = _index_path(name, gen)
+    if not (path / "meta.json").exists():
+        return None
+    try:
+        index = QuantizedIndex.load(path)
+    except Exception as e:
+        print(f"[quantized] load {path} failed, rebuilding: {e}")
+        return None
+    return index if index.dtype == settings.vector_quantization else None  # 换了量化方式，重建
+
+
+def build_index(name: str, gen: int, page: int = 5000) -> QuantizedIndex:
+    """从 Chroma collection 分页拉出向量和过滤列，量化后落盘。
+
+    先写进本进程私有的临时目录，写完整个目录 rename 过去：别的 worker 要么看不到，要么看到完整的索引，
+    不会在它们加载到一半时被 rmtree 掉。
+    """
+    from app.rag.vectorstore import get_chroma_client
+
+    path = _index_path(name, gen)
+    with _build_lock(name, gen):
+        existing = _load(name, gen)  # 排队等锁的时候别的 worker 已经建好了
+        if existing is not None:
+            return existing
+
+        col = get_chroma_client().get_collection(name)
+        ids, vecs, metas = [], [], []
+        offset = 0
+        while True:
+            data = col.get(include=["embeddings", "metadatas"], limit=page, offset=offset)
+            batch = data.get("ids") or []
+            if not batch:
+                break
+            ids += batch
+            vecs.append(np.asarray(data["embeddings"], dtype=np.float32))
+            metas += data.get("metadatas") or [{}] * len(batch)
+            offset += len(batch)
+
+        tmp = INDEX_DIR / f".{name}@{gen}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+        tmp.mkdir(parents=True)
+        try:
+            index = QuantizedIndex(
+                ids,
+                np.concatenate(vecs) if vecs else np.zeros((0, 0), dtype=np.float32),
+                metas,
+                dtype=settings.vector_quantization,
+                full_path=tmp / "full.f32",  # 打开的 fd 跟着 inode 走，目录改名后照样能读
+            )
+            index.save(tmp)
+            shutil.rmtree(path, ignore_errors=True)  # 只可能是换了量化方式的旧文件
+            os.rename(tmp, path)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+    # 旧代次的落盘文件顺手删掉（别的 worker 已经加载进内存的不受影响）
+    for old in INDEX_DIR.glob(f"{name}@*"):
+        if old != path:
+            shutil.rmtree(old, ignore_errors=True)
+    for lock in INDEX_DIR.glob(f".{name}@*.lock"):
+        if lock.name != f".{name}@{gen}.lock":
+            lock.unlink(missing_ok=True)
+    return index
+
+
+_building: dict[str, int] = {}  # name -> 正在后台建的代次
+
+
+def _rebuild_async(name: str, gen: int) -> None:
+    """后台线程建 name@gen，建好换进缓存；同一个 collection 同时只有一个线程在建。"""
+    if _building.get(name) == gen:
+        return
+    _building[name] = gen
+
+    def _run():
+        try:
+            index = build_index(name, gen)
+            with _lock:
+                cached = _cache.get(name)
+                if cached is None or cached[1] < gen:
+                    _cache[name] = (index, gen, time.monotonic() + settings.corpus_pointer_ttl_s)
+        except Exception as e:
+            print(f"[quantized] background build {name}@{gen} failed: {e}")
+        finally:
+            if _building.get(name) == gen:
+                _building.pop(name, None)
+
+    threading.Thread(target=_run, name=f"quant-build-{name}", daemon=True).start()
+
+
+def get_quantized_index(name: str) -> QuantizedIndex | None:
+    """collection 的量化索引。代次变了时：别的 worker 已经建好就直接加载；
+    否则后台重建、先返回旧索引（刚写入的内容要等建完才查得到）。
+    进程里一份都没有（冷启动）时也在后台建，这期间返回 None，调用方直接查 Chroma。"""
+    now = time.monotonic()
+    cached = _cache.get(name)
+    if cached and cached[2] > now:
+        return cached[0]
+    gen = generation(name)
+    if cached and cached[1] == gen:
+        _cache[name] = (cached[0], gen, now + settings.corpus_pointer_ttl_s)
+        return cached[0]
+    with _lock:
+        cached = _cache.get(name)
+        if cached and cached[1] == gen:
+            return cached[0]
+        index = _load(name, gen)
+        if index is not None:
+            _cache[name] = (index, gen, now + settings.corpus_pointer_ttl_s)
+            return index
+        _rebuild_async(name, gen)
+        if cached is None:
+            return None
+        _cache[name] = (cached[0], cached[1], now + settings.corpus_pointer_ttl_s)
+        return cached[0]
+
+
+def drop_index(name: str) -> None:
+    """collection 被删除（GC）时清掉缓存和落盘文件。"""
+    _cache.pop(name, None)
+    for path in INDEX_DIR.glob(f"{name}@*"):
+        shutil.rmtree(path, ignore_errors=True)
+    for lock in INDEX_DIR.glob(f".{name}@*.lock"):
+        lock.unlink(missing_ok=True)
+
+
+def search_collection(
+    name: str,
+    embedding: list[float],
+    k: int,
+    visibility: set[str] | None = None,
+    sources: set[str] | None = None,
+) -> list[tuple[Document, float]] | None:
+    """返回 [(Document, L2 距离平方)]；还没有可用的量化索引时返回 None（调用方这次直接查 Chroma）。"""
+    index = get_quantized_index(name)
+    if index is None:
+        return None
+    hits = index.search(embedding, k=k, rescore=settings.quant_rescore, visibility=visibility, sources=sources)
+    return _documents_for(name, [(index.ids[i], d) for i, d in hits])
+
+
+def _documents_for(name: str, hits: list[tuple[str, float]]) -> list[tuple[Document, float]]:
+    """按 id 回 Chroma 取文本和元数据（一次批量 get）。索引建好之后又被删掉的 chunk 取不到，直接跳过。"""
+    if not hits:
+        return []
+    from app.rag.vectorstore import get_chroma_client
+
+    data = get_chroma_client().get_collection(name).get(ids=[i for i, _ in hits], include=["documents", "metadatas"])
+    found = {
+        i: (doc, meta)
+        for i, doc, meta in zip(data.get("ids") or [], data.get("documents") or [], data.get("metadatas") or [])
+    }
+    return [
+        (Document(page_content=found[i][0] or "", metadata=found[i][1] or {}), d)
+        for i, d in hits
+        if i in found
+    ]
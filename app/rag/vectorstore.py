@@ -1,28 +1,341 @@
 import os
-from langchain_chroma import Chroma
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator
 
-def get_vectorstore(embeddings):
-    """获取向量存储，带错误处理和降级机制"""
+from app.config import settings
+
+# chromadb / langchain_chroma 导入很慢（1~2 秒），统一放到函数里，第一次用到时才加载
+
+PERSIST_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chroma_db")
+COLLECTION_NAME = "documents"
+
+# 蓝绿切换：/reindex 建一个新的带版本号的 collection（documents_v<时间戳>），
+# 建好之后把 redis 里的“当前版本”指针原子地指过去；建库期间查询一直走旧的 collection。
+# 被换下来的旧版本记进 retired 有序集合，过了宽限期（正在跑的查询都结束了）再删。
+# 还没有指针时（老部署、没跑过 /reindex）沿用原来的 documents collection，版本号记为 "0"。
+ACTIVE_KEY = "kb:active_collection"
+RETIRED_KEY = "kb:retired_collections"
+
+# /reindex 和增量写入（/ingest、PUT/DELETE /docs）互斥：
+#   - reindex 开始时 SET NX 一个标记，写入方看到标记就拒绝（409），不会只写进马上要退役的旧版本，
+#     也不会在新版本建好之后把删掉的文档“复活”
+#   - 写入方在 WRITERS_KEY（有序集合，分数是过期时间）里登记自己；reindex 设好标记后等登记清空再扫描 data/docs，
+#     保证扫描时磁盘上的文件和旧版本里的数据都已经落定
+#   - 写入方总是从 redis 现读版本指针，不用本地缓存：切换之后别的 worker 也不会再往旧版本里写
+REINDEX_KEY = "kb:reindex"
+WRITERS_KEY = "kb:corpus_writers"
+
+# 按 visibility 分区：每个版本下每个可见性一个 collection（documents_v<时间戳>-public / -hr / ...）。
+# 以前所有 chunk 在一个 collection 里，查询时带 {"visibility": {"$in": [...]}} 过滤；
+# public 占了绝大多数，hr/finance/it 这些小分区的过滤检索又慢、召回又不稳。
+# 分区后检索只查角色能看到的那几个分区（并行），再按距离合并。
+# 同一个 collection 名本身存在就是旧的单 collection 布局，照旧带过滤查。
+PARTITION_SEP = "-"
+
+# 早期版本读的 Chroma 配置，现在都不生效了
+_IGNORED_ENV = ("CHROMA_DIR", "CHROMA_HOST", "CHROMA_PORT", "COLLECTION_NAME")
+
+_client = None
+_active: tuple[str, float] | None = None  # (collection 名, 本地缓存过期时间)
+_active_lock = threading.Lock()
+_names: tuple[set[str], float] | None = None  # chroma 里已有的 collection 名，本地缓存
+
+
+def get_chroma_client():
+    """进程内共享一个 Chroma client，带错误处理和降级机制"""
+    global _client
+    if _client is not None:
+        return _client
+
+    import chromadb
+
+    ignored = [k for k in _IGNORED_ENV if os.getenv(k)]
+    if ignored:
+        print(f"[chroma] ignoring {', '.join(ignored)}: using the local PersistentClient at {PERSIST_DIR}")
     try:
         # 尝试使用持久化存储
-        persist_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chroma_db")
-        os.makedirs(persist_dir, exist_ok=True)
-        
+        os.makedirs(PERSIST_DIR, exist_ok=True)
+
         # 确保目录可写
-        if not os.access(persist_dir, os.W_OK):
-            os.chmod(persist_dir, 0o777)
-        
-        print(f"Using ChromaDB at: {persist_dir}")
-        return Chroma(
-            embedding_function=embeddings,
-            persist_directory=persist_dir,
-            collection_name="documents"
-        )
+        if not os.access(PERSIST_DIR, os.W_OK):
+            os.chmod(PERSIST_DIR, 0o777)
+
+        print(f"Using ChromaDB at: {PERSIST_DIR}")
+        _client = chromadb.PersistentClient(path=PERSIST_DIR)
     except Exception as e:
         print(f"Persistent ChromaDB failed: {e}")
         print("Falling back to in-memory ChromaDB")
         # 降级到内存模式
-        return Chroma(
-            embedding_function=embeddings,
-            collection_name="documents"
-        )
+        _client = chromadb.EphemeralClient()
+    return _client
+
+
+def get_vectorstore(embeddings, collection_name: str | None = None):
+    """获取向量存储；默认用当前激活版本的 collection"""
+    from langchain_chroma import Chroma
+
+    return Chroma(
+        client=get_chroma_client(),
+        embedding_function=embeddings,
+        collection_name=collection_name or active_collection_name(),
+    )
+
+
+# ---------- 版本指针 ----------
+
+def _redis():
+    from app.db.redis_session import get_redis
+
+    return get_redis()
+
+
+def active_collection_name(fresh: bool = False) -> str:
+    """当前激活的 collection。每个查询都要用，redis 里的指针在本地缓存几秒；写入时传 fresh=True 现读。"""
+    global _active
+    now = time.monotonic()
+    cached = _active
+    if cached and cached[1] > now and not fresh:
+        return cached[0]
+    try:
+        name = _redis().get(ACTIVE_KEY) or COLLECTION_NAME
+    except Exception as e:
+        # redis 不可用就继续用上次的指针，别让查询挂掉
+        print(f"[vectorstore] read active pointer failed: {e}")
+        name = cached[0] if cached else COLLECTION_NAME
+    _active = (name, now + settings.corpus_pointer_ttl_s)
+    return name
+
+
+def version_of(collection_name: str) -> str:
+    prefix = f"{COLLECTION_NAME}_v"
+    return collection_name[len(prefix):] if collection_name.startswith(prefix) else "0"
+
+
+def corpus_version() -> str:
+    """当前语料版本号；和语料相关的缓存都应该带上它做 key。"""
+    return version_of(active_collection_name())
+
+
+def new_collection_name() -> str:
+    return f"{COLLECTION_NAME}_v{datetime.now().strftime('%Y%m%d%H%M%S%f')[:-3]}"
+
+
+def activate_collection(name: str) -> str | None:
+    """把指针切到 name（一条 redis GETSET，原子），旧版本进 retired 集合等待回收。返回旧的 collection 名。"""
+    global _active
+    with _active_lock:
+        r = _redis()
+        old = r.getset(ACTIVE_KEY, name) or COLLECTION_NAME
+        if old != name:
+            r.zadd(RETIRED_KEY, {old: time.time()})
+        r.zrem(RETIRED_KEY, name)
+        _active = (name, time.monotonic() + settings.corpus_pointer_ttl_s)
+    return old if old != name else None
+
+
+class CorpusBusy(RuntimeError):
+    """正在 /reindex，暂时不接受增量写入。"""
+
+    def __init__(self, collection: str):
+        super().__init__(f"reindex in progress ({collection}), retry later")
+        self.collection = collection
+
+
+def begin_reindex(name: str) -> str | None:
+    """拿到 reindex 标记并等正在进行的写入结束。成功返回 None；
+    已经有别的 reindex 在跑返回它的 collection 名；等写入超时会释放标记并抛 TimeoutError。"""
+    r = _redis()
+    if not r.set(REINDEX_KEY, name, nx=True, ex=settings.reindex_lock_ttl_s):
+        return r.get(REINDEX_KEY) or "?"
+    stale = r.zrangebyscore(WRITERS_KEY, 0, time.time())  # 崩溃的进程没来得及注销的登记
+    if stale:
+        r.zrem(WRITERS_KEY, *stale)
+    deadline = time.monotonic() + settings.reindex_writer_wait_s
+    while r.zrangebyscore(WRITERS_KEY, time.time(), "+inf"):
+        if time.monotonic() > deadline:
+            end_reindex(name)
+            raise TimeoutError(f"corpus writers still running after {settings.reindex_writer_wait_s}s")
+        time.sleep(0.05)
+    return None
+
+
+def end_reindex(name: str) -> None:
+    r = _redis()
+    if r.get(REINDEX_KEY) == name:
+        r.delete(REINDEX_KEY)
+
+
+@contextmanager
+def corpus_writer() -> Iterator[str]:
+    """增量写入语料时包在外面：登记写入、检查 reindex 标记，yield 现读的当前 collection 名。"""
+    r = _redis()
+    me = uuid.uuid4().hex
+    r.zadd(WRITERS_KEY, {me: time.time() + settings.corpus_writer_ttl_s})
+    try:
+        # 先登记再看标记：要么这里看到标记，要么 begin_reindex 看到这次登记，不会两边都漏掉
+        building = r.get(REINDEX_KEY)
+        if building:
+            raise CorpusBusy(building)
+        yield active_collection_name(fresh=True)
+    finally:
+        r.zrem(WRITERS_KEY, me)
+
+
+def gc_collections(grace_s: float | None = None) -> list[str]:
+    """删掉退役超过宽限期的旧版本 collection；当前激活的永远不删。"""
+    grace_s = settings.corpus_gc_grace_s if grace_s is None else grace_s
+    r = _redis()
+    active = r.get(ACTIVE_KEY) or COLLECTION_NAME
+    deleted = []
+    for name in r.zrangebyscore(RETIRED_KEY, 0, time.time() - grace_s):
+        if name != active:
+            try:
+                delete_corpus(name)
+            except Exception as e:
+                print(f"[vectorstore] delete {name} failed: {e}")  # 已经不存在等情况，照样移出集合
+            deleted.append(name)
+        r.zrem(RETIRED_KEY, name)
+    return deleted
+
+
+def corpus_status() -> dict:
+    r = _redis()
+    active = r.get(ACTIVE_KEY) or COLLECTION_NAME
+    retired = r.zrange(RETIRED_KEY, 0, -1, withscores=True)
+    return {
+        "collection": active,
+        "version": version_of(active),
+        "retired": [
+            {"collection": n, "retired_at": datetime.fromtimestamp(ts).isoformat(timespec="seconds")}
+            for n, ts in retired
+        ],
+    }
+
+
+
+# ---------- visibility 分区 ----------
+
+def _vis(visibility: str | None) -> str:
+    return re.sub(r"[^a-z0-9_]", "_", (visibility or "public").strip().lower()) or "public"
+
+
+def partition_name(base: str, visibility: str | None) -> str:
+    return f"{base}{PARTITION_SEP}{_vis(visibility)}"
+
+
+def collection_for(base: str, visibility: str | None) -> str:
+    """这个 visibility 的 chunk 存在哪个 collection 里（分区布局下是对应分区）。"""
+    return partition_name(base, visibility) if is_partitioned(base) else base
+
+
+def _collection_names(refresh: bool = False) -> set[str]:
+    global _names
+    now = time.monotonic()
+    if not refresh and _names and _names[1] > now:
+        return _names[0]
+    names = {getattr(c, "name", c) for c in get_chroma_client().list_collections()}
+    _names = (names, now + settings.corpus_pointer_ttl_s)
+    return names
+
+
+def list_partitions(base: str | None = None) -> dict[str, str]:
+    """{visibility: collection 名}"""
+    base = base or active_collection_name()
+    prefix = base + PARTITION_SEP
+    return {n[len(prefix):]: n for n in _collection_names() if n.startswith(prefix)}
+
+
+def is_partitioned(base: str | None = None) -> bool:
+    base = base or active_collection_name()
+    if list_partitions(base):
+        return True
+    if base in _collection_names():
+        return False
+    return settings.vector_partitioning  # 空语料：按配置决定新数据怎么放
+
+
+def visible_collections(role: str, base: str | None = None) -> list[str]:
+    """角色能看到的分区（public + 本角色），不存在的分区直接跳过（不会替随便传的角色建空 collection）。"""
+    parts = list_partitions(base)
+    wanted = dict.fromkeys(["public", _vis(role)])
+    return [parts[v] for v in wanted if v in parts]
+
+
+def visible_stores(embeddings, role: str, base: str | None = None) -> list:
+    return [get_vectorstore(embeddings, collection_name=n) for n in visible_collections(role, base)]
+
+
+def corpus_collections(base: str | None = None) -> list[str]:
+    """当前语料的全部 collection：分区布局下是所有分区，否则就是那一个。"""
+    base = base or active_collection_name()
+    if is_partitioned(base):
+        return list(list_partitions(base).values())
+    return [base]
+
+
+def corpus_stores(embeddings, base: str | None = None) -> list:
+    return [get_vectorstore(embeddings, collection_name=n) for n in corpus_collections(base)]
+
+
+def _collection_changed(*names: str) -> None:
+    """collection 内容变了：让基于它的量化索引失效。"""
+    from app.rag.quantized import bump_generation
+
+    for name in names:
+        bump_generation(name)
+
+
+def add_documents_routed(embeddings, chunks: list, base: str | None = None) -> dict[str, int]:
+    """按 chunk 的 visibility 写进对应分区（单 collection 布局就直接写）。返回每个 collection 写入的条数。"""
+    base = base or active_collection_name()
+    if not chunks:
+        return {}
+    if not is_partitioned(base):
+        get_vectorstore(embeddings, collection_name=base).add_documents(chunks)
+        _collection_changed(base)
+        return {base: len(chunks)}
+
+    groups: dict[str, list] = {}
+    for c in chunks:
+        groups.setdefault(partition_name(base, (c.metadata or {}).get("visibility")), []).append(c)
+    for name, docs in groups.items():
+        get_vectorstore(embeddings, collection_name=name).add_documents(docs)
+    _collection_changed(*groups)
+    _collection_names(refresh=True)  # 可能新建了分区
+    return {name: len(docs) for name, docs in groups.items()}
+
+
+def delete_documents_where(embeddings, where: dict, base: str | None = None) -> list[dict]:
+    """按元数据条件（比如 {"doc_id": ...}）删 chunk：每个 collection 先取 id 再一次批量删除。
+    返回被删 chunk 的元数据（调用方用来清理去重指纹和源文件）。"""
+    deleted: list[dict] = []
+    for name in corpus_collections(base):
+        store = get_vectorstore(embeddings, collection_name=name)
+        data = store.get(where=where, include=["metadatas"])
+        ids = data.get("ids") or []
+        if ids:
+            store.delete(ids=ids)
+            deleted.extend(m or {} for m in data.get("metadatas") or [])
+            _collection_changed(name)
+    return deleted
+
+
+def delete_corpus(base: str) -> list[str]:
+    """删掉一个版本：单 collection 本身和它的所有分区。"""
+    prefix = base + PARTITION_SEP
+    deleted = []
+    for name in _collection_names(refresh=True):
+        if name == base or name.startswith(prefix):
+            get_chroma_client().delete_collection(name)
+            deleted.append(name)
+            if settings.vector_quantization != "none":
+                from app.rag.quantized import drop_index
+
+                drop_index(name)
+    _collection_names(refresh=True)
+    return deleted
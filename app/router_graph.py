@@ -4,8 +4,9 @@ from __future__ import annotations
 from typing import TypedDict, Any
 from langgraph.graph import StateGraph, START, END
 
+from app.intent_classifier import classify
 from app.rag.qa_graph import build_qa_graph
-from app.workflows.leave.leave_graph import build_leave_graph
+from app.workflows.leave.leave_graph import build_leave_graph, CONFIRM_WORDS
 
 
 class RouterState(TypedDict, total=False):
@@ -15,41 +16,63 @@ class RouterState(TypedDict, total=False):
     mode: str          # "qa"/"rag"/"kb"/"leave" 可选提示
     requester: str
     active_route: str
+    leave_intent: str  # route 节点顺带算出的请假子意图，leave 子图直接用
 
     # --- fields produced by subgraphs that we want to keep across turns ---
     req: dict
     missing_fields: list[str]
     violations: list[str]
 
+    memory: dict       # QA 会话记忆（最近几轮 + 滚动摘要），跟着 session 存进 redis
     answer: str
     docs: list[Any]
     leave_id: str
+    list_cursor: str
+    pending_page: dict
+    bulk_review: dict  # 等待“确认”的批量审批，只在紧接着的下一轮有效
+    prefetched: dict   # /chat/batch 预取的检索结果，交给 qa 子图（不进 session）
 
 
-def decide_route(state: RouterState) -> str:
+def classify_state(state: RouterState) -> tuple[str, str]:
+    """一次分类同时得到 (route, leave_intent)。"""
     mode = (state.get("mode") or "").lower().strip()
+    text = state.get("text") or state.get("question") or ""
+    c = classify(text)
 
     active = (state.get("active_route") or "").lower().strip()
     if active == "leave" and mode not in {"qa", "rag", "kb"}:
-        return "leave"
+        # 请假多轮对话中（“确认”“改成下午”）默认留在 leave，
+        # 只有规则明确判成问答（如“查一下报修进度”）才跳出去
+        if not (c.route == "qa" and c.source == "rules"):
+            return "leave", c.intent
 
     # 显式 mode 优先
     if mode in {"qa", "rag", "kb"}:
-        return "qa"
+        return "qa", c.intent
     if mode in {"leave", "hr"}:
-        return "leave"
+        return "leave", c.intent
+
+    # 关键词 + 小模型路由
+    return c.route or "qa", c.intent
 
-    # 关键词路由
-    text = (state.get("text") or state.get("question") or "").lower()
-    if any(k in text for k in ["请假", "年假", "病假", "事假", "休假", "调休", "假期", "请一天假", "请半天假" ,"审批"]):
-        return "leave"
 
-    return "qa"
+def decide_route(state: RouterState) -> str:
+    return classify_state(state)[0]
 
 
 def route_node(state: RouterState) -> dict:
     """Router node runnable. Must return dict updates."""
-    return {"active_route": decide_route(state)}
+    route, intent = classify_state(state)
+    out = {"active_route": route, "leave_intent": intent}
+    text = (state.get("text") or state.get("question") or "").strip().lower()
+    if state.get("bulk_review") and text not in CONFIRM_WORDS:
+        out["bulk_review"] = None  # 列出批量审批的单之后没有紧接着确认，就作废，不能隔几轮再被“确认”触发
+    return out
+
+
+def _next_route(state: RouterState) -> str:
+    # route_node 已经算好了，这里不再重复分类
+    return state.get("active_route") or "qa"
 
 
 def build_router_graph():
@@ -66,7 +89,7 @@ def build_router_graph():
 
     g.add_conditional_edges(
         "route",
-        decide_route,
+        _next_route,
         {"qa": "qa", "leave": "leave"},
     )
 
@@ -76,4 +99,19 @@ def build_router_graph():
     return g.compile()
 
 
-router_graph = build_router_graph()
\ No newline at end of file
+_router_graph = None
+
+
+def get_router_graph():
+    """编译好的路由图（进程内只编译一次）。
+
+    不在 import 时编译：main.py 的 lifespan 启动阶段会先调一次。
+    """
+    global _router_graph
+    if _router_graph is None:
+        _router_graph = build_router_graph()
+    return _router_graph
+
+
+def router_graph_ready() -> bool:
+    return _router_graph is not None
@@ -0,0 +1,248 @@
+# app/singleflight.py
+# 相同问题的请求合并（single-flight）：同一时刻同样的计算只跑一次，结果（连同流式 token）分给所有等待者。
+#
+# 全员大会一发通知，几十个人几秒内问同一个问题，以前每个请求各自 embed、检索、调一次 qwen-max。
+# 现在按 key（由调用方决定，QA 用 归一化问题 + 可见范围 + 语料版本）合并：
+#   - 进程内：第一个请求是 leader，真正去算；后来的 follower 挂在同一个 _Flight 上，
+#     先补发 leader 已经吐出的 token，之后的 token 实时转发，最后拿同一份结果
+#   - 跨 worker：进程内的 leader 再去 redis 抢锁（SET NX PX）。
+#     抢到的是全局 leader：每个 token 追加到 token 列表并 PUBLISH，算完把结果写进 redis（保留几秒）再发 done；
+#     没抢到的先 SUBSCRIBE，再读 token 列表补发（按序号去重），然后等 done 取结果
+#   - redis 不可用时退化成只在进程内合并；leader 出错 / 超时 / 进程挂掉（锁过期也没有结果）时，
+#     follower 自己算一遍（这时不再转发 token，只返回结果）
+# compute(on_token) 返回的结果必须能 JSON 序列化（跨 worker 要经过 redis）。
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+import uuid
+from typing import Any, Callable
+
+from app.config import settings
+
+KEY_PREFIX = "singleflight:"
+
+TokenSink = Callable[[str], None]
+
+
+def _noop(_: str) -> None:
+    return None
+
+
+def flight_key(*parts: str) -> str:
+    return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.tokens: list[str] = []
+        self.listeners: list[TokenSink] = []
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self._lock = threading.Lock()
+
+    def emit(self, token: str) -> None:
+        with self._lock:
+            self.tokens.append(token)
+            listeners = list(self.listeners)
+        for fn in listeners:
+            try:
+                fn(token)
+            except Exception as e:  # 某个 follower 的连接断了不能影响 leader
+                print(f"[singleflight] listener failed: {e}")
+
+    def follow(self, on_token: TokenSink) -> None:
+        # 补发在锁里做：补发完之前 leader 的下一个 token 进不来，顺序不会乱
+        with self._lock:
+            for token in self.tokens:
+                on_token(token)
+            self.listeners.append(on_token)
+
+
+_flights: dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+_stats = {"leaders": 0, "local_followers": 0, "remote_followers": 0, "fallbacks": 0}
+
+
+def run(key: str, compute: Callable[[TokenSink], Any], on_token: TokenSink | None = None) -> Any:
+    """同一个 key 同时只算一次；返回 compute 的结果，过程中的 token 通过 on_token 推给每个调用方。"""
+    on_token = on_token or _noop
+    if not settings.singleflight_enabled:
+        return compute(on_token)
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+            _stats["leaders"] += 1
+        else:
+            _stats["local_followers"] += 1
+
+    if not leader:
+        flight.follow(on_token)
+        if flight.done.wait(settings.singleflight_wait_s) and flight.error is None:
+            return flight.result
+        _stats["fallbacks"] += 1
+        return compute(_noop)
+
+    flight.follow(on_token)
+    try:
+        flight.result = _run_shared(key, compute, flight.emit)
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+def _redis():
+    try:
+        from app.db.redis_session import get_redis
+
+        return get_redis()
+    except Exception as e:
+        print(f"[singleflight] redis unavailable: {e}")
+        return None
+
+
+def _run_shared(key: str, compute: Callable[[TokenSink], Any], emit: TokenSink) -> Any:
+    """进程内 leader 再和其他 worker 协调；redis 出问题就自己算。"""
+    r = _redis() if settings.singleflight_redis else None
+    if r is None:
+        return compute(emit)
+    lock_key = f"{KEY_PREFIX}lock:{key}"
+    result_key = f"{KEY_PREFIX}result:{key}"
+    owner = uuid.uuid4().hex
+    try:
+        cached = r.get(result_key)  # 刚算完的结果还在（几秒内），直接用
+        if cached:
+            result = json.loads(cached)
+            _stats["remote_followers"] += 1
+            return result
+        got = r.set(lock_key, owner, nx=True, px=int(settings.singleflight_wait_s * 1000))
+    except Exception as e:
+        print(f"[singleflight] redis lock failed: {e}")
+        return compute(emit)
+
+    if got:
+        return _lead(r, key, lock_key, owner, compute, emit)
+    try:
+        result = _follow_remote(r, key, lock_key, emit)
+    except Exception as e:
+        print(f"[singleflight] redis follow failed: {e}")
+        result = None
+    if result is not None:
+        _stats["remote_followers"] += 1
+        return result
+    _stats["fallbacks"] += 1
+    return compute(_noop)
+
+
+def _lead(r, key: str, lock_key: str, owner: str, compute: Callable[[TokenSink], Any], emit: TokenSink) -> Any:
+    channel = f"{KEY_PREFIX}chan:{key}"
+    tokens_key = f"{KEY_PREFIX}tokens:{key}"
+    ttl_ms = int(settings.singleflight_wait_s * 1000)
+    seq = 0
+    broken = False
+
+    def publish(token: str) -> None:
+        nonlocal seq, broken
+        emit(token)
+        if broken:
+            return
+        try:
+            pipe = r.pipeline(transaction=False)
+            pipe.rpush(tokens_key, token)
+            pipe.pexpire(tokens_key, ttl_ms)
+            pipe.publish(channel, json.dumps({"seq": seq, "token": token}, ensure_ascii=False))
+            pipe.execute()
+        except Exception as e:
+            broken = True  # redis 中途挂了：本 worker 照常算完，别的 worker 的 follower 会超时自己算
+            print(f"[singleflight] publish failed: {e}")
+        seq += 1
+
+    try:
+        result = compute(publish)
+    except Exception as e:
+        _safe(lambda: r.publish(channel, json.dumps({"error": f"{type(e).__name__}: {e}"})))
+        _release_lock(r, lock_key, owner)
+        raise
+
+    def _finish():
+        pipe = r.pipeline(transaction=False)
+        pipe.set(f"{KEY_PREFIX}result:{key}", json.dumps(result, ensure_ascii=False), px=int(settings.singleflight_result_ttl_s * 1000))
+        pipe.delete(tokens_key)
+        pipe.publish(channel, json.dumps({"done": True}))
+        pipe.execute()
+
+    _safe(_finish)
+    _release_lock(r, lock_key, owner)
+    return result
+
+
+def _follow_remote(r, key: str, lock_key: str, emit: TokenSink) -> Any:
+    """跟着别的 worker 上的 leader：转发 token，返回它的结果；leader 失败 / 消失返回 None。"""
+    result_key = f"{KEY_PREFIX}result:{key}"
+    pubsub = r.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(f"{KEY_PREFIX}chan:{key}")
+    try:
+        # 先订阅再读列表：列表里没有的 token 一定会从频道里收到，按序号去重
+        backlog = r.lrange(f"{KEY_PREFIX}tokens:{key}", 0, -1)
+        for token in backlog:
+            emit(token)
+        next_seq = len(backlog)
+        cached = r.get(result_key)  # 订阅之前 leader 就已经算完了
+        if cached:
+            return json.loads(cached)
+        deadline = time.monotonic() + settings.singleflight_wait_s
+        while time.monotonic() < deadline:
+            msg = pubsub.get_message(timeout=0.5)
+            if msg is None:
+                if not r.exists(lock_key):
+                    # 锁没了：要么刚好错过了 done，要么 leader 挂了（没有结果）
+                    cached = r.get(result_key)
+                    return json.loads(cached) if cached else None
+                continue
+            data = json.loads(msg["data"])
+            if "token" in data:
+                if data["seq"] >= next_seq:
+                    emit(data["token"])
+                    next_seq = data["seq"] + 1
+            elif data.get("done"):
+                cached = r.get(result_key)
+                return json.loads(cached) if cached else None
+            elif "error" in data:
+                return None
+        return None
+    finally:
+        _safe(pubsub.close)
+
+
+def _release_lock(r, lock_key: str, owner: str) -> None:
+    # 只删自己的锁（超时后锁可能已经被别的 worker 拿走）；GET 和 DEL 之间的竞争窗口可以接受
+    def _do():
+        if r.get(lock_key) == owner:
+            r.delete(lock_key)
+
+    _safe(_do)
+
+
+def _safe(fn: Callable[[], Any]) -> None:
+    try:
+        fn()
+    except Exception as e:
+        print(f"[singleflight] redis cleanup failed: {e}")
+
+
+def snapshot() -> dict:
+    with _flights_lock:
+        in_flight = len(_flights)
+    return {"in_flight": in_flight, **_stats}
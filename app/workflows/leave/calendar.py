@@ -0,0 +1,159 @@
+# app/workflows/leave/calendar.py
+# 工作日历：工作时间（09:00-12:00、13:00-18:00）、周末、法定节假日 / 调休。
+#
+# 以前请假时长 = 墙钟小时数 / 8，周五请到周一会把周末和夜里都算进去；
+# “提前 1 个工作日”也只是简单的 24 小时。
+#
+# 这里把 [今年-1, 今年+2] 的每一天预计算成三个紧凑数组：
+#   _workday  bytearray，1 = 工作日
+#   _prefix   array('i')，_prefix[i] = 第 i 天之前的工作日数（前缀和）
+#   _next     array('i')，_next[i]   = 第 i 天及之后第一个工作日的下标
+# 两个时间点之间的工作时长、下一个工作日都是 O(1)，不用逐天循环。
+# 超出预计算范围的日期逐天兜底计算，结果一样，只是慢一些。
+#
+# 节假日表来源由 Settings.holiday_source 决定：file（CSV）或 mysql（holidays 表），
+# mysql 读不到时退回文件。
+
+from __future__ import annotations
+
+import csv
+import threading
+from array import array
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from app.config import settings
+
+ROOT_DIR = Path(__file__).resolve().parents[3]
+
+# 一天内的工作时段（分钟）
+WORK_PERIODS = [(9 * 60, 12 * 60), (13 * 60, 18 * 60)]
+
+
+def load_overrides_from_file(path: str | Path) -> dict[date, bool]:
+    """CSV：date,kind,name；kind = holiday（放假）/ workday（调休上班），# 开头为注释。"""
+    path = Path(path)
+    if not path.is_absolute():
+        path = ROOT_DIR / path
+    overrides: dict[date, bool] = {}
+    with open(path, encoding="utf-8") as f:
+        rows = csv.DictReader(line for line in f if line.strip() and not line.lstrip().startswith("#"))
+        for row in rows:
+            overrides[date.fromisoformat(row["date"].strip())] = row["kind"].strip().lower() == "workday"
+    return overrides
+
+
+def load_overrides_from_mysql() -> dict[date, bool]:
+    from app.db.mysql import get_holiday_overrides
+
+    return get_holiday_overrides()
+
+
+class BusinessCalendar:
+    def __init__(
+        self,
+        overrides: dict[date, bool],
+        first: date,
+        last: date,
+        periods: list[tuple[int, int]] = WORK_PERIODS,
+    ):
+        self.overrides = overrides
+        self.periods = periods
+        self.minutes_per_day = sum(e - s for s, e in periods)
+        self.first = first
+
+        n = (last - first).days + 1
+        self._workday = bytearray(n)
+        self._prefix = array("i", [0]) * (n + 1)
+        for i in range(n):
+            d = first + timedelta(days=i)
+            w = overrides.get(d, d.weekday() < 5)
+            self._workday[i] = w
+            self._prefix[i + 1] = self._prefix[i] + w
+        self._next = array("i", [n]) * (n + 1)  # n 表示范围内之后没有工作日了
+        for i in range(n - 1, -1, -1):
+            self._next[i] = i if self._workday[i] else self._next[i + 1]
+
+    def _index(self, d: date) -> int | None:
+        i = (d - self.first).days
+        return i if 0 <= i < len(self._workday) else None
+
+    def is_workday(self, d: date) -> bool:
+        i = self._index(d)
+        if i is None:
+            return self.overrides.get(d, d.weekday() < 5)
+        return bool(self._workday[i])
+
+    def workdays_between(self, a: date, b: date) -> int:
+        """[a, b) 之间的工作日数。"""
+        if b <= a:
+            return 0
+        ia, ib = self._index(a), self._index(b - timedelta(days=1))
+        if ia is not None and ib is not None:
+            return self._prefix[ib + 1] - self._prefix[ia]
+        return sum(self.is_workday(a + timedelta(days=k)) for k in range((b - a).days))
+
+    def _minutes_in_day(self, start_min: int, end_min: int) -> int:
+        return sum(max(0, min(e, end_min) - max(s, start_min)) for s, e in self.periods)
+
+    def working_minutes(self, start: datetime, end: datetime) -> int:
+        """[start, end) 里落在工作日工作时段内的分钟数。"""
+        if end <= start:
+            return 0
+        sd, ed = start.date(), end.date()
+        s_min = start.hour * 60 + start.minute
+        e_min = end.hour * 60 + end.minute
+        if sd == ed:
+            return self._minutes_in_day(s_min, e_min) if self.is_workday(sd) else 0
+        total = self._minutes_in_day(s_min, 24 * 60) if self.is_workday(sd) else 0
+        total += self.workdays_between(sd + timedelta(days=1), ed) * self.minutes_per_day
+        total += self._minutes_in_day(0, e_min) if self.is_workday(ed) else 0
+        return total
+
+    def working_days(self, start: datetime, end: datetime) -> float:
+        """请假时长（天），8 个工作小时 = 1 天。"""
+        return self.working_minutes(start, end) / self.minutes_per_day
+
+    def next_workday(self, d: date, include_today: bool = False) -> date:
+        if not include_today:
+            d = d + timedelta(days=1)
+        i = self._index(d)
+        if i is not None and self._next[i] < len(self._workday):
+            return self.first + timedelta(days=self._next[i])
+        while not self.is_workday(d):
+            d += timedelta(days=1)
+        return d
+
+
+_calendar: BusinessCalendar | None = None
+_lock = threading.Lock()
+
+
+def build_calendar(today: date | None = None) -> BusinessCalendar:
+    if settings.holiday_source == "mysql":
+        try:
+            overrides = load_overrides_from_mysql()
+        except Exception as e:
+            print(f"[calendar] load holidays from mysql failed, fallback to file: {e}")
+            overrides = load_overrides_from_file(settings.holiday_file)
+    else:
+        overrides = load_overrides_from_file(settings.holiday_file)
+    year = (today or date.today()).year
+    return BusinessCalendar(overrides, date(year - 1, 1, 1), date(year + 2, 12, 31))
+
+
+def get_calendar() -> BusinessCalendar:
+    """进程内单例；节假日表更新后调用 reload_calendar()。"""
+    global _calendar
+    if _calendar is None:
+        with _lock:
+            if _calendar is None:
+                _calendar = build_calendar()
+    return _calendar
+
+
+def reload_calendar() -> BusinessCalendar:
+    global _calendar
+    with _lock:
+        _calendar = build_calendar()
+    return _calendar
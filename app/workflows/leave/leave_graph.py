@@ -3,24 +3,29 @@ from __future__ import annotations
 import json
 import uuid
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Any, Dict
 
 from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import HumanMessage, SystemMessage
 
 from app.depts import get_llm
+from app.db.llm_cache import cached_json, prompt_version
+from app.intent_classifier import classify
 from app.workflows.leave.models import LeaveState
+from app.workflows.leave.calendar import get_calendar
 from app.workflows.leave.rules import validate_leave
 from app.db.mysql import (
-    get_leave_balance,
+    get_balance_and_conflicts,
     insert_leave_request,
     get_leave_request,
     cancel_leave_request,
-    get_recent_leave_requests,
-    update_leave_request,
+    get_leave_history_page,
+    get_pending_leave_requests,
+    modify_leave_request,
     approve_leave_request,
     reject_leave_request,
+    bulk_review_leave_requests,
 )
 
 # ========= Prompts =========
@@ -78,6 +83,9 @@ TIME_USER = """现在时间是：{now}
 - 只输出 JSON
 """
 
+SLOT_PROMPT_VERSION = prompt_version(SLOT_SYSTEM, SLOT_USER)
+TIME_PROMPT_VERSION = prompt_version(TIME_SYSTEM, TIME_USER)
+
 # ========= Helpers =========
 
 def _extract_limit(text: str, default: int = 5) -> int:
@@ -119,6 +127,64 @@ def _safe_iso(s: Any) -> str | None:
         return None
 
 
+def _extract_slots(text: str) -> Dict[str, Any]:
+    """LLM 抽取 leave_type / start_time / end_time / reason（同一句话走缓存）。"""
+    def _call() -> Dict[str, Any]:
+        raw = get_llm().invoke([
+            SystemMessage(content=SLOT_SYSTEM),
+            HumanMessage(content=SLOT_USER.format(text=text)),
+        ]).content
+        return _safe_json_load(raw)
+
+    return cached_json("slots", SLOT_PROMPT_VERSION, text, _call)
+
+
+def _parse_time(text: str, now: datetime | None = None) -> Dict[str, Any]:
+    """LLM 解析相对时间（“下周二/明天下午”）。
+
+    结果依赖“今天是几号”，所以缓存 key 里带上 now 的日期部分。
+    """
+    now = now or datetime.now()
+
+    def _call() -> Dict[str, Any]:
+        raw = get_llm().invoke([
+            SystemMessage(content=TIME_SYSTEM),
+            HumanMessage(content=TIME_USER.format(now=now.strftime("%Y-%m-%d %H:%M"), text=text)),
+        ]).content
+        return _safe_json_load(raw)
+
+    return cached_json("time", TIME_PROMPT_VERSION, text, _call, extra=now.strftime("%Y-%m-%d"))
+
+
+_LEAVE_TYPE_WORDS = {"年假": "annual", "病假": "sick", "事假": "personal"}
+
+
+def _extract_leave_type(text: str) -> str | None:
+    for word, leave_type in _LEAVE_TYPE_WORDS.items():
+        if word in text:
+            return leave_type
+    return None
+
+
+def _extract_date_range(text: str) -> tuple[str | None, str | None]:
+    """“2026-01-01 到 2026-01-31” -> ('2026-01-01', '2026-02-01')，结束日期包含当天。"""
+    dates = []
+    for d in re.findall(r"\d{4}-\d{1,2}-\d{1,2}", text or ""):
+        try:
+            dates.append(datetime.strptime(d, "%Y-%m-%d"))
+        except ValueError:
+            continue
+    if not dates:
+        return None, None
+    start = dates[0].strftime("%Y-%m-%d")
+    end = (dates[1] + timedelta(days=1)).strftime("%Y-%m-%d") if len(dates) > 1 else None
+    return start, end
+
+
+def _wants_more(text: str) -> bool:
+    return any(k in text for k in ["更多", "下一页", "继续"])
+
+
 def _extract_leave_id(text: str) -> str | None:
     if not text:
         return None
@@ -126,43 +192,32 @@ def _extract_leave_id(text: str) -> str | None:
     return m.group(0) if m else None
 
 
-# ========= Intent Routing =========
-
-def decide_intent(state: LeaveState) -> str:
-    """apply / query / cancel / list / modify / approve / reject"""
-    text = (state.get("text") or state.get("question") or "").lower()
-
-    # cancel intent
-    if any(k in text for k in ["取消", "撤销", "作废"]):
-        return "cancel"
-
-    # query intent
-    if any(k in text for k in ["查询", "查", "状态", "进度", "结果"]):
-        if any(k in text for k in ["请假", "年假", "病假", "事假", "休假", "调休", "假期", "申请", "单"]):
-            return "query"
-
-    # list intent
-    if any(k in text for k in ["最近", "列表", "我的请假", "请假记录", "历史请假"]) and \
-       any(k in text for k in ["请假", "年假", "病假", "事假", "休假", "假期", "记录"]):
-        return "list"
+def _extract_leave_ids(text: str) -> list[str]:
+    return list(dict.fromkeys(re.findall(r"\bLV-[0-9a-fA-F]{6,12}\b", text or "")))
 
-    # modify intent
-    if any(k in text for k in ["修改", "变更", "调整", "改期", "改到", "改为"]):
-        return "modify"
 
-    # approve intent (HR/Admin)
-    if any(k in text for k in ["批准", "同意", "通过", "审批通过"]):
-        return "approve"
+def _extract_reason(text: str) -> str | None:
+    # naive reason extraction
+    m = re.search(r"(因为|理由|原因)[:： ]?(.*)$", text)
+    if m:
+        return (m.group(2) or "").strip()[:200] or None
+    return None
 
-    # reject intent (HR/Admin)
-    if any(k in text for k in ["驳回", "拒绝", "不通过", "审批拒绝"]):
-        return "reject"
 
-    return "apply"
+# ========= Intent Routing =========
 
+def decide_intent(state: LeaveState) -> str:
+    """apply / query / cancel / list / pending / modify / approve / reject / bulk_approve / bulk_reject
 
-def intent_node(state: LeaveState) -> dict:
-    return {}
+    router 的 route 节点已经用 app.intent_classifier 一次算好了 leave_intent，
+    直接调用 leave 子图时才在这里现算。
+    """
+    if state.get("bulk_review") and _is_confirm(state.get("text") or ""):
+        return "bulk_confirm"  # 上一轮列出了要批量处理的单，这一轮“确认”才真正写库
+    intent = state.get("leave_intent")
+    if intent:
+        return intent
+    return classify(state.get("text") or state.get("question") or "").intent
 
 
 # ========= Query / Cancel / Approve / Reject / List / Modify Nodes =========
@@ -232,11 +287,7 @@ def reject_leave_node(state: LeaveState) -> dict:
     if not leave_id:
         return {"answer": "请提供要驳回的请假编号（例如 LV-xxxxxxx）。"}
 
-    # naive reason extraction
-    reason = None
-    m = re.search(r"(因为|理由|原因)[:： ]?(.*)$", text)
-    if m:
-        reason = (m.group(2) or "").strip()[:200] or None
+    reason = _extract_reason(text)
 
     ok = reject_leave_request(
         leave_id,
@@ -249,108 +300,214 @@ def reject_leave_node(state: LeaveState) -> dict:
     return {"leave_id": leave_id, "answer": f"已驳回请假单 {leave_id}。原因：{reason or '未填写'}"}
 
 
+BULK_REVIEW_MAX = 200  # 对话里一次最多批量处理的单数，超出的请走 /leave/bulk_review
+_BULK_OUTCOME_TEXT = {"not_found": "未找到该单"}
+
+
+def _bulk_targets(text: str) -> tuple[list[dict], str | None]:
+    """按单号或筛选条件找出要批量处理的单；返回 (单据列表, 需要用户补充信息时的提示)。"""
+    leave_ids = _extract_leave_ids(text)
+    if leave_ids:
+        rows = []
+        for lid in leave_ids[:BULK_REVIEW_MAX]:
+            row = get_leave_request(lid)
+            rows.append(row or {"leave_id": lid, "status": "not_found"})
+        return rows, None
+
+    leave_type = _extract_leave_type(text)
+    start_from, start_to = _extract_date_range(text)
+    # 没有单号也没有筛选条件时，必须明确说“全部/所有”才处理整个待审批队列
+    if not (leave_type or start_from or start_to or any(k in text for k in ["全部", "所有", "全都"])):
+        return [], "请提供要批量处理的请假编号，或者说明筛选条件（例如：批准所有待审批的年假）。"
+    rows, cursor = [], None
+    while len(rows) < BULK_REVIEW_MAX:
+        page, cursor = get_pending_leave_requests(
+            leave_type=leave_type, start_from=start_from, start_to=start_to, cursor=cursor, limit=50,
+        )
+        rows.extend(page)
+        if not cursor:
+            break
+    return rows[:BULK_REVIEW_MAX], None
+
+
+def bulk_review_node(state: LeaveState) -> dict:
+    """批量批准 / 驳回的第一步：列出命中的单，要求回复“确认”，这一步不写库。
+
+    多个 LV 单号，或者按类型、开始日期范围筛选待审批的单。确认时只处理这里列出的单，
+    列出之后新进来的待审批单不会被顺带批掉。
+    """
+    role = (state.get("user_role") or "").lower()
+    if role not in {"admin", "hr"}:
+        return {"answer": "你没有审批权限（需要 HR/Admin）。"}
+
+    text = state.get("text") or state.get("question") or ""
+    intent = state.get("leave_intent") or classify(text).intent
+    decision = "REJECTED" if intent == "bulk_reject" else "APPROVED"
+    verb = "驳回" if decision == "REJECTED" else "批准"
+    reason = _extract_reason(text) if decision == "REJECTED" else None
+
+    rows, hint = _bulk_targets(text)
+    if hint:
+        return {"answer": hint, "bulk_review": None}
+    targets = [r["leave_id"] for r in rows if r.get("status", "PENDING") == "PENDING"]
+    if not targets:
+        return {"answer": f"没有符合条件的待审批请假，未{verb}任何单据。", "bulk_review": None}
+
+    lines = [f"将批量{verb}以下 {len(targets)} 条请假" + (f"，原因：{reason}" if reason else "") + "："]
+    for r in rows:
+        status = r.get("status", "PENDING")
+        if status == "PENDING":
+            lines.append(
+                f"- {r['leave_id']} | {r.get('requester', '')} | {r.get('leave_type', '')} | "
+                f"{r.get('start_time', '')} ~ {r.get('end_time', '')}"
+            )
+        elif status == "not_found":
+            lines.append(f"- {r['leave_id']}：跳过，未找到该单")
+        else:
+            lines.append(f"- {r['leave_id']}：跳过，当前状态 {status}，不是待审批（PENDING）")
+    lines.append(f"回复“确认”执行批量{verb}，回复其它内容取消。")
+    return {
+        "answer": "\n".join(lines),
+        "bulk_review": {"decision": decision, "leave_ids": targets, "reason": reason},
+    }
+
+
+def bulk_confirm_node(state: LeaveState) -> dict:
+    """批量审批的第二步：对上一轮列出的单执行批准 / 驳回，一个事务内完成。"""
+    pending = state.get("bulk_review") or {}
+    role = (state.get("user_role") or "").lower()
+    if role not in {"admin", "hr"}:
+        return {"answer": "你没有审批权限（需要 HR/Admin）。", "bulk_review": None}
+
+    decision = pending["decision"]
+    verb = "驳回" if decision == "REJECTED" else "批准"
+    reason = pending.get("reason")
+    outcomes = bulk_review_leave_requests(
+        decision,
+        approver=state.get("requester", "admin"),
+        leave_ids=pending["leave_ids"],
+        reason=reason,
+        max_items=BULK_REVIEW_MAX,
+    )
+
+    done = [lid for lid, o in outcomes.items() if o == decision]
+    lines = [f"已批量{verb} {len(done)} 条请假" + (f"，原因：{reason}" if reason else "") + "。"]
+    for lid, o in outcomes.items():
+        if o == decision:
+            lines.append(f"- {lid}：已{verb}")
+        elif o.startswith("not_pending:"):
+            lines.append(f"- {lid}：跳过，当前状态 {o.split(':', 1)[1]}，不是待审批（PENDING）")
+        else:
+            lines.append(f"- {lid}：跳过，{_BULK_OUTCOME_TEXT.get(o, o)}")
+    return {"answer": "\n".join(lines), "bulk_review": None}
+
+
 def list_leave_node(state: LeaveState) -> dict:
     text = state.get("text") or state.get("question") or ""
     requester = state.get("requester", "anonymous")
-    limit = _extract_limit(text, default=5)
+    limit = min(_extract_limit(text, default=5), 20)  # 我们查询的时候最多一次查询20条
 
-    rows = get_recent_leave_requests(requester, limit=limit)
+    cursor = state.get("list_cursor") if _wants_more(text) else None
+    rows, next_cursor = get_leave_history_page(requester, cursor=cursor, limit=limit)
     if not rows:
-        return {"answer": "你还没有请假记录。"}
+        return {"answer": "没有更早的请假记录了。" if cursor else "你还没有请假记录。", "list_cursor": None}
 
-    lines = [f"最近 {len(rows)} 条请假记录："]
+    lines = [f"{'更早的' if cursor else '最近'} {len(rows)} 条请假记录："]
     for r in rows:
         lines.append(
             f"- {r['leave_id']} | {r['leave_type']} | "
             f"{r['start_time']} ~ {r['end_time']} | "
             f"{r['duration_days']}天 | {r['status']}"
         )
-    return {"answer": "\n".join(lines)}
+    if next_cursor:
+        lines.append("回复“更多请假记录”查看更早的记录。")
+    return {"answer": "\n".join(lines), "list_cursor": next_cursor}
+
+
+def pending_leave_node(state: LeaveState) -> dict:
+    """HR/Admin 查看待审批队列，可按类型、开始日期范围筛选，支持翻页。"""
+    role = (state.get("user_role") or "").lower()
+    if role not in {"admin", "hr"}:
+        return {"answer": "你没有查看待审批队列的权限（需要 HR/Admin）。"}
+
+    text = state.get("text") or state.get("question") or ""
+    prev = state.get("pending_page") or {}
+    if _wants_more(text) and prev.get("cursor"):
+        page = dict(prev)  # 翻页沿用上一页的筛选条件
+    else:
+        start_from, start_to = _extract_date_range(text)
+        page = {
+            "leave_type": _extract_leave_type(text),
+            "start_from": start_from,
+            "start_to": start_to,
+            "cursor": None,
+        }
+
+    limit = min(_extract_limit(text, default=10), 50)
+    rows, next_cursor = get_pending_leave_requests(
+        leave_type=page["leave_type"],
+        start_from=page["start_from"],
+        start_to=page["start_to"],
+        cursor=page["cursor"],
+        limit=limit,
+    )
+    if not rows:
+        return {"answer": "没有更多待审批的请假了。" if page["cursor"] else "当前没有待审批的请假。", "pending_page": None}
+
+    lines = [f"待审批请假 {len(rows)} 条："]
+    for r in rows:
+        lines.append(
+            f"- {r['leave_id']} | {r['requester']} | {r['leave_type']} | "
+            f"{r['start_time']} ~ {r['end_time']} | {r['duration_days']}天"
+        )
+    if next_cursor:
+        lines.append("回复“更多待审批请假”查看下一页。")
+    return {"answer": "\n".join(lines), "pending_page": {**page, "cursor": next_cursor}}
 
 
 def modify_leave_node(state: LeaveState) -> dict:
     text = state.get("text") or state.get("question") or ""
-    requester = state.get("requester", "anonymous")
 
     leave_id = state.get("leave_id") or _extract_leave_id(text)
     if not leave_id:
         return {"answer": "请提供要修改的请假编号（例如 LV-xxxxxxx）。"}
 
-    old = get_leave_request(leave_id)
-    if not old:
+    # 0) 先普通读一次（不加锁）：单不存在、已经不是 PENDING 的直接拒掉，不白花下面两次大模型调用；
+    #    事务里锁行之后还会再查一遍状态，这里只是提前挡掉注定失败的请求
+    row = get_leave_request(leave_id)
+    if not row:
         return {"answer": f"未找到编号为 {leave_id} 的请假申请。"}
-    if old["status"] != "PENDING":
-        return {"answer": f"{leave_id} 不是待审批状态，无法修改（当前：{old['status']}）。"}
-
-    # 1) 基于旧单构造 base req
-    base_req = {
-        "leave_type": old["leave_type"],
-        "start_time": old["start_time"].strftime("%Y-%m-%d %H:%M"),
-        "end_time": old["end_time"].strftime("%Y-%m-%d %H:%M"),
-        "reason": old.get("reason"),
-        "requester": old["requester"],
+    if row.get("status") != "PENDING":
+        return {"answer": f"{leave_id} 不是待审批状态，无法修改（当前：{row.get('status')}）。"}
+
+    # 1) LLM 抽 leave_type / ISO 时间 / 原因（如果用户给了）；在开事务之前做完，不持锁等大模型
+    slots = _extract_slots(text)
+
+    # 2) LLM 解析相对时间（如果用户只说“下周二/明天下午”）
+    tdata = _parse_time(text)
+
+    changes = {
+        "leave_type": slots.get("leave_type"),
+        "start_time": _safe_iso(slots.get("start_time")) or _safe_iso(tdata.get("start_time")),
+        "end_time": _safe_iso(slots.get("end_time")) or _safe_iso(tdata.get("end_time")),
+        "reason": slots.get("reason"),
     }
 
-    llm = get_llm()
-
-    # 2) LLM 抽 leave_type / ISO 时间（如果用户给了）
-    raw_slots = llm.invoke([
-        SystemMessage(content=SLOT_SYSTEM),
-        HumanMessage(content=SLOT_USER.format(text=text)),
-    ]).content
-    slots = _safe_json_load(raw_slots)
-
-    # 3) LLM 解析相对时间（如果用户只说“下周二/明天下午”）
-    raw_time = llm.invoke([
-        SystemMessage(content=TIME_SYSTEM),
-        HumanMessage(content=TIME_USER.format(
-            now=datetime.now().strftime("%Y-%m-%d %H:%M"),
-            text=text
-        )),
-    ]).content
-    tdata = _safe_json_load(raw_time)
-
-    new_req = dict(base_req)
-
-    new_req["leave_type"] = slots.get("leave_type") or new_req["leave_type"]
-
-    st = _safe_iso(slots.get("start_time")) or _safe_iso(tdata.get("start_time"))
-    et = _safe_iso(slots.get("end_time")) or _safe_iso(tdata.get("end_time"))
-    if st:
-        new_req["start_time"] = st
-    if et:
-        new_req["end_time"] = et
-
-    new_req["reason"] = slots.get("reason") or new_req["reason"]
-
-    # 4) validate（余额 + 规则）
-    bal = get_leave_balance(requester) or {}
-    annual_balance = float(bal.get("annual_days", 0))
-    missing, violations = validate_leave(new_req, balance_days=annual_balance)
-    if missing or violations:
-        tips = []
-        if missing:
-            tips.append("缺少信息：" + "、".join(missing))
-        if violations:
-            tips.append("规则问题：" + "；".join(violations))
-        return {"answer": "；".join(tips) + "。请重新描述修改内容。"}
-
-    # 兜底计算 duration_days（防止 rules 不写回）
-    if not new_req.get("duration_days") and new_req.get("start_time") and new_req.get("end_time"):
-        st_dt = datetime.fromisoformat(new_req["start_time"])
-        et_dt = datetime.fromisoformat(new_req["end_time"])
-        new_req["duration_days"] = round((et_dt - st_dt).total_seconds() / 3600 / 8, 2)
-
-    # 5) 落库 update
-    ok = update_leave_request(leave_id, {
-        "leave_type": new_req["leave_type"],
-        "start_time": new_req["start_time"],
-        "end_time": new_req["end_time"],
-        "duration_days": new_req.get("duration_days"),
-        "reason": new_req.get("reason"),
-    })
-    if not ok:
-        return {"answer": "修改失败：该单可能已被审批或取消。"}
+    def _validate(req: dict, bal: dict | None, conflicts: list[dict]) -> tuple[list[str], list[str]]:
+        annual_balance = float((bal or {}).get("annual_days", 0))
+        missing, violations = validate_leave(req, balance_days=annual_balance, conflicts=conflicts)
+        # 兜底计算 duration_days（防止 rules 不写回）
+        if not missing and not req.get("duration_days"):
+            st_dt = datetime.fromisoformat(req["start_time"])
+            et_dt = datetime.fromisoformat(req["end_time"])
+            req["duration_days"] = round(get_calendar().working_days(st_dt, et_dt), 2)
+        return missing, violations
+
+    # 3) 一个事务里：锁行 + 读余额 -> 冲突检测 + 规则校验 -> update
+    result = modify_leave_request(leave_id, changes, _validate)
+    if not result["ok"]:
+        return {"answer": result["message"]}
+    new_req = result["req"]
 
     return {
         "leave_id": leave_id,
@@ -372,16 +529,8 @@ def parse_time_node(state: LeaveState) -> dict:
     if _safe_iso(req.get("start_time")) and _safe_iso(req.get("end_time")):
         return {}
 
-    llm = get_llm()
     text = state.get("text", "") or state.get("question", "") or ""
-    now = datetime.now().strftime("%Y-%m-%d %H:%M")
-
-    messages = [
-        SystemMessage(content=TIME_SYSTEM),
-        HumanMessage(content=TIME_USER.format(now=now, text=text)),
-    ]
-    raw = llm.invoke(messages).content
-    data = _safe_json_load(raw)
+    data = _parse_time(text)
 
     start = _safe_iso(data.get("start_time"))
     end = _safe_iso(data.get("end_time"))
@@ -396,15 +545,8 @@ def parse_time_node(state: LeaveState) -> dict:
 
 
 def extract_slots_node(state: LeaveState) -> dict:
-    llm = get_llm()
     text = state.get("text", "") or state.get("question", "") or ""
-
-    messages = [
-        SystemMessage(content=SLOT_SYSTEM),
-        HumanMessage(content=SLOT_USER.format(text=text)),
-    ]
-    raw = llm.invoke(messages).content
-    data = _safe_json_load(raw)
+    data = _extract_slots(text)
 
     req = state.get("req") or {}
     req.update({
@@ -421,10 +563,11 @@ def validate_node(state: LeaveState) -> dict:
     req = state.get("req") or {}
     requester = req.get("requester") or state.get("requester", "anonymous")
 
-    bal = get_leave_balance(requester) or {}
-    annual_balance = float(bal.get("annual_days", 0))
+    # 余额和时间冲突一次查回来
+    bal, conflicts = get_balance_and_conflicts(requester, req.get("start_time"), req.get("end_time"))
+    annual_balance = float((bal or {}).get("annual_days", 0))
 
-    missing, violations = validate_leave(req, balance_days=annual_balance)
+    missing, violations = validate_leave(req, balance_days=annual_balance, conflicts=conflicts)
     return {"missing_fields": missing, "violations": violations, "req": req}
 
 
@@ -459,9 +602,15 @@ def confirm_node(state: LeaveState) -> dict:
     return {"answer": ans}
 
 
+CONFIRM_WORDS = {"确认", "确定", "yes", "ok", "submit"}
+
+
+def _is_confirm(text: str) -> bool:
+    return (text or "").strip().lower() in CONFIRM_WORDS
+
+
 def decide_confirm(state: LeaveState) -> str:
-    text = (state.get("text") or "").strip().lower()
-    if text in {"确认", "确定", "yes", "ok", "submit"}:
+    if _is_confirm(state.get("text") or ""):
         return "create"
     return "end"
 
@@ -488,13 +637,15 @@ def build_leave_graph():
     g = StateGraph(LeaveState)
 
     # intent routing
-    g.add_node("intent", intent_node)
     g.add_node("query", query_leave_node)
     g.add_node("cancel", cancel_leave_node)
     g.add_node("list", list_leave_node)
+    g.add_node("pending", pending_leave_node)
     g.add_node("modify", modify_leave_node)
     g.add_node("approve", approve_leave_node)
     g.add_node("reject", reject_leave_node)
+    g.add_node("bulk_review", bulk_review_node)
+    g.add_node("bulk_confirm", bulk_confirm_node)
 
     # apply-flow
     g.add_node("parse_time", parse_time_node)
@@ -504,19 +655,22 @@ def build_leave_graph():
     g.add_node("confirm", confirm_node)
     g.add_node("create", create_leave_node)
 
-    g.add_edge(START, "intent")
-
+    # 从 START 直接按意图跳到目标节点
     g.add_conditional_edges(
-        "intent",
+        START,
         decide_intent,
         {
             "apply": "parse_time",
             "query": "query",
             "cancel": "cancel",
             "list": "list",
+            "pending": "pending",
             "modify": "modify",
             "approve": "approve",
             "reject": "reject",
+            "bulk_approve": "bulk_review",
+            "bulk_reject": "bulk_review",
+            "bulk_confirm": "bulk_confirm",
         },
     )
 
@@ -540,9 +694,12 @@ def build_leave_graph():
     g.add_edge("query", END)
     g.add_edge("cancel", END)
     g.add_edge("list", END)
+    g.add_edge("pending", END)
     g.add_edge("modify", END)
     g.add_edge("approve", END)
     g.add_edge("reject", END)
+    g.add_edge("bulk_review", END)
+    g.add_edge("bulk_confirm", END)
     g.add_edge("need_info", END)
     g.add_edge("create", END)
 
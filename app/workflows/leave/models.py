@@ -23,6 +23,7 @@ class LeaveState(TypedDict, total=False):
     text: str
     requester: str
     user_role: str
+    leave_intent: str    # 路由阶段已经分好的意图
 
     req: dict            # LeaveRequest as dict
     missing_fields: List[str]
@@ -30,4 +31,8 @@ class LeaveState(TypedDict, total=False):
 
     answer: str
     confirmed: bool
-    leave_id: Optional[str]  # LV-XXXXXXXX
\ No newline at end of file
+    leave_id: Optional[str]  # LV-XXXXXXXX
+
+    list_cursor: Optional[str]      # 请假历史翻页用（“更多请假记录”）
+    pending_page: Optional[dict]    # 待审批队列翻页用：筛选条件 + cursor
+    bulk_review: Optional[dict]     # 等待“确认”的批量审批：decision + 列出的 leave_ids + reason
\ No newline at end of file
@@ -1,7 +1,14 @@
 from typing import List, Tuple, Dict, Any
-from datetime import datetime, timedelta
+from datetime import datetime
 
-def validate_leave(req: Dict[str, Any], balance_days: float = 5.0) -> Tuple[List[str], List[str]]:
+from app.workflows.leave.calendar import get_calendar
+
+def validate_leave(
+    req: Dict[str, Any],
+    balance_days: float = 5.0,
+    conflicts: List[Dict[str, Any]] | None = None,
+) -> Tuple[List[str], List[str]]:
+    """conflicts：和本次申请时间重叠的已有单（PENDING/APPROVED），由调用方和余额一起查好传进来。"""
     missing = []  # 上级调用者会传来一个请求，请求中缺失的内容
     violations = [] # 违反的具体规则说明
 
@@ -23,7 +30,9 @@ def validate_leave(req: Dict[str, Any], balance_days: float = 5.0) -> Tuple[List
     if end <= start:
         violations.append("结束时间必须晚于开始时间")
 
-    duration = (end - start).total_seconds() / 3600.0 / 8.0
+    # 只算工作日的工作时段（周末、节假日、午休、夜里都不算），8 个工作小时 = 1 天
+    cal = get_calendar()
+    duration = cal.working_days(start, end)
     if duration < 0.5:
         violations.append("最小请假单位为 0.5 天")
 
@@ -31,10 +40,16 @@ def validate_leave(req: Dict[str, Any], balance_days: float = 5.0) -> Tuple[List
     if leave_type == "annual":
         if duration > balance_days:
             violations.append(f"年假余额不足（剩余 {balance_days} 天）")
-        # 提前 1 个工作日（简单版：提前 24h）
-        if start < datetime.now() + timedelta(days=1):
+        # 提前 1 个工作日：开始日期不能早于今天之后的下一个工作日
+        if start.date() < cal.next_workday(datetime.now().date()):
             violations.append("年假需至少提前 1 个工作日提交")
 
+    if conflicts:
+        items = "、".join(
+            f"{c['leave_id']}（{c['start_time']} ~ {c['end_time']}，{c['status']}）" for c in conflicts
+        )
+        violations.append(f"与已有请假时间重叠：{items}")
+
     if leave_type == "sick":
         if duration >= 1 and not req.get("reason"):
             violations.append("病假超过 1 天需提供病假原因/证明说明")
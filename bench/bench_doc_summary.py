@@ -0,0 +1,171 @@
+# bench/bench_doc_summary.py
+# 文档摘要两步检索（app/rag/doc_summary.py）vs 全量 chunk 检索：随语料变大的延迟和召回。
+#
+# 合成数据：若干“部门”，每个部门一组主题中心；每篇文档 = 部门中心 + 文档自己的偏移，
+# 文档的 chunk = 文档中心 + 噪声。摘要向量 = 文档全部 chunk 的均值 + 噪声（--summary-noise，模拟摘要写得不完美）。
+# 查询 = 随机一个 chunk + 扰动（--query-noise），它所在的文档就是“正确文档”。
+# 指标：
+#   recall@k   ：结果落在全量精确 top-k 里的比例（两步检索相对全量检索丢了多少）
+#   hit@k      ：出查询的那个 chunk 有没有被找回来
+#   same_doc@k ：结果里来自正确文档的比例（别的文档的 chunk 抢名额的程度）
+#   doc_recall ：第一步挑出的候选文档里有没有正确文档
+# 后端：
+#   numpy（默认）：app/rag/quantized.py 的 QuantizedIndex（float16，和 VECTOR_QUANTIZATION 线上路径同一套代码）
+#   chroma       ：--host/--port 连 chroma server，全量 query vs where={"source": {"$in": 候选}}
+#
+# 用法：
+#   python -m bench.bench_doc_summary
+#   python -m bench.bench_doc_summary --docs 50,200,800 --chunks-per-doc 40 --top-docs 5
+#   python -m bench.bench_doc_summary --backend chroma --host 127.0.0.1 --port 8000
+
+import argparse
+import json
+import time
+import uuid
+
+import numpy as np
+
+from bench.bench_partitions import _pct
+
+
+def make_corpus(n_docs: int, chunks_per_doc: int, dim: int, depts: int, summary_noise: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    dept_centers = rng.normal(size=(depts, dim)).astype(np.float32)
+    doc_dept = rng.integers(depts, size=n_docs)
+    doc_centers = dept_centers[doc_dept] + rng.normal(scale=0.7, size=(n_docs, dim)).astype(np.float32)
+    doc_of = np.repeat(np.arange(n_docs), chunks_per_doc)
+    vecs = doc_centers[doc_of] + rng.normal(scale=0.9, size=(len(doc_of), dim)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    summaries = np.stack([vecs[doc_of == d].mean(axis=0) for d in range(n_docs)])
+    summaries /= np.linalg.norm(summaries, axis=1, keepdims=True)
+    summaries += rng.normal(scale=summary_noise / np.sqrt(dim), size=summaries.shape).astype(np.float32)
+    summaries /= np.linalg.norm(summaries, axis=1, keepdims=True)
+    return vecs, doc_of, summaries.astype(np.float32)
+
+
+def make_queries(vecs: np.ndarray, n: int, noise: float, seed: int = 1) -> list[tuple[int, np.ndarray]]:
+    """noise 是扰动相对 chunk 向量（单位长度）的大小；问题和原文措辞不同，取 0.5 以上才像真实查询。"""
+    rng = np.random.default_rng(seed)
+    out = []
+    for i in rng.choice(len(vecs), size=n, replace=False):
+        q = vecs[i] + rng.normal(scale=noise / np.sqrt(vecs.shape[1]), size=vecs.shape[1]).astype(np.float32)
+        out.append((int(i), q / np.linalg.norm(q)))
+    return out
+
+
+def top_docs(summaries: np.ndarray, q: np.ndarray, n: int) -> np.ndarray:
+    scores = summaries @ q
+    return np.argpartition(-scores, n - 1)[:n] if n < len(scores) else np.arange(len(scores))
+
+
+class NumpyBackend:
+    def __init__(self, vecs: np.ndarray, doc_of: np.ndarray):
+        from app.rag.quantized import QuantizedIndex
+
+        metas = [{"source": f"doc{d}", "visibility": "public"} for d in doc_of]
+        self.index = QuantizedIndex([str(i) for i in range(len(vecs))], vecs, metas, dtype="float16")
+        self.index.search(vecs[0], k=1, sources={"doc0"})  # 建好按 source 分组的行号缓存
+
+    def flat(self, q: np.ndarray, k: int) -> list[int]:
+        return [i for i, _ in self.index.search(q, k=k)]
+
+    def restricted(self, q: np.ndarray, k: int, docs: np.ndarray) -> list[int]:
+        return [i for i, _ in self.index.search(q, k=k, sources={f"doc{d}" for d in docs})]
+
+    def close(self) -> None:
+        pass
+
+
+class ChromaBackend:
+    def __init__(self, vecs: np.ndarray, doc_of: np.ndarray, host: str, port: int):
+        import chromadb
+
+        self.client = chromadb.HttpClient(host=host, port=port)
+        self.col = self.client.create_collection(f"bench_docsum_{uuid.uuid4().hex[:8]}")
+        for i in range(0, len(vecs), 2000):
+            sl = slice(i, i + 2000)
+            self.col.add(
+                ids=[str(x) for x in range(sl.start, min(sl.stop, len(vecs)))],
+                embeddings=vecs[sl].tolist(),
+                metadatas=[{"source": f"doc{d}"} for d in doc_of[sl]],
+            )
+
+    def flat(self, q: np.ndarray, k: int) -> list[int]:
+        res = self.col.query(query_embeddings=[q.tolist()], n_results=k)
+        return [int(x) for x in res["ids"][0]]
+
+    def restricted(self, q: np.ndarray, k: int, docs: np.ndarray) -> list[int]:
+        res = self.col.query(
+            query_embeddings=[q.tolist()], n_results=k,
+            where={"source": {"$in": [f"doc{d}" for d in docs]}},
+        )
+        return [int(x) for x in res["ids"][0]]
+
+    def close(self) -> None:
+        self.client.delete_collection(self.col.name)
+
+
+def run_size(args, n_docs: int) -> dict:
+    vecs, doc_of, summaries = make_corpus(n_docs, args.chunks_per_doc, args.dim, args.depts, args.summary_noise)
+    queries = make_queries(vecs, min(args.queries, len(vecs)), args.query_noise)
+    backend = ChromaBackend(vecs, doc_of, args.host, args.port) if args.backend == "chroma" else NumpyBackend(vecs, doc_of)
+    report = {"docs": n_docs, "chunks": len(vecs)}
+    try:
+        truth = {}
+        for i, q in queries:
+            d = ((vecs - q) ** 2).sum(axis=1)
+            truth[i] = set(np.argsort(d)[:args.k].tolist())
+
+        def two_stage(q):
+            return backend.restricted(q, args.k, top_docs(summaries, q, args.top_docs))
+
+        variants = [("flat", lambda q: backend.flat(q, args.k)), ("two_stage", two_stage)]
+        for name, fn in variants:
+            for _, q in queries[:5]:
+                fn(q)  # 预热
+            lat, recall, hit, same_doc, doc_recall = [], [], [], [], []
+            for i, q in queries:
+                t0 = time.perf_counter()
+                got = fn(q)
+                lat.append(time.perf_counter() - t0)
+                recall.append(len(truth[i] & set(got)) / args.k)
+                hit.append(i in got)
+                same_doc.append(np.mean([doc_of[g] == doc_of[i] for g in got]) if got else 0.0)
+                if name == "two_stage":
+                    doc_recall.append(doc_of[i] in set(top_docs(summaries, q, args.top_docs).tolist()))
+            report[name] = {
+                "p50_ms": _pct(lat, 0.5),
+                "p95_ms": _pct(lat, 0.95),
+                f"recall@{args.k}": round(float(np.mean(recall)), 4),
+                f"hit@{args.k}": round(float(np.mean(hit)), 4),
+                f"same_doc@{args.k}": round(float(np.mean(same_doc)), 4),
+            }
+            if doc_recall:
+                report[name]["doc_recall"] = round(float(np.mean(doc_recall)), 4)
+    finally:
+        backend.close()
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", default="50,200,800", help="逗号分隔的文档数，逐个规模跑一遍")
+    ap.add_argument("--chunks-per-doc", type=int, default=40)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--depts", type=int, default=8)
+    ap.add_argument("--summary-noise", type=float, default=0.3)
+    ap.add_argument("--query-noise", type=float, default=0.8)
+    ap.add_argument("--top-docs", type=int, default=5)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=8)
+    ap.add_argument("--backend", choices=["numpy", "chroma"], default="numpy")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    args = ap.parse_args()
+    sizes = [int(x) for x in args.docs.split(",") if x.strip()]
+    print(json.dumps({"top_docs": args.top_docs, "k": args.k, "backend": args.backend,
+                      "sizes": [run_size(args, n) for n in sizes]}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
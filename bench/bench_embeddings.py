@@ -0,0 +1,124 @@
+# bench/bench_embeddings.py
+# embedding 后端对比（app/rag/local_embeddings.py）：远程 DashScope vs 本地哈希 TF-IDF vs 本地 ONNX。
+#
+# 评测集：data/eval/retrieval_qa.jsonl，每条是一个问题 + 答案所在文档 + 答案里一定出现的片段。
+# 语料：data/docs 按线上同样的 chunk_size / chunk_overlap 切块（不写父段落库），每个后端 embed 一遍，
+# 问题向量和全部 chunk 做精确的余弦检索（不经过 Chroma，只比较 embedding 本身）。
+# 指标：
+#   hit@k     ：前 k 个 chunk 里有没有包含答案片段的
+#   mrr@k     ：第一个包含答案片段的 chunk 排名的倒数（没有记 0）
+#   source@1  ：第一名 chunk 是否来自答案所在文档
+#   query_p50_ms / query_p95_ms：单个问题 embed_query 的延迟（远程模型包含网络往返）
+#   docs_per_s：embed_documents 的吞吐（整个语料一次调用）
+#
+# 用法：
+#   python -m bench.bench_embeddings                                   # hashing（拟合 idf / 不用 idf）
+#   python -m bench.bench_embeddings --backends hashing,dashscope      # 需要 QIANWEN_API_KEY 和网络
+#   python -m bench.bench_embeddings --backends hashing,onnx --onnx-model models/bge-small-zh
+#   python -m bench.bench_embeddings --repeat 20                       # 语料重复 20 遍测吞吐
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.config import settings
+from bench.bench_partitions import _pct
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+
+def load_eval(path: str) -> list[dict]:
+    with open(ROOT_DIR / path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_chunks(docs_dir: str) -> list:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    from app.ingestion.loader import load_docs
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=settings.chunk_size, chunk_overlap=settings.chunk_overlap)
+    return splitter.split_documents(load_docs(str(ROOT_DIR / docs_dir)))
+
+
+def make_backend(name: str, args, texts: list[str]):
+    from app.rag.local_embeddings import HashingEmbeddings, OnnxEmbeddings
+
+    dim = settings.local_embedding_dim
+    if name == "hashing":
+        emb = HashingEmbeddings(dim=dim, threads=args.threads)
+        emb.idf = emb.fit_idf(texts)  # 和 python -m app.rag.local_embeddings fit 一样，在语料上拟合
+        return emb
+    if name == "hashing-noidf":
+        return HashingEmbeddings(dim=dim, threads=args.threads)
+    if name == "onnx":
+        if not args.onnx_model:
+            raise ValueError("--onnx-model is required for the onnx backend")
+        return OnnxEmbeddings(args.onnx_model, pooling=args.onnx_pooling, query_instruction=args.onnx_query_instruction,
+                              threads=args.threads)
+    if name == "dashscope":
+        from langchain_community.embeddings import DashScopeEmbeddings
+
+        return DashScopeEmbeddings(model=settings.qianwen_embedding_model_name, dashscope_api_key=settings.qianwen_api_key)
+    raise ValueError(f"unknown backend: {name}")
+
+
+def run_backend(name: str, args, chunks: list, evalset: list[dict]) -> dict:
+    texts = [c.page_content for c in chunks]
+    emb = make_backend(name, args, texts)
+
+    t0 = time.perf_counter()
+    doc_vecs = np.asarray(emb.embed_documents(texts * args.repeat), dtype=np.float32)[: len(texts)]
+    doc_s = time.perf_counter() - t0
+    doc_vecs /= np.maximum(np.linalg.norm(doc_vecs, axis=1, keepdims=True), 1e-9)
+
+    lat, hits, rr, src1 = [], [], [], []
+    for item in evalset:
+        t0 = time.perf_counter()
+        q = np.asarray(emb.embed_query(item["question"]), dtype=np.float32)
+        lat.append(time.perf_counter() - t0)
+        order = np.argsort(-(doc_vecs @ (q / max(np.linalg.norm(q), 1e-9))))[: args.k]
+        found = [r for r, i in enumerate(order) if item["answer_contains"] in texts[i]]
+        hits.append(bool(found))
+        rr.append(1 / (found[0] + 1) if found else 0.0)
+        src1.append(item["source"] in str(chunks[order[0]].metadata.get("source")))
+    return {
+        "dim": int(doc_vecs.shape[1]),
+        f"hit@{args.k}": round(float(np.mean(hits)), 4),
+        f"mrr@{args.k}": round(float(np.mean(rr)), 4),
+        "source@1": round(float(np.mean(src1)), 4),
+        "query_p50_ms": _pct(lat, 0.5),
+        "query_p95_ms": _pct(lat, 0.95),
+        "docs_per_s": round(len(texts) * args.repeat / doc_s, 1),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backends", default="hashing,hashing-noidf", help="逗号分隔：hashing / hashing-noidf / onnx / dashscope")
+    ap.add_argument("--eval", default="data/eval/retrieval_qa.jsonl")
+    ap.add_argument("--docs", default="data/docs")
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--repeat", type=int, default=1, help="语料重复几遍测 embed_documents 吞吐")
+    ap.add_argument("--threads", type=int, default=settings.local_embedding_threads)
+    ap.add_argument("--onnx-model", default=settings.onnx_embedding_model)
+    ap.add_argument("--onnx-pooling", default=settings.onnx_embedding_pooling)
+    ap.add_argument("--onnx-query-instruction", default=settings.onnx_query_instruction)
+    args = ap.parse_args()
+
+    chunks = load_chunks(args.docs)
+    evalset = load_eval(args.eval)
+    report = {"chunks": len(chunks), "questions": len(evalset), "k": args.k, "backends": {}}
+    for name in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        try:
+            report["backends"][name] = run_backend(name, args, chunks, evalset)
+        except Exception as e:  # 没网 / 没装 onnxruntime 时只跳过这一个后端
+            report["backends"][name] = {"skipped": f"{type(e).__name__}: {e}"}
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
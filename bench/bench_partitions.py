@@ -0,0 +1,151 @@
+# bench/bench_partitions.py
+# 单 collection + visibility 过滤  vs  按 visibility 分区并行检索：延迟和召回率对比。
+#
+# 合成数据：N 条向量，public 占大头（默认 85%），hr / finance / it 各占一小块，
+# 模拟 data/docs 里 public 制度文档远多于部门文档的情况。
+# 召回的基准是对“角色可见的全部向量”做精确的暴力 L2 检索（numpy），
+# recall@k = ANN 结果里落在精确 top-k 的比例。
+#
+# 用法：
+#   python -m bench.bench_partitions                      # 进程内 chromadb（需要完整版 chromadb）
+#   python -m bench.bench_partitions --host 127.0.0.1 --port 8000   # 连 chroma server
+#   python -m bench.bench_partitions --n 50000 --dim 256 --queries 200 --k 8
+
+import argparse
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SHARES = {"public": 0.85, "hr": 0.05, "finance": 0.05, "it": 0.05}
+ROLES = ["hr", "finance", "it"]
+
+
+def make_corpus(n: int, dim: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """每个可见性一组簇中心，向量 = 簇中心 + 噪声，比纯随机更像真实 embedding 的分布。"""
+    rng = np.random.default_rng(seed)
+    labels = rng.choice(list(SHARES), size=n, p=list(SHARES.values()))
+    centers = {v: rng.normal(size=(16, dim)) for v in SHARES}
+    vecs = np.empty((n, dim), dtype=np.float32)
+    for i, v in enumerate(labels):
+        vecs[i] = centers[v][rng.integers(16)] + rng.normal(scale=0.6, size=dim)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs, labels
+
+
+def make_queries(vecs: np.ndarray, labels: np.ndarray, n: int, seed: int = 1) -> list[tuple[np.ndarray, str]]:
+    """查询 = 某个角色可见的一条向量 + 扰动；一半查部门文档，一半查 public。"""
+    rng = np.random.default_rng(seed)
+    out = []
+    for i in range(n):
+        role = ROLES[i % len(ROLES)]
+        pool = np.flatnonzero(labels == (role if i % 2 == 0 else "public"))
+        q = vecs[rng.choice(pool)] + rng.normal(scale=0.05, size=vecs.shape[1]).astype(np.float32)
+        out.append((q / np.linalg.norm(q), role))
+    return out
+
+
+def exact_topk(vecs: np.ndarray, labels: np.ndarray, q: np.ndarray, role: str, k: int) -> set[int]:
+    visible = np.flatnonzero(np.isin(labels, ["public", role]))
+    d = ((vecs[visible] - q) ** 2).sum(axis=1)
+    return set(visible[np.argsort(d)[:k]].tolist())
+
+
+def _client(args):
+    import chromadb
+
+    if args.host:
+        return chromadb.HttpClient(host=args.host, port=args.port)
+    return chromadb.EphemeralClient()
+
+
+def _add(col, ids: np.ndarray, vecs: np.ndarray, labels: np.ndarray, batch: int = 2000) -> None:
+    for i in range(0, len(ids), batch):
+        sl = slice(i, i + batch)
+        col.add(
+            ids=[str(x) for x in ids[sl]],
+            embeddings=vecs[sl].tolist(),
+            metadatas=[{"visibility": v} for v in labels[sl]],
+        )
+
+
+def _pct(xs: list[float], q: float) -> float:
+    xs = sorted(xs)
+    return round(xs[min(len(xs) - 1, int(q * len(xs)))] * 1000, 2)
+
+
+def run(args) -> dict:
+    vecs, labels = make_corpus(args.n, args.dim)
+    queries = make_queries(vecs, labels, args.queries)
+    ids = np.arange(len(vecs))
+    client = _client(args)
+    tag = uuid.uuid4().hex[:8]
+
+    single = client.create_collection(f"bench_single_{tag}")
+    _add(single, ids, vecs, labels)
+    parts = {}
+    for v in SHARES:
+        mask = labels == v
+        parts[v] = client.create_collection(f"bench_part_{tag}-{v}")
+        _add(parts[v], ids[mask], vecs[mask], labels[mask])
+
+    pool = ThreadPoolExecutor(max_workers=4)
+
+    def q_single(q, role):
+        res = single.query(
+            query_embeddings=[q.tolist()], n_results=args.k,
+            where={"visibility": {"$in": ["public", role]}},
+        )
+        return [int(x) for x in res["ids"][0]]
+
+    def q_parts(q, role):
+        futs = [
+            pool.submit(parts[v].query, query_embeddings=[q.tolist()], n_results=args.k)
+            for v in ("public", role)
+        ]
+        hits = []
+        for f in futs:
+            res = f.result()
+            hits += zip(res["distances"][0], res["ids"][0])
+        return [int(i) for _, i in sorted(hits)[:args.k]]
+
+    report = {"n": args.n, "dim": args.dim, "queries": args.queries, "k": args.k}
+    try:
+        for name, fn in [("filtered_single", q_single), ("partitioned", q_parts)]:
+            for q, role in queries[:5]:
+                fn(q, role)  # 预热
+            lat, recall = [], []
+            for q, role in queries:
+                t0 = time.perf_counter()
+                got = fn(q, role)
+                lat.append(time.perf_counter() - t0)
+                truth = exact_topk(vecs, labels, q, role, args.k)
+                recall.append(len(truth & set(got)) / args.k)
+            report[name] = {
+                "p50_ms": _pct(lat, 0.5),
+                "p95_ms": _pct(lat, 0.95),
+                f"recall@{args.k}": round(float(np.mean(recall)), 4),
+            }
+    finally:
+        pool.shutdown()
+        client.delete_collection(single.name)
+        for col in parts.values():
+            client.delete_collection(col.name)
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=8)
+    ap.add_argument("--host", default=None)
+    ap.add_argument("--port", type=int, default=8000)
+    print(json.dumps(run(ap.parse_args()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# bench/bench_quantization.py
+# 量化向量索引（app/rag/quantized.py）的内存 / 召回 / 延迟对比：float32 vs float16 vs int8（± float32 重打分）。
+#
+# 召回基准：float32 精确暴力 L2 检索的 top-k；recall@k = 量化检索结果落在其中的比例。
+#
+# 内存看两个数：
+#   resident_bytes：索引自己的数组（codes + scales + 范数 + 过滤列），只是下限
+#   rss_delta_bytes：整进程 RSS 的增量（建索引 + 跑完全部查询之后，含 ids 列表；重打分用 pread 读磁盘上的原向量，不算在内）
+# --from-chroma 时另外记下 Chroma 查询一次（加载它自己的 float32 HNSW）带来的 RSS 增量：
+# 量化索引是叠加在 Chroma 之上的，进程总内存 = Chroma + 量化索引，比只用 Chroma 多，不是少。
+# memory_vs_float32 比较的是“进程里再放一份 float32 矩阵做暴力检索”。
+# 数据来源：
+#   --from-chroma：从当前激活语料的 collection 里拉真实的 embedding（data/docs 入库后的向量），
+#                  查询用语料里随机抽的向量加一点扰动
+#   默认         ：合成 1536 维（text-embedding-v2 的维度）带簇结构的向量
+#
+# 用法：
+#   python -m bench.bench_quantization
+#   python -m bench.bench_quantization --from-chroma --queries 200 --k 8
+#   python -m bench.bench_quantization --n 100000 --rescore 4
+
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.rag.quantized import QuantizedIndex
+
+
+def synthetic(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(64, dim)).astype(np.float32)
+    vecs = centers[rng.integers(64, size=n)] + rng.normal(scale=0.8, size=(n, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def rss_bytes() -> int | None:
+    """当前进程的常驻内存（Linux /proc）；拿不到时返回 None。"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _delta(after: int | None, before: int | None) -> int | None:
+    return after - before if after is not None and before is not None else None
+
+
+def from_chroma() -> tuple[np.ndarray, int | None]:
+    """返回 (语料里的全部向量, Chroma 加载 HNSW 带来的 RSS 增量)。"""
+    from app.rag.vectorstore import corpus_collections, get_chroma_client
+
+    client = get_chroma_client()
+    names = corpus_collections()
+    before = rss_bytes()
+    for name in names:
+        col = client.get_collection(name)
+        if col.count():
+            first = col.get(limit=1, include=["embeddings"])["embeddings"]
+            col.query(query_embeddings=[list(first[0])], n_results=1)  # 查一次，Chroma 把 HNSW 加载进来
+    chroma_rss = _delta(rss_bytes(), before)
+    vecs = []
+    for name in names:
+        data = client.get_collection(name).get(include=["embeddings"])
+        if len(data["embeddings"]):
+            vecs.append(np.asarray(data["embeddings"], dtype=np.float32))
+    if not vecs:
+        raise SystemExit("active corpus has no embeddings; run /reindex first")
+    return np.concatenate(vecs), chroma_rss
+
+
+def make_queries(vecs: np.ndarray, n: int, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    q = vecs[rng.integers(len(vecs), size=n)]
+    q = q + rng.normal(scale=0.3 / np.sqrt(vecs.shape[1]), size=q.shape).astype(np.float32)
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def exact_topk(vecs: np.ndarray, q: np.ndarray, k: int) -> np.ndarray:
+    d = (vecs ** 2).sum(axis=1) - 2 * vecs @ q
+    return np.argpartition(d, k)[:k]
+
+
+def _pct(xs: list[float], q: float) -> float:
+    xs = sorted(xs)
+    return round(xs[min(len(xs) - 1, int(q * len(xs)))] * 1000, 3)
+
+
+def run(args) -> dict:
+    chroma_rss = None
+    if args.from_chroma:
+        vecs, chroma_rss = from_chroma()
+    else:
+        vecs = synthetic(args.n, args.dim)
+    queries = make_queries(vecs, args.queries)
+    truth = [set(exact_topk(vecs, q, args.k).tolist()) for q in queries]
+    n = len(vecs)
+    metas = [{"visibility": "public", "source": f"doc{i % 50}"} for i in range(n)]
+
+    report = {
+        "vectors": n,
+        "dim": int(vecs.shape[1]),
+        "k": args.k,
+        "float32_bytes": int(vecs.nbytes),
+        "chroma_rss_delta_bytes": chroma_rss,
+        "variants": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype in ["float16", "int8"]:
+            gc.collect()
+            before = rss_bytes()
+            index = QuantizedIndex([str(i) for i in range(n)], vecs, metas, dtype=dtype, full_path=Path(tmp) / f"{dtype}.f32")
+            for rescore in [0, args.rescore]:
+                lat, recall = [], []
+                for q, t in zip(queries, truth):
+                    t0 = time.perf_counter()
+                    hits = index.search(q, k=args.k, rescore=rescore)
+                    lat.append(time.perf_counter() - t0)
+                    recall.append(len(t & {i for i, _ in hits}) / args.k)
+                rss = _delta(rss_bytes(), before)
+                report["variants"][f"{dtype}{f'+rescore{rescore}' if rescore else ''}"] = {
+                    "resident_bytes": index.memory_bytes(),
+                    "rss_delta_bytes": rss,
+                    "memory_vs_float32": round(index.memory_bytes() / vecs.nbytes, 3),
+                    "rss_vs_float32": round(rss / vecs.nbytes, 3) if rss is not None else None,
+                    f"recall@{args.k}": round(float(np.mean(recall)), 4),
+                    "p50_ms": _pct(lat, 0.5),
+                    "p95_ms": _pct(lat, 0.95),
+                }
+            del index
+    report["note"] = (
+        "quantized index is resident in addition to Chroma's own float32 HNSW; "
+        "total process memory = Chroma + rss_delta_bytes"
+    )
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--from-chroma", action="store_true")
+    ap.add_argument("--n", type=int, default=20000)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=8)
+    ap.add_argument("--rescore", type=int, default=4)
+    print(json.dumps(run(ap.parse_args()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
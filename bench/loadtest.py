@@ -0,0 +1,328 @@
+# bench/loadtest.py
+# 单个 app.main worker 的并发压测：能扛多少并发用户，p95 从哪一档开始崩。
+#
+# 两个子命令：
+#   serve：起一个接了本地替身（bench/standins.py）的 app.main，单 worker，不连任何外部服务
+#   run  ：asyncio 压测器，闭环虚拟用户（发请求 -> 等响应 -> 思考时间 -> 下一个），按阶梯调整用户数
+#
+# 场景（每个虚拟用户每次抽一个场景跑完）：
+#   qa          /chat 单轮问答
+#   qa_stream   /chat/stream 单轮问答，额外记首 token 时间（ttft）
+#   multi_turn  同一个 session_id 连问 3 轮（第 2、3 轮是追问，会触发问题改写）
+#   leave       同一个 session_id：提请假 -> 确认 -> 查记录
+#   ingest      /ingest 上传一个小文本
+# 混合比例：--mix qa_heavy / leave_heavy / multi_turn / mixed
+# 阶梯：--ramp "10x30s,50x60s,100x60s" 表示 10 个用户跑 30 秒，再 50 个跑 60 秒……
+#
+# 报告（JSON）：每一档的吞吐（rps）、错误率、p50/p90/p95/p99，按接口拆分；
+# 以及 p95 超过 --slo-ms 或错误率超过 --max-error-rate 的第一档（saturated_at）。
+#
+# 用法：
+#   python -m bench.loadtest serve --port 8099 --llm-latency-ms 300
+#   python -m bench.loadtest run --base-url http://127.0.0.1:8099 --mix qa_heavy --ramp 10x30s,50x60s
+#   python -m bench.loadtest run --spawn-server --mix mixed --ramp 5x20s,20x20s,50x20s   # 自己起 serve 子进程
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+QA_QUESTIONS = [
+    "年假怎么申请？", "年假有多少天？", "病假需要什么材料？", "请假审批流程是什么？",
+    "电脑坏了怎么报修？", "IT 工单多久处理？", "事假扣工资吗？", "请假可以撤销吗？",
+]
+FOLLOWUPS = ["那病假呢？", "需要提前多久？", "这个要谁审批？", "那事假呢？"]
+LEAVE_TEXTS = ["我想下周一请一天年假，家里有事", "帮我请个病假，明天全天", "我要请后天下午的事假"]
+
+MIXES = {
+    "qa_heavy": {"qa": 0.6, "qa_stream": 0.2, "multi_turn": 0.1, "leave": 0.08, "ingest": 0.02},
+    "leave_heavy": {"leave": 0.6, "qa": 0.25, "multi_turn": 0.1, "qa_stream": 0.05},
+    "multi_turn": {"multi_turn": 0.8, "qa_stream": 0.2},
+    "mixed": {"qa": 0.35, "qa_stream": 0.2, "multi_turn": 0.2, "leave": 0.2, "ingest": 0.05},
+}
+
+
+@dataclass
+class Sample:
+    stage: int
+    endpoint: str
+    scenario: str
+    latency: float
+    ok: bool
+    ttft: float | None = None
+    error: str | None = None
+
+
+@dataclass
+class Stage:
+    users: int
+    seconds: float
+
+
+@dataclass
+class Recorder:
+    samples: list[Sample] = field(default_factory=list)
+    stage: int = 0
+
+
+def parse_ramp(spec: str) -> list[Stage]:
+    """'10x30s,50x60s' -> [Stage(10, 30), Stage(50, 60)]"""
+    stages = []
+    for part in spec.split(","):
+        users, _, dur = part.strip().partition("x")
+        stages.append(Stage(int(users), float(dur.rstrip("s"))))
+    return stages
+
+
+# ---------- 场景 ----------
+
+async def _post_chat(client, rec: Recorder, scenario: str, text: str, sid: str | None, role: str = "public") -> str | None:
+    t0 = time.perf_counter()
+    try:
+        r = await client.post("/chat", json={"text": text, "session_id": sid, "user_role": role, "requester": f"u-{sid}"})
+        ok = r.status_code == 200
+        rec.samples.append(Sample(rec.stage, "/chat", scenario, time.perf_counter() - t0, ok, error=None if ok else str(r.status_code)))
+        return r.json().get("session_id") if ok else sid
+    except Exception as e:
+        rec.samples.append(Sample(rec.stage, "/chat", scenario, time.perf_counter() - t0, False, error=type(e).__name__))
+        return sid
+
+
+async def _post_stream(client, rec: Recorder, scenario: str, text: str) -> None:
+    t0 = time.perf_counter()
+    ttft, ok, err = None, False, None
+    try:
+        async with client.stream("POST", "/chat/stream", json={"text": text, "mode": "qa"}) as r:
+            if r.status_code != 200:
+                err = str(r.status_code)
+            else:
+                async for line in r.aiter_lines():
+                    if line.startswith("event: token") and ttft is None:
+                        ttft = time.perf_counter() - t0
+                    elif line.startswith("event: done"):
+                        ok = True
+                    elif line.startswith("event: error"):
+                        err = "stream_error"
+    except Exception as e:
+        err = type(e).__name__
+    rec.samples.append(Sample(rec.stage, "/chat/stream", scenario, time.perf_counter() - t0, ok, ttft, err))
+
+
+async def _post_ingest(client, rec: Recorder, scenario: str) -> None:
+    body = ("压测文档 " + uuid.uuid4().hex + "\n" + "员工请假需提前提交申请。" * 20).encode("utf-8")
+    t0 = time.perf_counter()
+    try:
+        r = await client.post(
+            "/ingest",
+            files={"file": (f"loadtest_{uuid.uuid4().hex[:8]}.txt", body, "text/plain")},
+            data={"visibility": "public"},
+        )
+        ok = r.status_code == 200
+        rec.samples.append(Sample(rec.stage, "/ingest", scenario, time.perf_counter() - t0, ok, error=None if ok else str(r.status_code)))
+    except Exception as e:
+        rec.samples.append(Sample(rec.stage, "/ingest", scenario, time.perf_counter() - t0, False, error=type(e).__name__))
+
+
+async def run_scenario(name: str, client, rec: Recorder, rnd: random.Random) -> None:
+    if name == "qa":
+        await _post_chat(client, rec, name, rnd.choice(QA_QUESTIONS), None)
+    elif name == "qa_stream":
+        await _post_stream(client, rec, name, rnd.choice(QA_QUESTIONS))
+    elif name == "multi_turn":
+        sid = await _post_chat(client, rec, name, rnd.choice(QA_QUESTIONS), None)
+        for text in rnd.sample(FOLLOWUPS, 2):
+            sid = await _post_chat(client, rec, name, text, sid)
+    elif name == "leave":
+        sid = f"lt-{uuid.uuid4().hex[:10]}"
+        for text in [rnd.choice(LEAVE_TEXTS), "确认", "查一下我的请假记录"]:
+            sid = await _post_chat(client, rec, name, text, sid)
+    elif name == "ingest":
+        await _post_ingest(client, rec, name)
+    else:
+        raise ValueError(f"unknown scenario: {name}")
+
+
+# ---------- 调度 ----------
+
+async def virtual_user(client, rec: Recorder, mix: dict[str, float], think_s: float, seed: int) -> None:
+    rnd = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    while True:
+        await run_scenario(rnd.choices(names, weights)[0], client, rec, rnd)
+        await asyncio.sleep(rnd.uniform(0, 2 * think_s))
+
+
+async def drive(base_url: str, mix: dict[str, float], stages: list[Stage], think_s: float, timeout_s: float) -> tuple[Recorder, list[dict]]:
+    import httpx
+
+    rec = Recorder()
+    max_users = max(s.users for s in stages)
+    limits = httpx.Limits(max_connections=max_users + 10, max_keepalive_connections=max_users + 10)
+    users: list[asyncio.Task] = []
+    windows = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout_s, limits=limits) as client:
+        try:
+            for i, stage in enumerate(stages):
+                rec.stage = i
+                while len(users) < stage.users:
+                    users.append(asyncio.create_task(virtual_user(client, rec, mix, think_s, seed=len(users))))
+                while len(users) > stage.users:
+                    users.pop().cancel()
+                t0 = time.perf_counter()
+                await asyncio.sleep(stage.seconds)
+                windows.append({"users": stage.users, "seconds": time.perf_counter() - t0})
+        finally:
+            for t in users:
+                t.cancel()
+            await asyncio.gather(*users, return_exceptions=True)
+    return rec, windows
+
+
+# ---------- 报告 ----------
+
+def _pct(xs: list[float], q: float) -> float | None:
+    if not xs:
+        return None
+    xs = sorted(xs)
+    return round(xs[min(len(xs) - 1, int(q * len(xs)))] * 1000, 1)
+
+
+def _summary(samples: list[Sample], seconds: float) -> dict:
+    lat = [s.latency for s in samples]
+    errors = [s for s in samples if not s.ok]
+    out = {
+        "requests": len(samples),
+        "rps": round(len(samples) / seconds, 2) if seconds else None,
+        "error_rate": round(len(errors) / len(samples), 4) if samples else 0.0,
+        "p50_ms": _pct(lat, 0.5),
+        "p90_ms": _pct(lat, 0.9),
+        "p95_ms": _pct(lat, 0.95),
+        "p99_ms": _pct(lat, 0.99),
+    }
+    ttft = [s.ttft for s in samples if s.ttft is not None]
+    if ttft:
+        out["ttft_p50_ms"], out["ttft_p95_ms"] = _pct(ttft, 0.5), _pct(ttft, 0.95)
+    if errors:
+        kinds = defaultdict(int)
+        for s in errors:
+            kinds[s.error or "unknown"] += 1
+        out["errors"] = dict(kinds)
+    return out
+
+
+def report(rec: Recorder, windows: list[dict], slo_ms: float, max_error_rate: float) -> dict:
+    stages = []
+    saturated_at = None
+    for i, w in enumerate(windows):
+        samples = [s for s in rec.samples if s.stage == i]
+        by_ep = defaultdict(list)
+        for s in samples:
+            by_ep[s.endpoint].append(s)
+        summary = _summary(samples, w["seconds"])
+        stages.append({
+            "users": w["users"],
+            **summary,
+            "endpoints": {ep: _summary(ss, w["seconds"]) for ep, ss in sorted(by_ep.items())},
+        })
+        bad = (summary["p95_ms"] or 0) > slo_ms or summary["error_rate"] > max_error_rate
+        if bad and saturated_at is None:
+            saturated_at = w["users"]
+    return {"stages": stages, "slo_p95_ms": slo_ms, "saturated_at_users": saturated_at}
+
+
+# ---------- serve ----------
+
+def serve(args) -> None:
+    import uvicorn
+
+    from bench.standins import install
+
+    install(
+        llm_latency_ms=args.llm_latency_ms,
+        token_delay_ms=args.token_delay_ms,
+        embed_latency_ms=args.embed_latency_ms,
+        db_latency_ms=args.db_latency_ms,
+    )
+    from app.main import app
+
+    uvicorn.run(app, host=args.host, port=args.port, workers=1, log_level="warning")
+
+
+def _spawn_server(args) -> subprocess.Popen:
+    import httpx
+
+    cmd = [
+        sys.executable, "-m", "bench.loadtest", "serve", "--port", str(args.port),
+        "--llm-latency-ms", str(args.llm_latency_ms), "--token-delay-ms", str(args.token_delay_ms),
+        "--embed-latency-ms", str(args.embed_latency_ms), "--db-latency-ms", str(args.db_latency_ms),
+    ]
+    proc = subprocess.Popen(cmd)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{args.port}/healthz", timeout=1).status_code == 200:
+                return proc
+        except Exception:
+            pass
+        if proc.poll() is not None:
+            raise SystemExit("loadtest server exited during startup")
+        time.sleep(0.3)
+    proc.terminate()
+    raise SystemExit("loadtest server did not become healthy in 60s")
+
+
+def run(args) -> dict:
+    mix = MIXES[args.mix]
+    stages = parse_ramp(args.ramp)
+    proc = _spawn_server(args) if args.spawn_server else None
+    base_url = args.base_url or f"http://127.0.0.1:{args.port}"
+    try:
+        rec, windows = asyncio.run(drive(base_url, mix, stages, args.think_ms / 1000, args.timeout_s))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+    return {"mix": args.mix, "base_url": base_url, **report(rec, windows, args.slo_ms, args.max_error_rate)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    def _standin_args(p):
+        p.add_argument("--port", type=int, default=8099)
+        p.add_argument("--llm-latency-ms", type=float, default=300)
+        p.add_argument("--token-delay-ms", type=float, default=10)
+        p.add_argument("--embed-latency-ms", type=float, default=20)
+        p.add_argument("--db-latency-ms", type=float, default=2)
+
+    p_serve = sub.add_parser("serve")
+    p_serve.add_argument("--host", default="127.0.0.1")
+    _standin_args(p_serve)
+
+    p_run = sub.add_parser("run")
+    _standin_args(p_run)
+    p_run.add_argument("--base-url", default=None)
+    p_run.add_argument("--spawn-server", action="store_true")
+    p_run.add_argument("--mix", choices=sorted(MIXES), default="qa_heavy")
+    p_run.add_argument("--ramp", default="5x20s,20x20s,50x20s")
+    p_run.add_argument("--think-ms", type=float, default=500)
+    p_run.add_argument("--timeout-s", type=float, default=60)
+    p_run.add_argument("--slo-ms", type=float, default=3000)
+    p_run.add_argument("--max-error-rate", type=float, default=0.01)
+
+    args = ap.parse_args()
+    if args.cmd == "serve":
+        serve(args)
+    else:
+        print(json.dumps(run(args), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,527 @@
+# bench/standins.py
+# 压测用的本地替身：LLM、embedding、Chroma、Redis、MySQL 全部换成进程内实现，
+# 不连任何外部服务、不花钱，但保留各自的调用形状和（可配置的）延迟，
+# 这样压出来的是 app.main 这一个 worker 自己的并发上限（线程池、图调度、序列化、锁），而不是供应商的限流。
+#
+# 只给 bench/loadtest.py 用，不要在服务代码里 import。
+#
+#   LLM        StandinChatModel：真正的 langchain BaseChatModel，invoke / stream 都走回调，
+#              /chat/stream 能拿到逐 token 输出；按 system prompt 认出请假抽取 / 时间解析 / 问题改写 / 摘要，
+#              返回合法的 JSON 或文本
+#   embedding  StandinEmbeddings：字符 bigram 哈希到固定维度，确定性、同一段文字向量相同
+#   Chroma     StandinChromaClient：numpy 暴力 L2，支持 langchain_chroma 和 app/rag 用到的那部分 API
+#   Redis      StandinRedis：dict 实现的子集（字符串 / hash / set / zset / pipeline）
+#   MySQL      StandinLeaveDB：请假相关函数的内存实现，替换 app.db.mysql 里同名函数
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+# ---------- LLM ----------
+
+class StandinChatModel(BaseChatModel):
+    latency_ms: float = 300.0      # 首 token 之前的延迟
+    token_delay_ms: float = 10.0   # 之后每个 token 的间隔
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "standin"
+
+    def _reply(self, messages: list[BaseMessage]) -> str:
+        system = str(messages[0].content) if messages else ""
+        user = str(messages[-1].content) if messages else ""
+        if "时间解析器" in system or "请假助手" in system:
+            start = (datetime.now() + timedelta(days=3)).replace(hour=9, minute=0)
+            return json.dumps({
+                "leave_type": "annual",
+                "start_time": start.strftime("%Y-%m-%d %H:%M"),
+                "end_time": start.replace(hour=18).strftime("%Y-%m-%d %H:%M"),
+                "reason": "家里有事",
+            }, ensure_ascii=False)
+        if "问题改写器" in system:
+            m = re.search(r"追问：(.*)", user)
+            return (m.group(1).strip() if m else user) + "（请假制度）"
+        if "对话摘要器" in system:
+            return "用户在咨询请假制度的相关规定。"
+        return "根据制度，年假需要提前一个工作日在系统中提交申请，经直属上级审批后生效[1]。病假需提供医院证明[2]。"
+
+    def _tokens(self, text: str) -> list[str]:
+        return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+    def _generate(self, messages, stop=None, run_manager: CallbackManagerForLLMRun | None = None, **kwargs) -> ChatResult:
+        text = self._reply(messages)
+        time.sleep((self.latency_ms + self.token_delay_ms * len(self._tokens(text))) / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager: CallbackManagerForLLMRun | None = None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency_ms / 1000)
+        for tok in self._tokens(self._reply(messages)):
+            time.sleep(self.token_delay_ms / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=tok))
+            if run_manager:
+                run_manager.on_llm_new_token(tok, chunk=chunk)
+            yield chunk
+
+
+# ---------- embedding ----------
+
+class StandinEmbeddings(Embeddings):
+    def __init__(self, dim: int = 256, latency_ms: float = 20.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+
+    def _vec(self, text: str) -> list[float]:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for i in range(len(text) - 1):
+            h = int.from_bytes(hashlib.blake2b(text[i:i + 2].encode("utf-8"), digest_size=4).digest(), "little")
+            v[h % self.dim] += 1.0
+        n = float(np.linalg.norm(v))
+        return (v / n if n else v).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self.latency_ms / 1000)
+        return [self._vec(t) for t in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self.latency_ms / 1000)
+        return self._vec(text)
+
+
+# ---------- Chroma ----------
+
+def _match(meta: dict, where: dict | None) -> bool:
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(_match(meta, c) for c in cond):
+                return False
+        elif key == "$or":
+            if not any(_match(meta, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            for op, val in cond.items():
+                v = meta.get(key)
+                ok = {
+                    "$in": lambda: v in val, "$nin": lambda: v not in val,
+                    "$eq": lambda: v == val, "$ne": lambda: v != val,
+                }.get(op, lambda: False)()
+                if not ok:
+                    return False
+        elif meta.get(key) != cond:
+            return False
+    return True
+
+
+class StandinCollection:
+    def __init__(self, name: str, metadata: dict | None = None):
+        self.name = name
+        self.metadata = metadata
+        self.configuration = {}
+        self._rows: dict[str, tuple[np.ndarray, str, dict]] = {}
+        self._lock = threading.Lock()
+        self._matrix: tuple | None = None
+
+    def count(self) -> int:
+        return len(self._rows)
+
+    def upsert(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs):
+        with self._lock:
+            for i, id_ in enumerate(ids):
+                self._rows[id_] = (
+                    np.asarray(embeddings[i], dtype=np.float32),
+                    documents[i] if documents else "",
+                    dict(metadatas[i] or {}) if metadatas else {},
+                )
+            self._matrix = None
+
+    add = upsert
+
+    def _ids_where(self, ids=None, where=None) -> list[str]:
+        keys = ids if ids is not None else list(self._rows)
+        return [k for k in keys if k in self._rows and _match(self._rows[k][2], where)]
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None, **kwargs) -> dict:
+        include = include or ["documents", "metadatas"]
+        keys = self._ids_where(ids, where)
+        keys = keys[offset or 0:][:limit] if limit is not None else keys[offset or 0:]
+        return {
+            "ids": keys,
+            "documents": [self._rows[k][1] for k in keys] if "documents" in include else None,
+            "metadatas": [self._rows[k][2] for k in keys] if "metadatas" in include else None,
+            "embeddings": [self._rows[k][0].tolist() for k in keys] if "embeddings" in include else None,
+        }
+
+    def delete(self, ids=None, where=None, **kwargs):
+        with self._lock:
+            for k in self._ids_where(ids, where):
+                self._rows.pop(k, None)
+            self._matrix = None
+
+    def query(self, query_embeddings=None, n_results=4, where=None, include=None, **kwargs) -> dict:
+        with self._lock:
+            if self._matrix is None:
+                keys = list(self._rows)
+                mat = np.stack([self._rows[k][0] for k in keys]) if keys else np.zeros((0, 1), np.float32)
+                self._matrix = (keys, mat, [self._rows[k][1] for k in keys], [self._rows[k][2] for k in keys])
+            keys, mat, docs, metas = self._matrix  # 快照，查询期间并发写入不影响
+        out = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": None}
+        rows = np.asarray([i for i, m in enumerate(metas) if _match(m, where)], dtype=int)
+        for q in query_embeddings or []:
+            hits, dist = [], []
+            if len(rows):
+                d = ((mat[rows] - np.asarray(q, dtype=np.float32)) ** 2).sum(axis=1)
+                order = np.argsort(d)[:n_results]
+                hits, dist = [int(rows[i]) for i in order], [float(d[i]) for i in order]
+            out["ids"].append([keys[i] for i in hits])
+            out["documents"].append([docs[i] for i in hits])
+            out["metadatas"].append([metas[i] for i in hits])
+            out["distances"].append(dist)
+        return out
+
+
+class StandinChromaClient:
+    def __init__(self):
+        self._cols: dict[str, StandinCollection] = {}
+        self._lock = threading.Lock()
+
+    def heartbeat(self) -> int:
+        return time.time_ns()
+
+    def list_collections(self):
+        return list(self._cols.values())
+
+    def get_collection(self, name: str, **kwargs) -> StandinCollection:
+        if name not in self._cols:
+            raise ValueError(f"Collection {name} does not exist.")
+        return self._cols[name]
+
+    def get_or_create_collection(self, name: str, metadata: dict | None = None, **kwargs) -> StandinCollection:
+        with self._lock:
+            return self._cols.setdefault(name, StandinCollection(name, metadata))
+
+    create_collection = get_or_create_collection
+
+    def delete_collection(self, name: str) -> None:
+        self._cols.pop(name, None)
+
+
+# ---------- Redis ----------
+
+class StandinRedis:
+    """单进程内的 redis 子集，够 session / 记账 / 缓存 / 版本指针用。不做过期。"""
+
+    def __init__(self):
+        self._kv: dict[str, Any] = {}
+        self._lock = threading.RLock()
+
+    def ping(self) -> bool:
+        return True
+
+    def get(self, k):
+        return self._kv.get(k)
+
+    def set(self, k, v, ex=None, px=None, nx=False, **kwargs):
+        with self._lock:
+            if nx and k in self._kv:
+                return None
+            self._kv[k] = str(v)
+            return True
+
+    def setex(self, k, ttl, v):
+        return self.set(k, v)
+
+    def getset(self, k, v):
+        with self._lock:
+            old = self._kv.get(k)
+            self._kv[k] = str(v)
+            return old
+
+    def incr(self, k, n=1):
+        with self._lock:
+            self._kv[k] = str(int(self._kv.get(k) or 0) + n)
+            return int(self._kv[k])
+
+    def append(self, k, v):
+        with self._lock:
+            self._kv[k] = (self._kv.get(k) or "") + str(v)
+            return len(self._kv[k])
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._kv.pop(k, None) is not None for k in keys)
+
+    def expire(self, k, ttl):
+        return k in self._kv
+
+    def hincrby(self, k, field, n=1):
+        with self._lock:
+            h = self._kv.setdefault(k, {})
+            h[field] = int(h.get(field, 0)) + n
+            return h[field]
+
+    def hgetall(self, k):
+        return {f: str(v) for f, v in dict(self._kv.get(k) or {}).items()}
+
+    def sadd(self, k, *members):
+        with self._lock:
+            self._kv.setdefault(k, set()).update(members)
+
+    def smembers(self, k):
+        return set(self._kv.get(k) or set())
+
+    def zadd(self, k, mapping):
+        with self._lock:
+            self._kv.setdefault(k, {}).update(mapping)
+
+    def zrem(self, k, *members):
+        with self._lock:
+            for m in members:
+                (self._kv.get(k) or {}).pop(m, None)
+
+    def _zsorted(self, k):
+        return sorted(dict(self._kv.get(k) or {}).items(), key=lambda x: x[1])
+
+    def zrangebyscore(self, k, lo, hi):
+        lo = float("-inf") if lo == "-inf" else float(lo)
+        hi = float("inf") if hi == "+inf" else float(hi)
+        return [m for m, s in self._zsorted(k) if lo <= s <= hi]
+
+    def zrange(self, k, start, end, withscores=False):
+        items = self._zsorted(k)
+        items = items[start:] if end == -1 else items[start:end + 1]
+        return items if withscores else [m for m, _ in items]
+
+    def pipeline(self, transaction: bool = True):
+        return _StandinPipeline(self)
+
+
+class _StandinPipeline:
+    def __init__(self, r: StandinRedis):
+        self._r = r
+        self._ops: list = []
+
+    def __getattr__(self, name):
+        def _queue(*args, **kwargs):
+            self._ops.append((name, args, kwargs))
+            return self
+        return _queue
+
+    def execute(self):
+        ops, self._ops = self._ops, []
+        with self._r._lock:
+            return [getattr(self._r, n)(*a, **kw) for n, a, kw in ops]
+
+
+# ---------- MySQL（请假） ----------
+
+class StandinLeaveDB:
+    """app.db.mysql 里请假流程用到的函数的内存实现；每个调用睡 latency_ms 模拟一次往返。"""
+
+    def __init__(self, latency_ms: float = 2.0, balance: float = 10.0):
+        self.latency_ms = latency_ms
+        self.default_balance = balance
+        self._rows: dict[str, dict] = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _rt(self):
+        time.sleep(self.latency_ms / 1000)
+
+    def _balance(self, requester):
+        b = self.default_balance
+        return {"annual_days": b, "sick_days": b, "personal_days": b}
+
+    def _conflicts(self, requester, start, end, exclude=None):
+        return [
+            {k: r[k] for k in ("leave_id", "start_time", "end_time", "status")}
+            for r in self._rows.values()
+            if r["requester"] == requester and r["leave_id"] != exclude
+            and r["status"] in ("PENDING", "APPROVED")
+            and str(r["start_time"]) < end and str(r["end_time"]) > start
+        ][:10]
+
+    def get_balance_and_conflicts(self, requester, start_time, end_time, exclude_leave_id=None, limit=10):
+        self._rt()
+        conflicts = self._conflicts(requester, start_time, end_time, exclude_leave_id) if start_time and end_time else []
+        return self._balance(requester), conflicts
+
+    def insert_leave_request(self, req):
+        self._rt()
+        with self._lock:
+            self._seq += 1
+            self._rows[req["leave_id"]] = {
+                **{k: req.get(k) for k in ("leave_id", "requester", "leave_type", "start_time", "end_time", "duration_days", "reason")},
+                "id": self._seq, "status": "PENDING", "created_at": datetime.now(),
+            }
+        return req["leave_id"]
+
+    def get_leave_request(self, leave_id):
+        self._rt()
+        row = self._rows.get(leave_id)
+        return dict(row) if row else None
+
+    def _set_status(self, leave_id, status, reason=None):
+        self._rt()
+        with self._lock:
+            row = self._rows.get(leave_id)
+            if not row or row["status"] != "PENDING":
+                return False
+            row["status"] = status
+            if reason:
+                row["reason"] = reason
+            return True
+
+    def cancel_leave_request(self, leave_id):
+        return self._set_status(leave_id, "CANCELLED")
+
+    def approve_leave_request(self, leave_id, approver):
+        return self._set_status(leave_id, "APPROVED")
+
+    def reject_leave_request(self, leave_id, approver, reason=None):
+        return self._set_status(leave_id, "REJECTED", reason)
+
+    def get_leave_history_page(self, requester, cursor=None, limit=20):
+        self._rt()
+        rows = sorted((r for r in self._rows.values() if r["requester"] == requester), key=lambda r: -r["id"])
+        return [dict(r) for r in rows[:limit]], None
+
+    def get_pending_leave_requests(self, leave_type=None, start_from=None, start_to=None, cursor=None, limit=20):
+        self._rt()
+        rows = [r for r in self._rows.values() if r["status"] == "PENDING" and (not leave_type or r["leave_type"] == leave_type)]
+        rows.sort(key=lambda r: (str(r["start_time"]), r["id"]))
+        return [dict(r) for r in rows[:limit]], None
+
+    def modify_leave_request(self, leave_id, changes, validate):
+        self._rt()
+        with self._lock:
+            row = self._rows.get(leave_id)
+            if not row:
+                return {"ok": False, "step": "lock", "message": f"未找到编号为 {leave_id} 的请假申请。"}
+            if row["status"] != "PENDING":
+                return {"ok": False, "step": "status", "message": f"{leave_id} 不是待审批状态，无法修改（当前：{row['status']}）。"}
+            new_req = {k: row[k] for k in ("leave_type", "start_time", "end_time", "reason", "requester")}
+            new_req.update({k: v for k, v in changes.items() if v is not None})
+            missing, violations = validate(
+                new_req, self._balance(row["requester"]),
+                self._conflicts(row["requester"], new_req["start_time"], new_req["end_time"], leave_id),
+            )
+            if missing or violations:
+                return {"ok": False, "step": "validate", "message": "；".join(missing + violations)}
+            row.update({k: v for k, v in new_req.items() if v is not None})
+            return {"ok": True, "req": new_req}
+
+    def bulk_review_leave_requests(self, decision, approver, leave_ids=None, leave_type=None,
+                                   start_from=None, start_to=None, reason=None, max_items=1000):
+        self._rt()
+        if leave_ids:
+            ids = list(dict.fromkeys(leave_ids))[:max_items]
+        else:
+            ids = [r["leave_id"] for r in self._rows.values()
+                   if r["status"] == "PENDING" and (not leave_type or r["leave_type"] == leave_type)][:max_items]
+        out = {}
+        for lid in ids:
+            row = self._rows.get(lid)
+            if not row:
+                out[lid] = "not_found"
+            elif row["status"] != "PENDING":
+                out[lid] = f"not_pending:{row['status']}"
+            else:
+                row["status"] = decision
+                out[lid] = decision
+        return out
+
+
+LEAVE_DB_FUNCS = [
+    "get_balance_and_conflicts", "insert_leave_request", "get_leave_request", "cancel_leave_request",
+    "approve_leave_request", "reject_leave_request", "get_leave_history_page",
+    "get_pending_leave_requests", "modify_leave_request", "bulk_review_leave_requests",
+]
+
+
+# ---------- 装配 ----------
+
+def _replace_everywhere(original: Any, replacement: Any) -> None:
+    """把所有已加载的 app.* 模块里指向 original 的名字换成 replacement（覆盖 from x import y 的情况）。"""
+    for name, mod in list(sys.modules.items()):
+        if not (name == "app" or name.startswith("app.")) or mod is None:
+            continue
+        for attr, val in list(vars(mod).items()):
+            if val is original:
+                setattr(mod, attr, replacement)
+
+
+def install(
+    llm_latency_ms: float = 300.0,
+    token_delay_ms: float = 10.0,
+    embed_latency_ms: float = 20.0,
+    db_latency_ms: float = 2.0,
+    seed_docs: str | None = "data/docs",
+    workdir: str | None = None,
+) -> dict:
+    """把 app 的外部依赖换成替身，并把 seed_docs 下的文档建成当前激活的语料。返回替身对象。"""
+    import tempfile
+
+    from app.config import settings
+
+    workdir = workdir or tempfile.mkdtemp(prefix="kb-loadtest-")
+    settings.parent_store_path = f"{workdir}/parents.sqlite3"
+    settings.doc_summary_path = f"{workdir}/doc_summaries.sqlite3"
+    settings.dedup_refs_path = f"{workdir}/dedup_refs.sqlite3"
+    settings.llm_cache_enabled = False  # 缓存命中会让 LLM 延迟失真
+    settings.singleflight_redis = False  # 替身 redis 没有 pub/sub、也不过期，只在进程内合并
+
+    import app.db.mysql as mysql
+    import app.db.redis_session as redis_session
+    import app.depts as depts
+    import app.main  # 先把 app 的模块都加载进来，下面才能把引用全部换掉
+    import app.rag.vectorstore as vectorstore
+
+    llm = StandinChatModel(latency_ms=llm_latency_ms, token_delay_ms=token_delay_ms)
+    emb = StandinEmbeddings(latency_ms=embed_latency_ms)
+    redis = StandinRedis()
+    chroma = StandinChromaClient()
+    db = StandinLeaveDB(latency_ms=db_latency_ms)
+
+    app.main.DATA_DOCS_DIR = Path(workdir) / "docs"  # 压测上传的文件别落到真实的 data/docs 里
+    app.main.DATA_DOCS_DIR.mkdir(parents=True, exist_ok=True)
+    redis_session._client = redis
+    vectorstore._client = chroma
+    _replace_everywhere(depts.get_llm, lambda: llm)
+    _replace_everywhere(depts.get_embeddings, lambda: emb)
+    for fn in LEAVE_DB_FUNCS:
+        _replace_everywhere(getattr(mysql, fn), getattr(db, fn))
+
+    if seed_docs:
+        from app.ingestion.loader import load_docs, split_docs
+        from app.rag.doc_summary import index_documents as index_summaries
+        from app.rag.parent_store import store_parents_for
+
+        name = vectorstore.new_collection_name()
+        raw = load_docs(seed_docs)
+        chunks = split_docs(raw)
+        for c in chunks:
+            c.metadata.setdefault("visibility", "public")
+            c.metadata.setdefault("doc_id", "seed-" + hashlib.sha1(str(c.metadata.get("source")).encode()).hexdigest()[:8])
+        vectorstore.add_documents_routed(emb, chunks, base=name)
+        store_parents_for(raw, chunks)
+        index_summaries(raw, chunks, emb)
+        vectorstore.activate_collection(name)
+    return {"llm": llm, "embeddings": emb, "redis": redis, "chroma": chroma, "db": db, "workdir": workdir}